@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+BM25打分引擎基准测试
+使用Zipf分布的合成语料（直接生成词项id，跳过jieba分词），对比SparseBM25与rank_bm25.BM25Okapi
+在不同文档规模下的单次查询延迟
+
+用法:
+    python -m benchmarks.bm25_benchmark --sizes 10000 100000 1000000 --queries 200
+    python -m benchmarks.bm25_benchmark --sizes 10000 --baseline   # 同时测试rank_bm25
+"""
+import argparse
+import time
+
+import numpy as np
+
+from milvus.bm25_engine import SparseBM25
+
+
+def generate_corpus(num_docs, vocab_size, avg_doc_len, rng):
+    """生成合成语料：每个文档的(去重词项id, 词频)"""
+    doc_lens = np.maximum(1, rng.poisson(avg_doc_len, size=num_docs))
+    tokens = ((rng.zipf(1.2, size=int(doc_lens.sum())) - 1) % vocab_size).astype(np.int32)
+    doc_term_ids, doc_term_freqs = [], []
+    offset = 0
+    for length in doc_lens:
+        term_ids, freqs = np.unique(tokens[offset:offset + length], return_counts=True)
+        doc_term_ids.append(term_ids.astype(np.int32))
+        doc_term_freqs.append(freqs.astype(np.int32))
+        offset += length
+    return doc_term_ids, doc_term_freqs, tokens, doc_lens
+
+
+def generate_queries(num_queries, vocab_size, rng, terms_per_query=6):
+    """生成查询：从中频词区间采样，贴近真实问句的词项分布"""
+    return [rng.integers(10, min(vocab_size, 20000), size=terms_per_query).tolist() for _ in range(num_queries)]
+
+
+def percentile_ms(latencies, p):
+    return float(np.percentile(latencies, p) * 1000)
+
+
+def bench_sparse(doc_term_ids, doc_term_freqs, vocab_size, queries, top_k):
+    start = time.perf_counter()
+    engine = SparseBM25(doc_term_ids, doc_term_freqs, vocab_size)
+    build_s = time.perf_counter() - start
+
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        engine.top_k(q, top_k)
+        latencies.append(time.perf_counter() - start)
+    return build_s, latencies
+
+
+def bench_rank_bm25(tokens, doc_lens, queries, top_k):
+    from rank_bm25 import BM25Okapi
+
+    corpus = []
+    offset = 0
+    for length in doc_lens:
+        corpus.append(tokens[offset:offset + length].tolist())
+        offset += length
+
+    start = time.perf_counter()
+    bm25 = BM25Okapi(corpus)
+    build_s = time.perf_counter() - start
+
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        scores = bm25.get_scores(q)
+        sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        latencies.append(time.perf_counter() - start)
+    return build_s, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BM25打分引擎基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='文档数量')
+    parser.add_argument('--queries', type=int, default=200, help='每个规模的查询次数')
+    parser.add_argument('--vocab-size', type=int, default=200000, help='词表大小')
+    parser.add_argument('--avg-doc-len', type=int, default=120, help='平均文档长度（词数）')
+    parser.add_argument('--top-k', type=int, default=25, help='top-k（默认对应limit=5时的limit*5）')
+    parser.add_argument('--baseline', action='store_true', help='同时测试rank_bm25（大规模时非常慢）')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'engine':<12}{'docs':>10}{'build(s)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for num_docs in args.sizes:
+        doc_term_ids, doc_term_freqs, tokens, doc_lens = generate_corpus(
+            num_docs, args.vocab_size, args.avg_doc_len, rng)
+        queries = generate_queries(args.queries, args.vocab_size, rng)
+
+        results = []
+        if args.baseline:
+            results.append(('rank_bm25', bench_rank_bm25(tokens, doc_lens, queries, args.top_k)))
+        del tokens
+        results.insert(0, ('sparse', bench_sparse(doc_term_ids, doc_term_freqs, args.vocab_size, queries, args.top_k)))
+
+        for name, (build_s, latencies) in results:
+            print(f"{name:<12}{num_docs:>10}{build_s:>10.2f}{percentile_ms(latencies, 50):>10.2f}"
+                  f"{percentile_ms(latencies, 95):>10.2f}{percentile_ms(latencies, 99):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
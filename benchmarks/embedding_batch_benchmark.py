@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+查询向量动态批处理基准测试
+模拟多个Flask线程并发计算单条查询向量，对比各线程直接调用模型与经EmbeddingBatcher合并计算的
+吞吐（embeddings/s）和p50/p95/p99延迟
+
+用法:
+    python -m benchmarks.embedding_batch_benchmark --model-name BAAI/bge-large-zh-v1.5 --threads 1 8 16
+    python -m benchmarks.embedding_batch_benchmark --max-batch-size 16 --max-wait-ms 5
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from embedding.batcher import EmbeddingBatcher
+
+SAMPLE_QUERIES = ['如何申请年假', '报销流程需要哪些材料', '新员工入职培训安排', '公司的考勤制度是什么',
+                  '出差住宿标准', '如何修改个人信息', '绩效考核的周期', '办公用品在哪里领取']
+
+
+def run(embed_one, num_threads, queries_per_thread):
+    """num_threads个线程各自顺序计算queries_per_thread条查询，返回单次延迟列表和总耗时"""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(thread_idx):
+        local = []
+        for i in range(queries_per_thread):
+            query = f"{SAMPLE_QUERIES[(thread_idx + i) % len(SAMPLE_QUERIES)]}{i}"
+            start = time.perf_counter()
+            embed_one(query)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查询向量动态批处理基准测试')
+    parser.add_argument('--model-name', default='BAAI/bge-large-zh-v1.5', help='模型名称或本地路径')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8, 16], help='并发线程数')
+    parser.add_argument('--queries-per-thread', type=int, default=20)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=2)
+    args = parser.parse_args()
+
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+    model = HuggingFaceBgeEmbeddings(model_name=args.model_name, model_kwargs={'device': args.device},
+                                     encode_kwargs={'normalize_embeddings': True})
+    batcher = EmbeddingBatcher(model.embed_documents, max_batch_size=args.max_batch_size,
+                               max_wait_ms=args.max_wait_ms)
+    # 预热
+    model.embed_documents(SAMPLE_QUERIES)
+
+    print(f"{'mode':<10}{'threads':>8}{'emb/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for num_threads in args.threads:
+        for mode, embed_one in (('direct', lambda q: model.embed_documents([q])),
+                                ('batched', batcher.embed_query)):
+            latencies, wall_s = run(embed_one, num_threads, args.queries_per_thread)
+            ms = np.asarray(latencies) * 1000
+            print(f"{mode:<10}{num_threads:>8}{len(latencies) / wall_s:>10.1f}{np.percentile(ms, 50):>10.1f}"
+                  f"{np.percentile(ms, 95):>10.1f}{np.percentile(ms, 99):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
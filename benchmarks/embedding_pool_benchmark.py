@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+嵌入计算多进程工作池基准测试
+对比单进程（全部CPU线程）与多进程工作池（每进程固定线程数）批量计算文档块向量的吞吐（chunks/s），
+两种方式使用相同的长度分桶批次，并检查向量结果一致
+
+用法:
+    python -m benchmarks.embedding_pool_benchmark --texts-file chunks.txt --workers 2 4 8
+    python -m benchmarks.embedding_pool_benchmark --num-texts 2048 --workers 4 --threads-per-worker 8
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from embedding.bucketing import embed_bucketed
+from embedding.model_loader import create_embedding_model
+from embedding.worker_pool import EmbeddingWorkerPool, embed_in_worker
+
+SAMPLE_SENTENCES = ['新员工入职培训安排在每月第一周，由人力资源部统一组织。', '出差住宿标准按照城市等级划分。',
+                    '绩效考核的周期为每季度一次，年终进行综合评定。', '会议室预约需要提前一天在OA系统中提交申请。',
+                    '报销需提供发票原件、审批单以及相关证明材料。', '办公用品统一在行政部领取，每月限领一次。']
+
+
+def synthetic_texts(num_texts, seed=0):
+    """生成长度不一的文档块（1~20句）"""
+    rng = random.Random(seed)
+    return [''.join(rng.choice(SAMPLE_SENTENCES) for _ in range(rng.randint(1, 20))) for _ in range(num_texts)]
+
+
+def load_texts(path, limit):
+    with open(path, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return texts[:limit]
+
+
+def measure(texts, embed_fn, map_fn, batch_size, max_batch_tokens):
+    start = time.perf_counter()
+    embeddings = embed_bucketed(texts, embed_fn, batch_size=batch_size, max_batch_tokens=max_batch_tokens, map_fn=map_fn)
+    elapsed = time.perf_counter() - start
+    return np.asarray(embeddings, dtype=np.float32), len(texts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='嵌入计算多进程工作池基准测试')
+    parser.add_argument('--config', default='config/config.json', help='服务配置文件（读取嵌入模型配置）')
+    parser.add_argument('--texts-file', help='每行一个文档块，不指定时生成合成文本')
+    parser.add_argument('--num-texts', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-batch-tokens', type=int, default=16384)
+    parser.add_argument('--workers', type=int, nargs='+', default=[4], help='工作进程数，可传多个依次测试')
+    parser.add_argument('--threads-per-worker', type=int, default=0, help='每进程torch线程数，0为按CPU核数平均分配')
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    texts = load_texts(args.texts_file, args.num_texts) if args.texts_file else synthetic_texts(args.num_texts)
+
+    model = create_embedding_model(config, 'cpu')
+    model.embed_documents(texts[:2])
+    reference, single_cps = measure(texts, model.embed_documents, map, args.batch_size, args.max_batch_tokens)
+
+    print(f"{'mode':<28}{'chunks/s':>10}{'speedup':>9}{'min_cos':>9}")
+    print(f"{'single-process':<28}{single_cps:>10.1f}{1.0:>9.2f}{1.0:>9.4f}")
+    for num_workers in args.workers:
+        pool = EmbeddingWorkerPool(config, num_workers=num_workers, threads_per_worker=args.threads_per_worker)
+        # 预热：启动全部工作进程并加载模型，不计入吞吐
+        pool.map(embed_in_worker, [texts[:2]] * num_workers)
+        embeddings, cps = measure(texts, embed_in_worker, pool.map, args.batch_size, args.max_batch_tokens)
+        pool.close()
+        min_cos = float(np.min(np.sum(reference * embeddings, axis=1)))
+        label = f"pool {num_workers}x{pool.threads_per_worker} threads"
+        print(f"{label:<28}{cps:>10.1f}{cps / single_cps:>9.2f}{min_cos:>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+ONNX嵌入后端一致性检查与吞吐基准测试
+以torch后端（HuggingFaceBgeEmbeddings）的向量为基准，统计ONNX（fp32/int8）后端向量的余弦相似度，
+以及在同一语料上检索top-k结果的重合率；并对比各后端的吞吐（texts/s）。
+最小余弦相似度低于--min-cosine时以非0状态码退出，可作为导出/量化后的上线检查。
+--self-check不需要模型和onnxruntime，用桩tokenizer/session检查OnnxBgeEmbeddings的CLS池化、归一化、分批和查询指令逻辑
+
+用法:
+    python -m benchmarks.onnx_embedding_benchmark --self-check
+    python -m benchmarks.onnx_embedding_benchmark --model-path /workspace/embeddings/bge-large-zh-v1.5 \
+        --onnx /workspace/embeddings/bge-large-zh-v1.5/onnx/model.onnx \
+               /workspace/embeddings/bge-large-zh-v1.5/onnx/model_int8.onnx
+    python -m benchmarks.onnx_embedding_benchmark --model-path ... --onnx ... --texts-file chunks.txt --threads 4
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from embedding.onnx_backend import OnnxBgeEmbeddings
+
+SAMPLE_TEXTS = ['如何申请年假', '报销流程需要哪些材料', '新员工入职培训安排在每月第一周，由人力资源部统一组织',
+                '公司的考勤制度是什么', '出差住宿标准按照城市等级划分，一线城市每晚不超过500元',
+                '如何修改个人信息', '绩效考核的周期为每季度一次，年终进行综合评定', '办公用品在哪里领取',
+                'The VPN client must be updated before connecting to the internal network.',
+                '会议室预约需要提前一天在OA系统中提交申请，并注明参会人数和设备需求']
+
+
+def load_texts(path, limit):
+    with open(path, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return texts[:limit]
+
+
+def measure(model, texts, batch_size, repeat):
+    """返回向量和吞吐（texts/s）"""
+    embeddings = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        embeddings = []
+        for offset in range(0, len(texts), batch_size):
+            embeddings.extend(model.embed_documents(texts[offset:offset + batch_size]))
+    elapsed = time.perf_counter() - start
+    return np.asarray(embeddings, dtype=np.float32), len(texts) * repeat / elapsed
+
+
+def top_k_overlap(reference, candidate, k):
+    """把每条文本作为查询在全部文本中检索top-k，统计两组向量检索结果的平均重合率"""
+    k = min(k, len(reference))
+    ref_top = np.argsort(-(reference @ reference.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(candidate @ candidate.T), axis=1)[:, :k]
+    return float(np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)]))
+
+
+class _StubTokenizer:
+    """桩tokenizer：每个字符一个token（id为字符编码），右侧padding，额外返回session不接受的token_type_ids"""
+
+    def __call__(self, texts, padding, truncation, max_length, return_tensors):
+        ids = [[ord(c) for c in t][:max_length] or [0] for t in texts]
+        width = max(len(i) for i in ids)
+        input_ids = np.zeros((len(ids), width), dtype=np.int32)
+        attention_mask = np.zeros((len(ids), width), dtype=np.int32)
+        for row, token_ids in enumerate(ids):
+            input_ids[row, :len(token_ids)] = token_ids
+            attention_mask[row, :len(token_ids)] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask, 'token_type_ids': np.zeros_like(input_ids)}
+
+
+class _StubInput:
+    def __init__(self, name):
+        self.name = name
+
+
+class _StubSession:
+    """桩session：[CLS]位置输出由第一个token决定的向量（未归一化），其余位置为干扰值，记录每次调用的输入"""
+
+    DIM = 8
+
+    def __init__(self):
+        self.calls = []
+
+    def get_inputs(self):
+        return [_StubInput('input_ids'), _StubInput('attention_mask')]
+
+    def run(self, output_names, inputs):
+        self.calls.append(inputs)
+        input_ids = inputs['input_ids']
+        hidden = np.full(input_ids.shape + (self.DIM,), 100.0, dtype=np.float32)
+        hidden[:, 0] = _stub_cls_vector(input_ids[:, 0])
+        return [hidden]
+
+
+def _stub_cls_vector(first_token_ids):
+    return (np.arange(1, _StubSession.DIM + 1, dtype=np.float32)[None, :] * (np.asarray(first_token_ids)[:, None] % 7 + 1))
+
+
+def self_check():
+    """用桩tokenizer/session检查OnnxBgeEmbeddings的池化、归一化、分批、输入过滤和查询指令逻辑，不需要模型"""
+    model = OnnxBgeEmbeddings.__new__(OnnxBgeEmbeddings)
+    model.model_name = 'stub#onnx:stub.onnx'
+    model.normalize_embeddings = True
+    model.batch_size = 3
+    model.max_length = 16
+    model.query_instruction = '指令:'
+    model.tokenizer = _StubTokenizer()
+    model.session = _StubSession()
+    model._input_names = {i.name for i in model.session.get_inputs()}
+
+    texts = ['a', 'bb\nb', 'c', 'dddd', 'e', 'f', 'g']
+    embeddings = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    expected = _stub_cls_vector([ord(t[0]) for t in texts])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    checks = {
+        '按batch_size分批': [len(c['input_ids']) for c in model.session.calls] == [3, 3, 1],
+        '只传入session接受的输入且为int64': all(set(c) == {'input_ids', 'attention_mask'}
+                                        and all(v.dtype == np.int64 for v in c.values()) for c in model.session.calls),
+        '换行替换为空格': not any(10 in c['input_ids'] for c in model.session.calls),
+        'CLS池化且保持顺序': np.allclose(embeddings, expected, atol=1e-6),
+        'L2归一化': np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-6),
+    }
+    model.session.calls.clear()
+    query_embedding = np.asarray(model.embed_query('a'), dtype=np.float32)
+    query_ids = model.session.calls[0]['input_ids'][0]
+    checks['查询加指令前缀'] = ''.join(chr(i) for i in query_ids if i) == '指令:a'
+    checks['查询向量为CLS池化'] = np.allclose(query_embedding, _stub_cls_vector([ord('指')])[0]
+                                       / np.linalg.norm(_stub_cls_vector([ord('指')])[0]), atol=1e-6)
+    model.normalize_embeddings = False
+    checks['不归一化时保留原始向量'] = np.allclose(model.embed_documents(['a'])[0], _stub_cls_vector([ord('a')])[0])
+
+    for name, ok in checks.items():
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ONNX嵌入后端一致性检查与吞吐基准测试')
+    parser.add_argument('--self-check', action='store_true', help='只用桩session检查后端逻辑，不需要模型')
+    parser.add_argument('--model-path', help='原始模型目录')
+    parser.add_argument('--onnx', nargs='+', help='待检查的ONNX模型文件（可同时传fp32和int8）')
+    parser.add_argument('--texts-file', help='每行一条文本，不指定时使用内置样例')
+    parser.add_argument('--limit', type=int, default=512, help='最多使用的文本数')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3, help='吞吐测试重复次数')
+    parser.add_argument('--threads', type=int, default=0, help='torch与ONNX Runtime的计算线程数，0为默认')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--min-cosine', type=float, default=0.98, help='最小余弦相似度门限')
+    args = parser.parse_args()
+    if args.self_check:
+        sys.exit(0 if self_check() else 1)
+    if not args.model_path or not args.onnx:
+        parser.error('需要--model-path和--onnx（或使用--self-check）')
+
+    import torch
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    texts = load_texts(args.texts_file, args.limit) if args.texts_file else SAMPLE_TEXTS
+
+    torch_model = HuggingFaceBgeEmbeddings(model_name=args.model_path, model_kwargs={'device': 'cpu'},
+                                           encode_kwargs={'normalize_embeddings': True})
+    torch_model.embed_documents(texts[:2])
+    reference, torch_tps = measure(torch_model, texts, args.batch_size, args.repeat)
+
+    print(f"{'backend':<40}{'texts/s':>10}{'speedup':>9}{'min_cos':>9}{'mean_cos':>10}{'top-k':>8}")
+    print(f"{'torch':<40}{torch_tps:>10.1f}{1.0:>9.2f}{1.0:>9.4f}{1.0:>10.4f}{1.0:>8.3f}")
+
+    failed = False
+    for onnx_path in args.onnx:
+        model = OnnxBgeEmbeddings(args.model_path, onnx_path, batch_size=args.batch_size,
+                                  intra_op_threads=args.threads)
+        model.embed_documents(texts[:2])
+        embeddings, tps = measure(model, texts, args.batch_size, args.repeat)
+        cosines = np.sum(reference * embeddings, axis=1)
+        overlap = top_k_overlap(reference, embeddings, args.top_k)
+        print(f"{onnx_path[-40:]:<40}{tps:>10.1f}{tps / torch_tps:>9.2f}{cosines.min():>9.4f}"
+              f"{cosines.mean():>10.4f}{overlap:>8.3f}")
+        if cosines.min() < args.min_cosine:
+            failed = True
+            print(f"# {onnx_path}: 最小余弦相似度{cosines.min():.4f}低于门限{args.min_cosine}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+向量索引/检索参数的召回率与延迟基准测试
+把合成语料（或导出的语料）按真实的doc_collection_schema()写入独立的基准测试数据库，
+对每个索引方案及检索参数组合，通过search_from_collection分别执行纯向量检索和混合检索，
+以内存中的精确暴力检索（等价于FLAT）结果为基准，统计recall@k、p50/p95/p99延迟和QPS
+
+需要可访问的Milvus（本地standalone即可），基准测试collection写入--db-name指定的独立数据库；
+--oracle-only时只计算精确检索基准（可用--truth-file保存），不访问Milvus
+
+用法:
+    python -m benchmarks.search_benchmark --num-docs 100000 --profiles FLAT IVF_FLAT HNSW
+    python -m benchmarks.search_benchmark --profiles HNSW --sweep '{"HNSW": [{"ef": 32}, {"ef": 64}, {"ef": 128}]}'
+    python -m benchmarks.search_benchmark --corpus docs.jsonl --queries-file queries.jsonl --embedding model
+    python -m benchmarks.search_benchmark --num-docs 100000 --oracle-only --truth-file truth.json
+    python -m benchmarks.search_benchmark --profiles HNSW IVF_SQ8 --vector-dtype FLOAT16_VECTOR --modes vector
+
+语料JSONL每行: {"content": "...", "file_name": "...", "tenant_code": "...", "org_code": "..."}（后三项可选）
+查询JSONL每行: {"query": "...", "tenant_code": "..."}
+"""
+import argparse
+import copy
+import json
+import logging
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import jieba
+import numpy as np
+
+CHAR_POOL = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定'
+             '行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些'
+             '然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公')
+
+
+class SyntheticEmbeddings:
+    """确定性的合成嵌入：按jieba分词后每个词项对应一个固定随机向量，文本向量为词向量之和再归一化
+
+    与BM25使用相同的分词，词项重合度高的文本向量也相近，用于不加载真实模型时的基准测试
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self._token_vectors = {}
+
+    def _token_vector(self, token):
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode('utf-8')))
+            vector = self._token_vectors[token] = rng.standard_normal(self.dim).astype(np.float32)
+        return vector
+
+    def embed_documents(self, texts):
+        embeddings = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for token in jieba.cut(text):
+                vector += self._token_vector(token)
+            norm = np.linalg.norm(vector)
+            embeddings.append((vector / norm if norm > 0 else vector).tolist())
+        return embeddings
+
+
+def generate_corpus(num_docs, num_tenants, avg_doc_len, rng):
+    """生成合成语料：由两字词按Zipf分布组成的文档，按顺序分配给各租户"""
+    vocab = [a + b for a, b in zip(rng.choice(list(CHAR_POOL), 20000), rng.choice(list(CHAR_POOL), 20000))]
+    docs = []
+    for i in range(num_docs):
+        length = max(5, int(rng.poisson(avg_doc_len)))
+        words = [vocab[(w - 1) % len(vocab)] for w in rng.zipf(1.3, size=length)]
+        docs.append({'file_name': f'doc_{i}', 'content': ''.join(words), 'words': words,
+                     'tenant_code': f'tenant_{i % num_tenants}', 'org_code': ''})
+    return docs
+
+
+def load_corpus(path):
+    """读取导出的语料JSONL"""
+    docs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            docs.append({'file_name': item.get('file_name', f'doc_{i}'), 'content': item['content'],
+                         'tenant_code': item.get('tenant_code', ''), 'org_code': item.get('org_code', '')})
+    return docs
+
+
+def generate_queries(docs, num_queries, rng, words_per_query=8):
+    """从随机文档中截取连续片段作为查询，查询的租户与该文档相同"""
+    queries = []
+    for doc_idx in rng.integers(0, len(docs), size=num_queries):
+        doc = docs[doc_idx]
+        words = doc.get('words') or list(jieba.cut(doc['content']))
+        start = int(rng.integers(0, max(1, len(words) - words_per_query)))
+        queries.append({'query': ''.join(words[start:start + words_per_query]), 'tenant_code': doc['tenant_code']})
+    return queries
+
+
+def load_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def embed_in_batches(embedder, texts, batch_size=256):
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        embeddings.extend(embedder.embed_documents(texts[start:start + batch_size]))
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def exact_top_k(doc_embeddings, docs, query_embeddings, queries, top_k):
+    """内存中的精确暴力检索（与FLAT索引等价），按租户过滤，返回每个查询的file_name列表和单次耗时"""
+    tenant_rows = {}
+    for i, doc in enumerate(docs):
+        tenant_rows.setdefault(doc['tenant_code'], []).append(i)
+    tenant_rows = {t: np.asarray(rows) for t, rows in tenant_rows.items()}
+    rows_all = np.arange(len(docs))
+
+    truth, latencies = [], []
+    for query_embedding, query in zip(query_embeddings, queries):
+        start = time.perf_counter()
+        tenant_code = query.get('tenant_code')
+        rows = tenant_rows.get(tenant_code, rows_all) if tenant_code else rows_all
+        scores = doc_embeddings[rows] @ query_embedding
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        latencies.append(time.perf_counter() - start)
+        truth.append([docs[rows[i]]['file_name'] for i in top])
+    return truth, latencies
+
+
+def percentile_ms(latencies, p):
+    return float(np.percentile(latencies, p) * 1000)
+
+
+def load_collection(helper, name, docs, doc_embeddings, profile, batch_size=2000):
+    """按真实schema新建基准测试collection，写入语料并按指定索引方案建索引"""
+    from pymilvus import utility, Collection
+
+    alias = helper.milvus_manager.alias
+    if utility.has_collection(name, using=alias):
+        utility.drop_collection(name, using=alias)
+    helper.milvus_manager.invalidate(name)
+    schema = helper.doc_collection_schema()
+    collection = Collection(name, schema=schema, using=alias, **helper.collection_create_kwargs(schema))
+    vector_dtype = next(f.dtype for f in schema.fields if f.name == 'embedding')
+
+    start = time.perf_counter()
+    for offset in range(0, len(docs), batch_size):
+        rows = []
+        for doc, embedding in zip(docs[offset:offset + batch_size], doc_embeddings[offset:offset + batch_size]):
+            row = {'file_name': doc['file_name'], 'block_id': 0, 'content': doc['content'][:20000], 'source': '',
+                   'tenant_code': doc['tenant_code'], 'org_code': doc['org_code'],
+                   'embedding': helper.to_storage_vectors([embedding.tolist()], vector_dtype)[0], 'metadata': {}}
+            if not schema.auto_id:
+                row['id'] = helper.doc_primary_key(doc['tenant_code'], doc['org_code'], doc['file_name'], 0)
+            rows.append(row)
+        collection.insert(data=rows)
+    collection.flush()
+    helper.ensure_collection_indexes(collection, index_profile=profile)
+    collection.load()
+    print(f"# collection[{name}] 写入{len(docs)}条并建索引[{profile}]，耗时{time.perf_counter() - start:.1f}s")
+    return collection
+
+
+def run_queries(helper, queries, top_k, use_hybrid, concurrency):
+    """通过search_from_collection执行查询，返回每个查询的file_name列表、单次延迟和总耗时"""
+    def search(query):
+        start = time.perf_counter()
+        res = helper.search_from_collection(query.get('tenant_code', ''), '', 'DOC', [query['query']],
+                                            limit=top_k, use_hybrid=use_hybrid)
+        elapsed = time.perf_counter() - start
+        return [e.get('file_name') for e in res['entities'][0]], elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(search, queries))
+    wall_s = time.perf_counter() - start
+    return [r[0] for r in results], [r[1] for r in results], wall_s
+
+
+def recall_at_k(results, truth, top_k):
+    hits = sum(len(set(r[:top_k]) & set(t[:top_k])) for r, t in zip(results, truth))
+    total = sum(min(top_k, len(t)) for t in truth)
+    return hits / total if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='向量索引/检索参数的召回率与延迟基准测试')
+    parser.add_argument('--corpus', help='导出的语料JSONL，不指定时生成合成语料')
+    parser.add_argument('--queries-file', help='查询JSONL，不指定时从语料中截取')
+    parser.add_argument('--num-docs', type=int, default=20000, help='合成语料文档数')
+    parser.add_argument('--num-tenants', type=int, default=10, help='合成语料租户数')
+    parser.add_argument('--avg-doc-len', type=int, default=150, help='合成语料平均文档长度（词数）')
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--embedding', choices=['synthetic', 'model'], default='synthetic',
+                        help='synthetic: 合成嵌入；model: 使用服务配置的嵌入模型')
+    parser.add_argument('--profiles', nargs='+', help='测试的索引方案，默认测试配置中的全部方案')
+    parser.add_argument('--sweep', default='{}', help='各方案额外测试的检索参数，JSON: {"HNSW": [{"ef": 64}]}')
+    parser.add_argument('--modes', nargs='+', choices=['vector', 'hybrid'], default=['vector', 'hybrid'])
+    parser.add_argument('--concurrency', type=int, default=1, help='并发查询线程数（影响QPS）')
+    parser.add_argument('--db-name', default='vector_db_benchmark', help='基准测试使用的独立数据库')
+    parser.add_argument('--host', help='Milvus地址，默认使用配置文件')
+    parser.add_argument('--port', type=int, help='Milvus端口，默认使用配置文件')
+    parser.add_argument('--oracle-only', action='store_true', help='只计算精确检索基准，不访问Milvus')
+    parser.add_argument('--truth-file', help='保存精确检索基准结果的JSON文件')
+    parser.add_argument('--keep', action='store_true', help='测试结束后保留基准测试collection')
+    parser.add_argument('--vector-dtype', choices=['FLOAT_VECTOR', 'FLOAT16_VECTOR', 'INT8_VECTOR'],
+                        help='embedding字段存储类型，默认使用配置文件')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # 检索路径的每次调用都会输出info日志，基准测试时只保留警告
+    logging.getLogger('vector_db').setLevel(logging.WARNING)
+    jieba.setLogLevel(logging.WARNING)
+
+    rng = np.random.default_rng(args.seed)
+    docs = load_corpus(args.corpus) if args.corpus else generate_corpus(
+        args.num_docs, args.num_tenants, args.avg_doc_len, rng)
+    queries = load_queries(args.queries_file) if args.queries_file else generate_queries(docs, args.num_queries, rng)
+
+    if args.embedding == 'synthetic':
+        embedder = SyntheticEmbeddings()
+    else:
+        from milvus.miluvs_helper import embedding_model as embedder
+    start = time.perf_counter()
+    doc_embeddings = embed_in_batches(embedder, [d['content'] for d in docs])
+    query_embeddings = embed_in_batches(embedder, [q['query'] for q in queries])
+    print(f"# 语料{len(docs)}条，查询{len(queries)}条，嵌入耗时{time.perf_counter() - start:.1f}s")
+
+    truth, oracle_latencies = exact_top_k(doc_embeddings, docs, query_embeddings, queries, args.top_k)
+    if args.truth_file:
+        with open(args.truth_file, 'w', encoding='utf-8') as f:
+            json.dump({'queries': queries, 'truth': truth}, f, ensure_ascii=False)
+
+    header = f"{'profile':<10}{'search_params':<28}{'mode':<8}{'recall@k':>9}{'p50(ms)':>9}{'p95(ms)':>9}{'p99(ms)':>9}{'QPS':>9}"
+    print(header)
+    print(f"{'oracle':<10}{'exact':<28}{'vector':<8}{1.0:>9.3f}{percentile_ms(oracle_latencies, 50):>9.2f}"
+          f"{percentile_ms(oracle_latencies, 95):>9.2f}{percentile_ms(oracle_latencies, 99):>9.2f}"
+          f"{len(oracle_latencies) / sum(oracle_latencies):>9.1f}")
+    if args.oracle_only:
+        return
+
+    from milvus import miluvs_helper as helper
+    from milvus.connection_manager import MilvusConnectionManager
+    from milvus.index_profiles import get_index_profiles
+    # 导入时会重新初始化日志配置
+    logging.getLogger('vector_db').setLevel(logging.WARNING)
+
+    # 检索路径使用基准测试数据库和嵌入，collection名称按方案替换，其余逻辑与线上一致
+    helper.milvus_manager = MilvusConnectionManager(host=args.host or helper.config['milvus']['host'],
+                                                    port=args.port or helper.config['milvus']['port'],
+                                                    db_name=args.db_name, alias='benchmark')
+    helper.milvus_manager.ensure_database()
+    helper.milvus_manager.connect()
+    helper.embedding_model = embedder
+    # 查询向量缓存（可能带有磁盘层）中是线上模型的向量，基准测试的查询向量全部由embedder计算
+    helper.query_embedding_cache = None
+    # 测量的是Milvus检索本身，关闭检索结果缓存（否则预热和重复的方案/参数组合直接命中缓存）
+    helper.search_result_cache = None
+    helper.config = copy.deepcopy(helper.config)
+    if args.vector_dtype:
+        helper.config.setdefault('vector_storage', {})['dtype'] = args.vector_dtype
+    # 全精度重打分使用的向量存储放在临时目录，写入基准测试语料的向量
+    from embedding.chunk_store import ChunkEmbeddingStore
+    helper.chunk_embedding_store = ChunkEmbeddingStore(tempfile.mkdtemp(prefix='bench_chunks_'), dim=doc_embeddings.shape[1])
+    helper.chunk_embedding_store.put_many([helper.chunk_embedding_store.chunk_hash(d['content'][:20000]) for d in docs],
+                                          doc_embeddings)
+    profiles = get_index_profiles(helper.config)
+    sweep = json.loads(args.sweep)
+
+    for profile in args.profiles or list(profiles.keys()):
+        name = f"bench_doc_{profile.lower()}"
+        collection = load_collection(helper, name, docs, doc_embeddings, profile)
+        helper.config['name_convention']['global_collection_doc'] = name
+        # BM25索引按租户缓存，不区分collection，切换collection后全部失效
+        helper.bm25_store.invalidate()
+        search_params = profiles[profile]['search_params']
+        base_params = copy.deepcopy(search_params.get('params', {}))
+        param_sets = [base_params] + sweep.get(profile, [])
+
+        for params in param_sets:
+            search_params['params'] = params
+            # 检索参数缓存在collection元数据中，切换参数后重新计算
+            helper.milvus_manager.invalidate(name)
+            for mode in args.modes:
+                use_hybrid = mode == 'hybrid'
+                # 预热：建立连接、构建各租户的BM25索引
+                run_queries(helper, queries[:min(len(queries), args.num_tenants * 2)], args.top_k, use_hybrid, 1)
+                results, latencies, wall_s = run_queries(helper, queries, args.top_k, use_hybrid, args.concurrency)
+                print(f"{profile:<10}{json.dumps(params):<28}{mode:<8}{recall_at_k(results, truth, args.top_k):>9.3f}"
+                      f"{percentile_ms(latencies, 50):>9.2f}{percentile_ms(latencies, 95):>9.2f}"
+                      f"{percentile_ms(latencies, 99):>9.2f}{len(queries) / wall_s:>9.1f}")
+        search_params['params'] = base_params
+        if not args.keep:
+            collection.drop()
+    print("# hybrid的recall@k为与精确向量检索top-k的重合率，反映融合后结果相对纯向量结果的变化，并非相关性指标")
+
+
+if __name__ == '__main__':
+    main()
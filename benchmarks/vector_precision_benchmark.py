@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+低精度向量存储的内存与召回率基准测试
+在内存中模拟embedding字段的各存储方式（FLOAT_VECTOR、FLOAT16_VECTOR、INT8_VECTOR）以及IVF_SQ8索引的标量量化，
+以float32精确检索结果为基准，统计每个向量占用的字节数、直接在低精度向量上检索的recall@k，
+以及多取oversample倍候选后用全精度向量重打分的recall@k。不访问Milvus，ANN索引本身的召回损失可用search_benchmark测试
+
+用法:
+    python -m benchmarks.vector_precision_benchmark --num-docs 50000 --oversample 2 4 8
+    python -m benchmarks.vector_precision_benchmark --corpus docs.jsonl --queries-file queries.jsonl --embedding model
+"""
+import argparse
+import logging
+import time
+
+import jieba
+import numpy as np
+
+from benchmarks.search_benchmark import (SyntheticEmbeddings, generate_corpus, load_corpus, generate_queries, load_queries,
+                                         embed_in_batches)
+
+INT8_VECTOR_SCALE = 127
+
+
+def quantize(doc_embeddings, mode):
+    """返回(检索时使用的低精度向量还原值, 每个向量占用的字节数)"""
+    dim = doc_embeddings.shape[1]
+    if mode == 'FLOAT_VECTOR':
+        return doc_embeddings, dim * 4
+    if mode == 'FLOAT16_VECTOR':
+        return doc_embeddings.astype(np.float16).astype(np.float32), dim * 2
+    if mode == 'INT8_VECTOR':
+        # 与miluvs_helper.to_storage_vectors相同：按每个向量的最大绝对值缩放，余弦相似度与缩放无关
+        scale = INT8_VECTOR_SCALE / np.maximum(np.abs(doc_embeddings).max(axis=1, keepdims=True), 1e-12)
+        codes = np.clip(np.rint(doc_embeddings * scale), -127, 127)
+        return (codes / scale).astype(np.float32), dim
+    if mode == 'IVF_SQ8':
+        # 按维度的最小/最大值线性量化到uint8
+        low = doc_embeddings.min(axis=0)
+        step = np.maximum(doc_embeddings.max(axis=0) - low, 1e-12) / 255
+        codes = np.rint((doc_embeddings - low) / step)
+        return (codes * step + low).astype(np.float32), dim
+    raise ValueError(mode)
+
+
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall(results, truth):
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+
+def rescored_top_k(candidates, doc_embeddings, query_embeddings, k):
+    """对低精度检索的候选用全精度向量重新打分后取top-k"""
+    results = []
+    for query_candidates, query_embedding in zip(candidates, query_embeddings):
+        scores = doc_embeddings[query_candidates] @ query_embedding
+        results.append(query_candidates[np.argsort(-scores)[:k]])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='低精度向量存储的内存与召回率基准测试')
+    parser.add_argument('--corpus', help='导出的语料JSONL，不指定时生成合成语料')
+    parser.add_argument('--queries-file', help='查询JSONL，不指定时从语料中截取')
+    parser.add_argument('--num-docs', type=int, default=20000, help='合成语料文档数')
+    parser.add_argument('--avg-doc-len', type=int, default=150, help='合成语料平均文档长度（词数）')
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--oversample', type=int, nargs='+', default=[2, 4], help='重打分时候选数为top-k的倍数')
+    parser.add_argument('--modes', nargs='+', default=['FLOAT_VECTOR', 'FLOAT16_VECTOR', 'INT8_VECTOR', 'IVF_SQ8'])
+    parser.add_argument('--embedding', choices=['synthetic', 'model'], default='synthetic',
+                        help='synthetic为合成嵌入，model为配置的真实嵌入模型')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    jieba.setLogLevel(logging.WARNING)
+
+    rng = np.random.default_rng(args.seed)
+    docs = load_corpus(args.corpus) if args.corpus else generate_corpus(args.num_docs, 1, args.avg_doc_len, rng)
+    queries = load_queries(args.queries_file) if args.queries_file else generate_queries(docs, args.num_queries, rng)
+    if args.embedding == 'synthetic':
+        embedder = SyntheticEmbeddings()
+    else:
+        from milvus.miluvs_helper import embedding_model as embedder
+        logging.getLogger('vector_db').setLevel(logging.WARNING)
+    start = time.perf_counter()
+    doc_embeddings = embed_in_batches(embedder, [d['content'] for d in docs])
+    query_embeddings = embed_in_batches(embedder, [q['query'] for q in queries])
+    print(f"# 语料{len(docs)}条，查询{len(queries)}条，嵌入耗时{time.perf_counter() - start:.1f}s")
+
+    truth = top_k(query_embeddings @ doc_embeddings.T, args.top_k)
+    float_bytes = doc_embeddings.shape[1] * 4
+
+    header = f"{'mode':<16}{'bytes/vec':>10}{'total(MB)':>11}{'saved':>8}{'recall@k':>10}"
+    header += ''.join(f"{f'rescore x{m}':>13}" for m in args.oversample)
+    print(header)
+    for mode in args.modes:
+        stored, bytes_per_vector = quantize(doc_embeddings, mode)
+        scores = query_embeddings @ stored.T
+        line = (f"{mode:<16}{bytes_per_vector:>10}{bytes_per_vector * len(docs) / 2 ** 20:>11.1f}"
+                f"{1 - bytes_per_vector / float_bytes:>8.0%}{recall(top_k(scores, args.top_k), truth):>10.4f}")
+        for multiple in args.oversample:
+            candidates = top_k(scores, args.top_k * multiple)
+            line += f"{recall(rescored_top_k(candidates, doc_embeddings, query_embeddings, args.top_k), truth):>13.4f}"
+        print(line)
+    print("# bytes/vec只计算向量本身，不含索引结构开销；重打分的全精度向量保存在服务节点磁盘（chunk_embedding_store），不占Milvus内存")
+
+
+if __name__ == '__main__':
+    main()
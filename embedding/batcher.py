@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+查询向量的跨请求动态批处理模块
+并发请求的查询文本进入同一个队列，由单个工作线程合并为一次前向计算，
+避免多个Flask线程各自计算单条查询时争抢torch的计算线程
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger('vector_db')
+
+
+class EmbeddingBatcher:
+    """把并发的单条查询合并为批量调用embed_fn(texts)
+
+    工作线程取到第一条查询后最多再等待max_wait_ms收集后续查询，凑满max_batch_size条立即计算；
+    前一批计算期间到达的查询会在下一批中一并计算，因此max_wait_ms可以设置得很小
+    """
+
+    def __init__(self, embed_fn, max_batch_size=32, max_wait_ms=2):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, text):
+        """提交一条文本，返回其向量的Future"""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed_query(self, text):
+        """计算单条查询的向量（与其他线程的查询合并计算）"""
+        return self.submit(text).result()
+
+    def embed_documents(self, texts):
+        """计算多条查询的向量，与embed_fn的输入输出格式相同"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        """阻塞取出一批待计算的查询"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            try:
+                # 已排队的查询直接取出，否则最多等到deadline
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            start = time.time()
+            try:
+                embeddings = self.embed_fn(texts)
+            except Exception as e:
+                logger.error(f"批量计算查询向量失败，批大小{len(texts)}: {repr(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+            logger.debug(f"批量计算查询向量完成，批大小{len(texts)}，耗时{time.time() - start:.3f}s")
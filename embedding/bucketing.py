@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+批量入库时的文本长度分桶模块
+按长度排序后切分为有界的批次，同一批内文本长度相近，减少padding带来的无效计算；
+计算结果按原始顺序返回，入库时按窗口逐段计算和写入，控制峰值内存
+"""
+
+
+def bucketed_batches(lengths, batch_size=32, max_batch_tokens=None):
+    """按长度升序把下标切分为批次
+
+    每批最多batch_size条；指定max_batch_tokens时，批内最长文本长度 * 条数（即padding后的token数）不超过该值
+
+    Returns:
+        下标列表的列表
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        # 升序排列，加入i后批内最长文本就是i
+        if batch and (len(batch) >= batch_size
+                      or (max_batch_tokens and (len(batch) + 1) * lengths[i] > max_batch_tokens)):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def embed_bucketed(texts, embed_fn, batch_size=32, max_batch_tokens=None, length_fn=len, map_fn=map):
+    """按长度分桶调用embed_fn(批次文本)，返回与texts顺序一致的向量列表
+
+    map_fn(embed_fn, 批次列表)需按批次顺序返回结果，传入进程池的map即可并行计算各批次
+    """
+    embeddings = [None] * len(texts)
+    batches = bucketed_batches([length_fn(t) for t in texts], batch_size, max_batch_tokens)
+    for batch, batch_embeddings in zip(batches, map_fn(embed_fn, [[texts[i] for i in batch] for batch in batches])):
+        for i, embedding in zip(batch, batch_embeddings):
+            embeddings[i] = embedding
+    return embeddings
+
+
+def iter_windows(items, window_size):
+    """按窗口顺序切分items，入库时逐窗口计算向量并写入，向量不会全部驻留内存"""
+    for start in range(0, len(items), window_size):
+        yield items[start:start + window_size]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+文档块向量持久化存储模块
+以文档块内容的哈希为key保存其向量：向量按行追加到float32文件并通过内存映射读取，
+哈希到行号的索引保存在SQLite中。重新上传修改过的文档时只需为从未出现过的文档块计算向量
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+
+class ChunkEmbeddingStore:
+    """文档块内容哈希 -> 向量的持久化存储，同一台机器上的多个进程可共享同一目录
+
+    vectors.f32只追加不修改（追加时持有文件锁），index.sqlite记录哈希对应的行号；
+    namespace用于区分不同的嵌入模型，模型变更后不会误用旧向量
+    """
+
+    def __init__(self, directory, dim, namespace=''):
+        self.directory = directory
+        self.dim = dim
+        self.namespace = namespace
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, 'vectors.f32')
+        self._lock_path = os.path.join(directory, 'vectors.lock')
+        self._index_path = os.path.join(directory, 'index.sqlite')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._mmap = None
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, row INTEGER)')
+        conn.commit()
+        open(self._vectors_path, 'ab').close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._index_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def chunk_hash(self, text):
+        return hashlib.sha256(f"{self.namespace}\x1f{text}".encode('utf-8')).hexdigest()
+
+    def _rows_view(self, min_rows):
+        """返回至少包含min_rows行的向量内存映射，文件被其他进程追加后重新映射"""
+        with self._lock:
+            if self._mmap is None or len(self._mmap) < min_rows:
+                num_rows = os.path.getsize(self._vectors_path) // (self.dim * 4)
+                self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(num_rows, self.dim)) \
+                    if num_rows else np.zeros((0, self.dim), dtype=np.float32)
+            return self._mmap
+
+    def get_many(self, hashes):
+        """返回{hash: 向量}，只包含已存储的哈希"""
+        if not hashes:
+            return {}
+        rows = {}
+        conn = self._conn()
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), 500):
+            batch = unique_hashes[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            for chunk_hash, row in conn.execute(f'SELECT hash, row FROM chunks WHERE hash IN ({placeholders})', batch):
+                rows[chunk_hash] = row
+        if not rows:
+            return {}
+        view = self._rows_view(max(rows.values()) + 1)
+        return {chunk_hash: np.array(view[row]) for chunk_hash, row in rows.items()}
+
+    def put_many(self, hashes, vectors):
+        """追加保存向量，已存在的哈希不会重复保存"""
+        if not hashes:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(hashes), self.dim)
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                conn = self._conn()
+                existing = set(self.get_many(hashes).keys())
+                index_of = {h: i for i, h in enumerate(hashes)}
+                new_hashes = [h for h in index_of if h not in existing]
+                if not new_hashes:
+                    return
+                row_bytes = self.dim * 4
+                with open(self._vectors_path, 'r+b') as f:
+                    size = f.seek(0, os.SEEK_END)
+                    if size % row_bytes:
+                        # 上次追加中途失败留下的不完整行，丢弃后再追加
+                        size = f.truncate(size - size % row_bytes)
+                        f.seek(size)
+                    first_row = size // row_bytes
+                    f.write(np.ascontiguousarray(vectors[[index_of[h] for h in new_hashes]]).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                conn.executemany('INSERT OR IGNORE INTO chunks (hash, row) VALUES (?, ?)',
+                                 [(h, first_row + i) for i, h in enumerate(new_hashes)])
+                conn.commit()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def embed(self, texts, embed_fn):
+        """返回texts的向量，只对从未计算过的文档块调用embed_fn(文本列表)
+
+        Returns:
+            (向量列表, 实际计算的文档块数)
+        """
+        hashes = [self.chunk_hash(text) for text in texts]
+        stored = self.get_many(hashes)
+        missing = {}
+        for chunk_hash, text in zip(hashes, texts):
+            if chunk_hash not in stored and chunk_hash not in missing:
+                missing[chunk_hash] = text
+        if missing:
+            computed = embed_fn(list(missing.values()))
+            self.put_many(list(missing.keys()), computed)
+            stored.update(zip(missing.keys(), (np.asarray(v, dtype=np.float32) for v in computed)))
+        return [stored[chunk_hash] for chunk_hash in hashes], len(missing)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+嵌入模型加载模块
+按embedding_backend配置创建torch（HuggingFaceBgeEmbeddings）或onnx（ONNX Runtime）后端的嵌入模型，
+服务进程和嵌入工作进程使用同一套加载逻辑。
+模型从embedding_model_path本地目录加载（safetensors权重内存映射读取），服务进程中首次使用或预热时才加载
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('vector_db')
+
+# 本地模型目录不存在时使用的模型名（从HuggingFace Hub下载）
+FALLBACK_MODEL_NAME = 'BAAI/bge-large-zh-v1.5'
+
+
+def detect_device():
+    """检测CUDA是否可用"""
+    try:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        logger.info(f"检测到设备: {device}")
+    except ImportError:
+        device = 'cpu'
+        logger.warning("未安装torch，使用CPU设备")
+    return device
+
+
+def resolve_model_path(config):
+    """返回本地模型目录，目录不存在时回退为Hub上的模型名"""
+    model_path = config.get('embedding_model_path')
+    if model_path and os.path.isdir(model_path):
+        return model_path
+    logger.warning(f"嵌入模型目录不存在: {model_path}，使用 {FALLBACK_MODEL_NAME}")
+    return FALLBACK_MODEL_NAME
+
+
+def embedding_model_name(config):
+    """不加载模型，按配置得到模型名（与加载后模型的model_name一致），用作向量缓存的命名空间"""
+    embedding_backend_config = config.get('embedding_backend', {})
+    if embedding_backend_config.get('type', 'torch') == 'onnx':
+        return f"{config['embedding_model_path']}#onnx:{os.path.basename(embedding_backend_config['onnx_path'])}"
+    return resolve_model_path(config)
+
+
+def create_embedding_model(config, device=None):
+    """按配置创建嵌入模型，返回提供embed_documents/embed_query接口的对象"""
+    embedding_backend_config = config.get('embedding_backend', {})
+    if embedding_backend_config.get('type', 'torch') == 'onnx':
+        # ONNX Runtime后端，可使用int8量化模型，仅CPU
+        from embedding.onnx_backend import OnnxBgeEmbeddings
+        return OnnxBgeEmbeddings(
+            config['embedding_model_path'],
+            embedding_backend_config['onnx_path'],
+            normalize_embeddings=True,
+            batch_size=embedding_backend_config.get('batch_size', 32),
+            intra_op_threads=embedding_backend_config.get('intra_op_threads', 0)
+        )
+
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+    model_path = resolve_model_path(config)
+    model_kwargs = {'device': device or detect_device()}
+    if os.path.isdir(model_path):
+        # 只读本地目录，不访问Hub（目录中有safetensors权重时transformers默认以内存映射读取）
+        model_kwargs['local_files_only'] = True
+    return HuggingFaceBgeEmbeddings(
+        model_name=model_path,
+        model_kwargs=model_kwargs,
+        encode_kwargs={'normalize_embeddings': True}  # set True to compute cosine similarity
+    )
+
+
+class LazyEmbeddingModel:
+    """延迟加载的嵌入模型：导入时不加载，首次调用embed_*或显式load()时才加载，并发调用只加载一次"""
+
+    def __init__(self, config, device=None):
+        self.config = config
+        self.device = device
+        self.model_name = embedding_model_name(config)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """加载模型（已加载时直接返回）"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = create_embedding_model(self.config, self.device)
+                    logger.info(f"嵌入模型加载完成: {self.model_name}，耗时{time.perf_counter() - start:.2f}s")
+        return self._model
+
+    def embed_documents(self, texts):
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.load().embed_query(text)
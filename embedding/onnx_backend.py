@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+ONNX Runtime嵌入后端
+在CPU上使用导出的ONNX计算图运行bge模型（可选int8动态量化），
+提供与HuggingFaceBgeEmbeddings相同的embed_documents/embed_query接口（CLS池化 + L2归一化）
+
+导出（需要torch和onnxruntime）:
+    python -m embedding.onnx_backend --model-path /workspace/embeddings/bge-large-zh-v1.5 \
+        --output /workspace/embeddings/bge-large-zh-v1.5/onnx/model.onnx --quantize
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+# 与langchain中HuggingFaceBgeEmbeddings对中文bge模型使用的查询指令一致
+DEFAULT_QUERY_INSTRUCTION_ZH = '为这个句子生成表示以用于检索相关文章：'
+
+
+class OnnxBgeEmbeddings:
+    """基于ONNX Runtime的bge嵌入模型
+
+    Args:
+        model_path: 原始模型目录（读取tokenizer）
+        onnx_path: 导出的ONNX模型文件
+        normalize_embeddings: 是否L2归一化（与encode_kwargs的normalize_embeddings相同）
+        batch_size: 单次前向计算的最大文本数
+        max_length: 最大token数，超出部分截断
+        intra_op_threads: ONNX Runtime算子内线程数，0表示由ONNX Runtime决定
+    """
+
+    def __init__(self, model_path, onnx_path, normalize_embeddings=True, batch_size=32, max_length=512,
+                 intra_op_threads=0, query_instruction=DEFAULT_QUERY_INSTRUCTION_ZH):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("ONNX嵌入后端需要安装onnxruntime和transformers: pip install onnxruntime") from e
+
+        self.model_name = f"{model_path}#onnx:{os.path.basename(onnx_path)}"
+        self.normalize_embeddings = normalize_embeddings
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.query_instruction = query_instruction
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"ONNX嵌入模型加载完成: {onnx_path}")
+
+    def _encode(self, texts):
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors='np')
+        inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+        last_hidden_state = self.session.run(None, inputs)[0]
+        # bge使用[CLS]位置的输出作为句向量
+        embeddings = last_hidden_state[:, 0].astype(np.float32)
+        if self.normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+    def embed_documents(self, texts):
+        texts = [t.replace('\n', ' ') for t in texts]
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._encode(texts[start:start + self.batch_size]).tolist())
+        return embeddings
+
+    def embed_query(self, text):
+        return self._encode([self.query_instruction + text.replace('\n', ' ')])[0].tolist()
+
+
+def export_onnx(model_path, output_path, quantize=False, opset=17):
+    """把HuggingFace模型导出为ONNX（输出last_hidden_state），quantize为True时额外生成int8动态量化模型
+
+    Returns:
+        最终使用的ONNX模型路径（量化时为*_int8.onnx）
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path)
+    model.eval()
+
+    sample = tokenizer(['示例文本'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in input_names), output_path,
+                          input_names=input_names, output_names=['last_hidden_state'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    logger.info(f"ONNX模型导出完成: {output_path}")
+
+    if not quantize:
+        return output_path
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantized_path = output_path.replace('.onnx', '_int8.onnx')
+    quantize_dynamic(output_path, quantized_path, weight_type=QuantType.QInt8)
+    logger.info(f"int8动态量化模型生成完成: {quantized_path}")
+    return quantized_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出bge模型为ONNX（可选int8动态量化）')
+    parser.add_argument('--model-path', required=True, help='HuggingFace模型目录或名称')
+    parser.add_argument('--output', required=True, help='输出的ONNX文件路径')
+    parser.add_argument('--quantize', action='store_true', help='额外生成int8动态量化模型')
+    parser.add_argument('--opset', type=int, default=17)
+    args = parser.parse_args()
+    print(export_onnx(args.model_path, args.output, quantize=args.quantize, opset=args.opset))
+
+
+if __name__ == '__main__':
+    main()
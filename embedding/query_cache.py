@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+查询向量缓存模块
+以规范化后的查询文本为key，进程内LRU + TTL缓存float32查询向量，记录命中/未命中次数；
+可选的本地磁盘层（SQLite文件）供同一台机器上的多个gunicorn worker共享
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(text):
+    """查询文本规范化：全角转半角（NFKC）、去除首尾空白、合并连续空白、英文小写"""
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)).strip().lower()
+
+
+class SqliteVectorStore:
+    """基于SQLite文件的向量存储，多进程可同时读写（WAL模式）"""
+
+    def __init__(self, path, ttl_seconds=0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        path_dir = os.path.dirname(path)
+        if path_dir:
+            os.makedirs(path_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vector BLOB, created_at REAL)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT vector, created_at FROM vectors WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds and time.time() - row[1] > self.ttl_seconds:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, key, vector):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO vectors (key, vector, created_at) VALUES (?, ?, ?)',
+                     (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()))
+        conn.commit()
+
+
+class QueryEmbeddingCache:
+    """线程安全的查询向量缓存：进程内LRU + TTL，未命中时可回退到磁盘层
+
+    namespace用于区分不同的嵌入模型，模型变更后旧的磁盘缓存不会被误用
+    """
+
+    # 每查询多少次输出一次命中率统计
+    STATS_LOG_INTERVAL = 1000
+
+    def __init__(self, max_entries=10000, ttl_seconds=0, disk_path=None, namespace=''):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = SqliteVectorStore(disk_path, ttl_seconds)
+            except Exception as e:
+                logger.error(f"查询向量磁盘缓存[{disk_path}]不可用，只使用进程内缓存: {repr(e)}")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text):
+        return normalize_query(text)
+
+    def _disk_key(self, key):
+        return hashlib.sha1(f"{self.namespace}\x1f{key}".encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        """返回缓存的向量（float32数组），未命中返回None"""
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, created_at = entry
+                if not self.ttl_seconds or time.time() - created_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+        if self._disk is not None:
+            try:
+                vector = self._disk.get(self._disk_key(key))
+            except Exception as e:
+                logger.warning(f"读取查询向量磁盘缓存失败: {repr(e)}")
+                vector = None
+            if vector is not None:
+                self._put_memory(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_memory(self, key, vector):
+        with self._lock:
+            self._entries[key] = (vector, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, text, vector):
+        key = self._key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._put_memory(key, vector)
+        if self._disk is not None:
+            try:
+                self._disk.put(self._disk_key(key), vector)
+            except Exception as e:
+                logger.warning(f"写入查询向量磁盘缓存失败: {repr(e)}")
+
+    def embed(self, texts, embed_fn):
+        """返回texts的向量，只对未命中的文本调用embed_fn(未命中文本列表)计算（同一批中重复文本只计算一次）
+
+        规范化只用于缓存key：规范化后相同的多个文本，用其中第一个原始文本计算向量
+        """
+        vectors = [self.get(text) for text in texts]
+        # 规范化key -> 第一个产生该key的原始文本
+        missing = {}
+        for t, v in zip(texts, vectors):
+            if v is None:
+                missing.setdefault(self._key(t), t)
+        if missing:
+            computed = dict(zip(missing, embed_fn(list(missing.values()))))
+            for key, vector in computed.items():
+                self.put(key, vector)
+            vectors = [v if v is not None else np.asarray(computed[self._key(t)], dtype=np.float32)
+                       for t, v in zip(texts, vectors)]
+        stats = self.stats()
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        if lookups // self.STATS_LOG_INTERVAL != (lookups - len(texts)) // self.STATS_LOG_INTERVAL:
+            logger.info(f"查询向量缓存统计: {stats}")
+        return vectors
+
+    def stats(self):
+        """命中率统计"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
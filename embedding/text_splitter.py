@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+文档分块模块
+默认按字数切分（与原有行为一致）；split.mode为token时按嵌入模型的tokenizer计算长度，
+优先在段落、换行和中文句末标点处切分，使每个块都不超过模型的最大序列长度，避免超出部分在计算向量时被截断
+"""
+import logging
+import os
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger('vector_db')
+
+# 切分优先级：段落 > 换行 > 句末标点 > 分句标点 > 空格 > 单字
+CHINESE_SEPARATORS = ['\n\n', '\n', '。', '！', '？', '!', '?', '；', ';', '，', ',', ' ', '']
+
+
+def load_tokenizer(model_path):
+    """加载嵌入模型的tokenizer，本地目录不存在或未安装transformers时返回None"""
+    if not model_path or not os.path.isdir(model_path):
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+    except Exception as e:
+        logger.warning(f"加载tokenizer失败: {e}")
+        return None
+
+
+def create_text_splitter(config):
+    """按split配置创建文档分块器
+
+    mode为char（默认）时与原有分块完全一致：按字数切分，每块不超过chunk_size；
+    mode为token时按tokenizer的token数切分，每块不超过max_tokens（bge为512，去掉[CLS]/[SEP]后为510），
+    tokenizer不可用时按字数近似（bge中文基本一字一token）
+    """
+    split_config = config['split']
+    if split_config.get('mode', 'char') != 'token':
+        return RecursiveCharacterTextSplitter(chunk_size=split_config['chunk_size'], chunk_overlap=split_config['overlap'],
+                                              length_function=len, keep_separator=False)
+
+    common_kwargs = {'separators': CHINESE_SEPARATORS, 'keep_separator': 'end'}
+
+    max_tokens = split_config.get('max_tokens', 510)
+    overlap = min(split_config['overlap'], max_tokens // 4)
+    tokenizer = load_tokenizer(config.get('embedding_model_path'))
+    if tokenizer is None:
+        logger.warning(f"tokenizer不可用，文档分块按字数近似token数，每块不超过{max_tokens}字")
+        return RecursiveCharacterTextSplitter(chunk_size=max_tokens, chunk_overlap=overlap, length_function=len,
+                                              **common_kwargs)
+    logger.info(f"文档分块按token数切分，每块不超过{max_tokens}个token，重叠{overlap}个token")
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer, chunk_size=max_tokens, chunk_overlap=overlap, **common_kwargs)
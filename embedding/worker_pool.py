@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+嵌入计算多进程工作池
+批量入库时把分桶后的批次分发到多个工作进程并行计算向量，按提交顺序收集结果；
+每个工作进程只加载一次模型，并固定torch计算线程数，避免多个进程之间线程争抢CPU
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger('vector_db')
+
+# 工作进程内的模型，由_init_worker创建
+_worker_model = None
+
+
+def _init_worker(config, threads_per_worker):
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    from embedding.model_loader import create_embedding_model
+    _worker_model = create_embedding_model(config, 'cpu')
+    logger.info(f"嵌入工作进程{os.getpid()}模型加载完成，计算线程数: {threads_per_worker}")
+
+
+def embed_in_worker(texts):
+    """在工作进程内计算一批文本的向量，以float32数组返回，减少进程间传输的数据量"""
+    return np.asarray(_worker_model.embed_documents(texts), dtype=np.float32)
+
+
+class EmbeddingWorkerPool:
+    """嵌入计算进程池，首次使用时才启动工作进程
+
+    Args:
+        config: 服务配置，工作进程按embedding_backend等配置加载模型
+        num_workers: 工作进程数
+        threads_per_worker: 每个工作进程的torch计算线程数，0表示按CPU核数平均分配
+    """
+
+    def __init__(self, config, num_workers=4, threads_per_worker=0):
+        self.config = config
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 使用spawn启动，避免fork继承父进程已初始化的torch线程池和CUDA上下文
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.config, self.threads_per_worker)
+                )
+                logger.info(f"嵌入工作进程池启动，进程数: {self.num_workers}，每进程线程数: {self.threads_per_worker}")
+            return self._executor
+
+    def map(self, fn, batches):
+        """把批次分发到工作进程执行fn，按批次顺序返回结果"""
+        return list(self._get_executor().map(fn, batches))
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+服务预热与健康检查
+启动时并行执行预热步骤（嵌入模型首次前向计算、jieba词典加载、全局collection加载与BM25索引预建），
+/healthz 表示进程存活，/readyz 在全部预热步骤完成后才返回200，负载均衡据此决定是否转发流量
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, jsonify
+
+logger = logging.getLogger('vector_db')
+
+# 创建 Blueprint
+health_bp = Blueprint('health', __name__)
+
+
+def _warm_embedding():
+    from milvus.miluvs_helper import embedding_model
+    # 加载模型并完成一次前向计算
+    embedding_model.embed_documents(['预热'])
+
+
+def _warm_jieba():
+    import jieba
+    jieba.initialize()
+
+
+def _warm_milvus(bm25_scopes):
+    from milvus.miluvs_helper import load_global_collections, preload_bm25_index, use_milvus_bm25
+    loaded = load_global_collections()
+    logger.info(f"预热：已加载collection {loaded}")
+    if use_milvus_bm25():
+        return
+    # Python BM25模式下预建常用检索范围的常驻BM25索引，需在collection加载后执行
+    for scope in bm25_scopes:
+        collection_type, tenant_code, org_code = (list(scope) + ['', ''])[:3]
+        num_docs = preload_bm25_index(collection_type, tenant_code, org_code)
+        if num_docs is not None:
+            logger.info(f"预热：BM25索引[{collection_type}, {tenant_code}, {org_code}]构建完成，共{num_docs}个文档")
+
+
+class WarmupState:
+    """预热步骤及其状态，失败的步骤按retry_interval_seconds重试，全部成功后进程就绪"""
+
+    def __init__(self, config):
+        warmup_config = config.get('warmup', {})
+        self.enabled = warmup_config.get('enabled', True)
+        self.retry_interval_seconds = warmup_config.get('retry_interval_seconds', 10)
+        self.steps = {
+            'embedding': _warm_embedding,
+            'jieba': _warm_jieba,
+            'milvus': lambda: _warm_milvus(warmup_config.get('bm25_scopes', [])),
+        }
+        # 步骤名 -> {'status': pending/running/success/fail, 'elapsed': 秒, 'error': 错误信息}
+        self.status = {name: {'status': 'pending'} for name in self.steps}
+        self._ready = threading.Event()
+        if not self.enabled:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def _run_step(self, name):
+        self.status[name] = {'status': 'running'}
+        start = time.perf_counter()
+        try:
+            self.steps[name]()
+            self.status[name] = {'status': 'success', 'elapsed': round(time.perf_counter() - start, 3)}
+            logger.info(f"预热步骤[{name}]完成，耗时{time.perf_counter() - start:.2f}s")
+            return True
+        except Exception as e:
+            import traceback
+            self.status[name] = {'status': 'fail', 'elapsed': round(time.perf_counter() - start, 3), 'error': str(e)}
+            logger.error(f"预热步骤[{name}]失败: {traceback.format_exc()}")
+            return False
+
+    def run(self):
+        """并行执行未成功的预热步骤，直到全部成功"""
+        if not self.enabled:
+            return
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.steps), thread_name_prefix='warmup') as executor:
+            while True:
+                pending = [name for name in self.steps if self.status[name]['status'] != 'success']
+                if all(list(executor.map(self._run_step, pending))):
+                    break
+                time.sleep(self.retry_interval_seconds)
+        self._ready.set()
+        logger.info(f"服务预热完成，耗时{time.perf_counter() - start:.2f}s")
+
+    def start(self):
+        """在后台线程中执行预热，不阻塞服务启动（/healthz可立即响应）"""
+        threading.Thread(target=self.run, name='warmup', daemon=True).start()
+
+
+warmup_state = None
+
+
+def start_warmup(config):
+    """创建并启动预热，返回WarmupState"""
+    global warmup_state
+    warmup_state = WarmupState(config)
+    warmup_state.start()
+    return warmup_state
+
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'success', 'code': 200, 'msg': 'ok', 'data': ''})
+
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    if warmup_state is None or warmup_state.ready:
+        return jsonify({'status': 'success', 'code': 200, 'msg': 'ready',
+                        'data': warmup_state.status if warmup_state else ''})
+    return jsonify({'status': 'fail', 'code': 503, 'msg': '服务预热中', 'data': warmup_state.status}), 503
@@ -82,6 +82,18 @@ def main():
         logger.exception(traceback.format_exc())
         return
     
+    # 注册健康检查路由，并在后台并行预热（模型、jieba、collection加载、BM25索引），预热完成前/readyz返回503
+    try:
+        from health_server import health_bp, start_warmup
+        app.register_blueprint(health_bp)
+        start_warmup(config)
+        logger.info("健康检查路由已注册，服务预热已启动")
+    except Exception as e:
+        logger.error(f"启动服务预热失败: {e}")
+        import traceback
+        logger.exception(traceback.format_exc())
+        return
+    
     # 启动服务配置
     server_config = config.get('api_server', {})
     host = server_config.get('host', '0.0.0.0')
@@ -93,6 +105,7 @@ def main():
     logger.info(f"所有服务已启动，监听地址: {host}:{port}")
     logger.info("向量库服务接口: /vector_db_service/*")
     logger.info("对话服务接口: /chat_service/*")
+    logger.info("健康检查接口: /healthz, /readyz")
     logger.info("=" * 60)
     
     try:
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+基于稀疏矩阵的BM25打分引擎
+按词项组织的CSC倒排结构（indptr/indices/data），构建时预先计算IDF与文档长度归一化，
+查询只访问查询词项的倒排链，top-k使用argpartition做部分选择。
+打分公式与rank_bm25.BM25Okapi保持一致（k1、b、epsilon含义相同）
+"""
+import numpy as np
+
+
+class SparseBM25:
+    """不可变的BM25倒排矩阵，数据变化后由调用方重新构建"""
+
+    def __init__(self, doc_term_ids, doc_term_freqs, vocab_size, k1=1.5, b=0.75, epsilon=0.25):
+        """
+        Args:
+            doc_term_ids: 每个文档去重后的词项id数组列表
+            doc_term_freqs: 与doc_term_ids一一对应的词频数组列表
+            vocab_size: 词表大小（词项id的上界）
+            k1, b, epsilon: BM25参数，同rank_bm25.BM25Okapi
+        """
+        self.corpus_size = len(doc_term_ids)
+        self.vocab_size = vocab_size
+
+        nnz_per_doc = np.fromiter((len(t) for t in doc_term_ids), dtype=np.int64, count=self.corpus_size)
+        if self.corpus_size == 0 or nnz_per_doc.sum() == 0:
+            self.indptr = np.zeros(vocab_size + 1, dtype=np.int64)
+            self.indices = np.zeros(0, dtype=np.int32)
+            self.data = np.zeros(0, dtype=np.float32)
+            self.idf = np.zeros(vocab_size, dtype=np.float64)
+            return
+
+        # 倒排项数量可达上亿，中间数组统一使用32位类型以控制峰值内存
+        terms = np.concatenate(doc_term_ids).astype(np.int32, copy=False)
+        tfs = np.concatenate(doc_term_freqs).astype(np.float32, copy=False)
+        docs = np.repeat(np.arange(self.corpus_size, dtype=np.int32), nnz_per_doc)
+
+        # 文档长度（含重复词）与平均长度
+        doc_len = np.fromiter((f.sum() for f in doc_term_freqs), dtype=np.float64, count=self.corpus_size)
+        avgdl = doc_len.sum() / self.corpus_size
+
+        # IDF：与BM25Okapi相同，负IDF替换为epsilon * 平均IDF（平均值只统计语料中出现过的词）
+        df = np.bincount(terms, minlength=vocab_size)
+        present = df > 0
+        idf = np.zeros(vocab_size, dtype=np.float64)
+        idf[present] = np.log(self.corpus_size - df[present] + 0.5) - np.log(df[present] + 0.5)
+        average_idf = idf[present].mean()
+        idf[present & (idf < 0)] = epsilon * average_idf
+        self.idf = idf
+
+        # 每个倒排项的预计算权重：idf * tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl))
+        doc_norm = (k1 * (1 - b + b * doc_len / avgdl)).astype(np.float32)
+        weights = doc_norm[docs]
+        weights += tfs
+        np.divide(tfs * (k1 + 1), weights, out=weights)
+        weights *= idf.astype(np.float32)[terms]
+        del tfs
+
+        # 按词项排序得到CSC结构，同一词项内保持文档顺序
+        order = np.argsort(terms, kind='stable')
+        del terms
+        self.indices = docs[order]
+        del docs
+        self.data = weights[order]
+        self.indptr = np.zeros(vocab_size + 1, dtype=np.int64)
+        np.cumsum(df, out=self.indptr[1:])
+
+    def score(self, query_term_ids):
+        """计算查询的BM25分数，只返回命中的文档
+
+        Args:
+            query_term_ids: 查询分词后的词项id序列（可重复，未登录词需事先剔除）
+
+        Returns:
+            (doc_indices, scores)，doc_indices升序
+        """
+        if len(query_term_ids) == 0 or self.corpus_size == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+
+        term_ids, counts = np.unique(np.asarray(query_term_ids, dtype=np.int64), return_counts=True)
+        doc_parts = []
+        weight_parts = []
+        for term_id, count in zip(term_ids, counts):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            if start == end:
+                continue
+            doc_parts.append(self.indices[start:end])
+            weight_parts.append(self.data[start:end] * count)
+        if not doc_parts:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+
+        docs = np.concatenate(doc_parts)
+        weights = np.concatenate(weight_parts).astype(np.float64)
+        if len(docs) * 8 > self.corpus_size:
+            # 命中高频词时倒排链很长，直接按全体文档累加比排序去重更快
+            dense = np.bincount(docs, weights=weights, minlength=self.corpus_size)
+            doc_indices = np.flatnonzero(np.bincount(docs, minlength=self.corpus_size)).astype(np.int32)
+            return doc_indices, dense[doc_indices]
+        doc_indices, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights, minlength=len(doc_indices))
+        return doc_indices, scores
+
+    def top_k(self, query_term_ids, k):
+        """返回分数最高的k个文档，按分数降序，分数相同按文档顺序
+
+        Returns:
+            (doc_indices, scores)
+        """
+        doc_indices, scores = self.score(query_term_ids)
+        return select_top_k(doc_indices, scores, k)
+
+
+def select_top_k(doc_indices, scores, k):
+    """用argpartition从候选中部分选择top-k，再只对这k个排序"""
+    if k <= 0 or len(scores) == 0:
+        return doc_indices[:0], scores[:0]
+    if len(scores) > k:
+        # 取第k大的分数作为门限，保留与门限并列的文档，保证并列时按文档顺序取舍
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        keep = scores >= kth_score
+        doc_indices, scores = doc_indices[keep], scores[keep]
+    order = np.lexsort((doc_indices, -scores))[:k]
+    return doc_indices[order], scores[order]
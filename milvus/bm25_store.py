@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+BM25索引缓存模块
+按(collection_type, tenant_code, org_code)维度在进程内常驻BM25索引，
+写入/删除时增量维护，混合检索时只需对已构建好的索引打分
+"""
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import jieba
+import numpy as np
+
+from milvus.bm25_engine import SparseBM25
+
+logger = logging.getLogger('vector_db')
+
+
+def tokenize_chinese(text):
+    """中文分词函数"""
+    return list(jieba.cut(text))
+
+
+def scope_matches(key_tenant_code, key_org_code, tenant_code, org_code):
+    """判断索引范围(key_tenant_code, key_org_code)是否覆盖(tenant_code, org_code)的数据
+
+    索引范围中的空字符串表示不限制；tenant_code/org_code为None表示通配（任意值）
+    """
+    if key_tenant_code and tenant_code is not None and key_tenant_code != tenant_code:
+        return False
+    if key_org_code and org_code is not None and key_org_code != org_code:
+        return False
+    return True
+
+
+class BM25Index:
+    """单个检索范围内的BM25索引，只保存主键、词项id/词频及增量删除所需的少量键字段（不保存content等内容），
+    检索结果只有id和bm25_score，最终结果的字段由调用方按主键取回
+
+    倒排矩阵首次检索时同步构建；之后数据有变化时在后台线程重建，重建完成前检索使用上一版矩阵
+    （已删除的文档在结果中剔除，新增的文档在重建完成后可检索到）
+    """
+
+    def __init__(self, text_field, key_fields=(), k1=1.5, b=0.75, epsilon=0.25):
+        self.text_field = text_field
+        self.key_fields = tuple(key_fields)
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.built_at = time.time()
+        # 词项 -> 词项id，只增不减
+        self._vocab = {}
+        # id -> (键字段, term_ids, term_freqs)，保持插入顺序
+        self._docs = OrderedDict()
+        # 当前倒排矩阵及其文档顺序对应的主键
+        self._bm25 = None
+        self._ids = []
+        self._dirty = True
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, entities):
+        """增量添加实体，只对新增文本分词"""
+        added = 0
+        with self._lock:
+            for entity in entities:
+                text = entity.get(self.text_field, '')
+                doc_id = entity.get('id')
+                if not text or doc_id is None:
+                    continue
+                term_counts = Counter(self._vocab.setdefault(t, len(self._vocab)) for t in tokenize_chinese(text))
+                self._docs[doc_id] = ({f: entity.get(f) for f in self.key_fields},
+                                      np.fromiter(term_counts.keys(), dtype=np.int32, count=len(term_counts)),
+                                      np.fromiter(term_counts.values(), dtype=np.int32, count=len(term_counts)))
+                added += 1
+            if added:
+                self._dirty = True
+        return added
+
+    def remove(self, predicate):
+        """删除键字段满足predicate的实体，返回删除数量"""
+        with self._lock:
+            to_remove = [doc_id for doc_id, (keys, _, _) in self._docs.items() if predicate(keys)]
+            for doc_id in to_remove:
+                del self._docs[doc_id]
+            if to_remove:
+                self._dirty = True
+        return len(to_remove)
+
+    def _snapshot(self):
+        """在锁内取出当前文档的主键和词项数组（数组只读，可在锁外构建矩阵）"""
+        items = list(self._docs.items())
+        self._dirty = False
+        return [doc_id for doc_id, _ in items], [doc for _, doc in items], len(self._vocab)
+
+    def _build_model(self, ids, docs, vocab_size):
+        """用已缓存的词项id构建倒排矩阵（不再访问Milvus，也不重新分词）"""
+        if not ids:
+            return None
+        return SparseBM25([term_ids for _, term_ids, _ in docs], [term_freqs for _, _, term_freqs in docs],
+                          vocab_size, k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    def build(self):
+        """同步构建倒排矩阵（首次检索前调用，之后的变化由后台线程重建）"""
+        with self._lock:
+            snapshot = self._snapshot()
+        model = self._build_model(*snapshot)
+        with self._lock:
+            self._bm25, self._ids = model, snapshot[0]
+
+    def _rebuild_loop(self):
+        """后台重建倒排矩阵，重建期间又有变化时继续重建，直到与数据一致"""
+        try:
+            while True:
+                with self._lock:
+                    if not self._dirty:
+                        self._rebuilding = False
+                        return
+                    snapshot = self._snapshot()
+                start = time.time()
+                model = self._build_model(*snapshot)
+                with self._lock:
+                    self._bm25, self._ids = model, snapshot[0]
+                logger.info(f"BM25倒排矩阵后台重建完成，共{len(snapshot[0])}个文档，耗时{time.time() - start:.3f}s")
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+                self._dirty = True
+            logger.exception("BM25倒排矩阵后台重建失败，下次检索时重试")
+
+    def _ensure_model(self):
+        """返回可用于检索的倒排矩阵及主键列表：从未构建时同步构建，数据有变化时启动后台重建并先返回上一版"""
+        with self._lock:
+            built = self._bm25 is not None or not self._dirty
+        if not built:
+            self.build()
+        with self._lock:
+            if self._dirty and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_loop, name='bm25-rebuild', daemon=True).start()
+            return self._bm25, self._ids
+
+    def search(self, query, limit):
+        """使用BM25进行检索，只返回命中查询词项且仍存在的文档，结果为[{'id', 'bm25_score'}]"""
+        query_tokens = tokenize_chinese(query)
+        bm25, ids = self._ensure_model()
+        if bm25 is None:
+            return []
+        with self._lock:
+            # 上一版矩阵之后新增的词项id不在矩阵的词表范围内
+            query_term_ids = [self._vocab[t] for t in query_tokens
+                              if t in self._vocab and self._vocab[t] < bm25.vocab_size]
+
+        # 上一版矩阵中可能有已删除的文档，剔除后不足limit条时扩大k重新选择
+        k = limit
+        while True:
+            top_indices, top_scores = bm25.top_k(query_term_ids, k)
+            with self._lock:
+                results = [{'id': ids[idx], 'bm25_score': score}
+                           for idx, score in zip(top_indices.tolist(), top_scores.tolist()) if ids[idx] in self._docs]
+            if len(results) >= limit or len(top_indices) < k:
+                return results[:limit]
+            k *= 2
+
+
+class BM25IndexStore:
+    """进程内BM25索引仓库，key为(collection_type, tenant_code, org_code)
+
+    多进程部署时各进程的索引相互独立，其他进程写入的数据依赖ttl_seconds过期后重建来感知；
+    过期的索引在后台线程重新加载，重新加载完成前检索继续使用旧索引。
+    文档数超过max_rows的检索范围不常驻内存，get_or_build返回None，由调用方按请求临时构建
+    """
+
+    def __init__(self, ttl_seconds=0, max_indexes=256, max_rows=16384):
+        self.ttl_seconds = ttl_seconds
+        self.max_indexes = max_indexes
+        self.max_rows = max_rows
+        self._indexes = OrderedDict()
+        self._build_locks = {}
+        # 构建中的key -> 构建期间到达的增量操作[(add/remove, 参数)]，构建完成后按顺序重放；
+        # 构建期间被invalidate的key值为None，构建结果不登记
+        self._pending = {}
+        # 文档数超过max_rows的key -> 发现时间，ttl_seconds内（为0时直到失效或有删除）不再尝试常驻
+        self._oversized = {}
+        # 正在后台重新加载的key
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _expired(self, built_at):
+        return self.ttl_seconds and time.time() - built_at > self.ttl_seconds
+
+    def get_or_build(self, key, text_field, loader, key_fields=()):
+        """获取已构建的索引，不存在时调用loader(limit)加载实体并构建，同一key只构建一次
+
+        loader(limit)最多返回limit个实体（limit为None时返回全部）；
+        检索范围的文档数超过max_rows时不缓存，返回None
+        """
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                if self._expired(index.built_at) and key not in self._refreshing:
+                    logger.info(f"BM25索引已过期，后台重新加载: {key}")
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, text_field, loader, key_fields),
+                                     name='bm25-refresh', daemon=True).start()
+                return index
+            oversized_at = self._oversized.get(key)
+            if oversized_at is not None:
+                if not self._expired(oversized_at):
+                    return None
+                del self._oversized[key]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                index = self._indexes.get(key)
+                if index is not None:
+                    return index
+                if key in self._oversized:
+                    return None
+            return self._build(key, text_field, loader, key_fields)
+
+    def _refresh(self, key, text_field, loader, key_fields):
+        """后台重新加载过期的索引，加载完成后替换旧索引"""
+        try:
+            with self._lock:
+                build_lock = self._build_locks.setdefault(key, threading.Lock())
+            with build_lock:
+                self._build(key, text_field, loader, key_fields)
+        except Exception:
+            logger.exception(f"BM25索引后台重新加载失败，继续使用旧索引: {key}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _build(self, key, text_field, loader, key_fields):
+        """加载实体并构建索引，重放加载期间的增量操作后登记（调用方持有该key的构建锁）"""
+        start = time.time()
+        with self._lock:
+            self._pending[key] = []
+        try:
+            entities = loader(self.max_rows + 1 if self.max_rows else None)
+            if self.max_rows and len(entities) > self.max_rows:
+                with self._lock:
+                    self._pending.pop(key, None)
+                    self._oversized[key] = time.time()
+                    self._indexes.pop(key, None)
+                logger.info(f"检索范围的文档数超过bm25_index.max_rows={self.max_rows}，BM25索引不常驻内存: {key}")
+                return None
+            index = BM25Index(text_field, key_fields)
+            index.add(entities)
+            del entities
+            index.build()
+        except BaseException:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        with self._lock:
+            pending = self._pending.pop(key, None)
+            if pending is None:
+                logger.info(f"BM25索引构建期间已被失效，本次构建结果不缓存: {key}")
+                return index
+            # 加载期间的写入/删除可能已包含在加载结果中，增量操作按主键覆盖/按条件删除，重放是幂等的；
+            # 重放的变化由首次检索触发后台重建
+            for op, args in pending:
+                if op == 'add':
+                    index.add(*args)
+                else:
+                    index.remove(*args)
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                evicted_key, _ = self._indexes.popitem(last=False)
+                logger.info(f"BM25索引数量超过上限{self.max_indexes}，淘汰: {evicted_key}")
+        if pending:
+            logger.info(f"BM25索引构建期间有{len(pending)}次增量更新，已重放: {key}")
+        logger.info(f"BM25索引构建完成: {key}，共{len(index)}个文档，耗时{time.time() - start:.3f}s")
+        return index
+
+    def _matching(self, collection_type, tenant_code, org_code, op, args):
+        """返回覆盖该范围的已构建索引；覆盖该范围且正在构建的索引记录该操作，构建完成后重放"""
+        with self._lock:
+            if op == 'remove':
+                # 删除后检索范围可能不再超过max_rows
+                for key in [k for k in self._oversized
+                            if k[0] == collection_type and scope_matches(k[1], k[2], tenant_code, org_code)]:
+                    del self._oversized[key]
+            for key, pending in self._pending.items():
+                if pending is not None and key[0] == collection_type and scope_matches(key[1], key[2], tenant_code, org_code):
+                    pending.append((op, args))
+            return [(key, index) for key, index in self._indexes.items()
+                    if key[0] == collection_type and scope_matches(key[1], key[2], tenant_code, org_code)]
+
+    def add_entities(self, collection_type, tenant_code, org_code, entities):
+        """将新写入(tenant_code, org_code)的实体增量加入所有覆盖该范围的已构建（及构建中的）索引"""
+        for key, index in self._matching(collection_type, tenant_code, org_code, 'add', (entities,)):
+            added = index.add(entities)
+            logger.info(f"BM25索引增量新增{added}个文档: {key}")
+
+    def remove_entities(self, collection_type, tenant_code, org_code, predicate):
+        """从所有覆盖(tenant_code, org_code)范围的已构建（及构建中的）索引中删除满足predicate的实体"""
+        for key, index in self._matching(collection_type, tenant_code, org_code, 'remove', (predicate,)):
+            removed = index.remove(predicate)
+            if removed:
+                logger.info(f"BM25索引增量删除{removed}个文档: {key}")
+
+    def invalidate(self, collection_type=None, tenant_code=None, org_code=None):
+        """丢弃匹配的索引，下次检索时重新构建；参数为None表示通配"""
+        with self._lock:
+            keys = [key for key in self._indexes
+                    if (collection_type is None or key[0] == collection_type)
+                    and scope_matches(key[1], key[2], tenant_code, org_code)]
+            for key in keys:
+                del self._indexes[key]
+            for key in [k for k in self._oversized
+                        if (collection_type is None or k[0] == collection_type) and scope_matches(k[1], k[2], tenant_code, org_code)]:
+                del self._oversized[key]
+            # 构建中的索引加载的可能是失效前的数据，构建结果不再登记
+            for key in self._pending:
+                if (collection_type is None or key[0] == collection_type) and scope_matches(key[1], key[2], tenant_code, org_code):
+                    self._pending[key] = None
+        if keys:
+            logger.info(f"已失效BM25索引: {keys}")
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Milvus连接管理模块
+每个进程/alias只建立一次连接，缓存Collection句柄和字段元数据，
+create_collection/delete_collection等操作后失效对应缓存；
+缓存的句柄按schema_check_seconds重新检查collection ID，其他进程（如离线迁移）重建并替换同名collection后自动失效
+"""
+import logging
+import threading
+import time
+
+from pymilvus import connections, utility, db, Collection
+
+logger = logging.getLogger('vector_db')
+
+
+class MilvusConnectionManager:
+    """进程内Milvus连接与collection句柄管理"""
+
+    def __init__(self, host, port, db_name, alias='default', schema_check_seconds=0):
+        self.host = host
+        self.port = port
+        self.db_name = db_name
+        self.alias = alias
+        # 0表示不检查（只在本进程调用invalidate时失效）
+        self.schema_check_seconds = schema_check_seconds
+        self._connected = False
+        self._collections = {}
+        self._metadata = {}
+        # collection名称 -> (缓存句柄时的collection ID, 上次检查时间)
+        self._collection_ids = {}
+        # collection被其他进程替换时的回调，参数为collection名称
+        self._replaced_listeners = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """连接到全局数据库，同一进程只连接一次"""
+        if self._connected and connections.has_connection(self.alias):
+            return
+        with self._lock:
+            if self._connected and connections.has_connection(self.alias):
+                return
+            connections.connect(alias=self.alias, host=self.host, port=self.port, db_name=self.db_name)
+            self._connected = True
+            logger.info(f"已连接Milvus: {self.host}:{self.port}, db_name={self.db_name}, alias={self.alias}")
+
+    def ensure_database(self):
+        """确保全局数据库存在（连接到指定数据库前需要先创建）"""
+        admin_alias = f"{self.alias}_admin"
+        connections.connect(alias=admin_alias, host=self.host, port=self.port)
+        try:
+            if self.db_name not in db.list_database(using=admin_alias):
+                db.create_database(self.db_name, using=admin_alias)
+                logger.info(f"全局数据库[{self.db_name}]创建成功")
+        finally:
+            connections.disconnect(admin_alias)
+
+    def add_replaced_listener(self, listener):
+        """注册collection被替换（删除后重建、迁移重命名）时的回调listener(name)"""
+        self._replaced_listeners.append(listener)
+
+    @staticmethod
+    def _collection_id(collection):
+        return collection.describe().get('collection_id')
+
+    def _is_replaced(self, name, collection):
+        """按schema_check_seconds检查缓存句柄对应的collection是否已被替换，检查出错时视为未替换"""
+        cached_id, checked_at = self._collection_ids.get(name, (None, 0))
+        now = time.time()
+        if not self.schema_check_seconds or now - checked_at < self.schema_check_seconds:
+            return False
+        # 先更新检查时间，并发请求中只有一个执行检查
+        self._collection_ids[name] = (cached_id, now)
+        try:
+            if not utility.has_collection(name, using=self.alias):
+                return True
+            return cached_id is not None and self._collection_id(collection) != cached_id
+        except Exception as e:
+            logger.warning(f"检查collection[{name}]是否被替换失败: {repr(e)}")
+            return False
+
+    def get_collection(self, name):
+        """获取collection句柄，不存在时返回None；已存在的句柄会被缓存"""
+        collection = self._collections.get(name)
+        if collection is not None:
+            if not self._is_replaced(name, collection):
+                return collection
+            logger.warning(f"collection[{name}]已被其他进程删除或替换（如离线迁移），重新获取句柄和元数据")
+            self.invalidate(name)
+            for listener in self._replaced_listeners:
+                listener(name)
+
+        self.connect()
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                return collection
+            if not utility.has_collection(name, using=self.alias):
+                return None
+            collection = Collection(name, using=self.alias)
+            self._collections[name] = collection
+            if self.schema_check_seconds:
+                try:
+                    self._collection_ids[name] = (self._collection_id(collection), time.time())
+                except Exception as e:
+                    logger.warning(f"获取collection[{name}]的ID失败: {repr(e)}")
+                    self._collection_ids[name] = (None, time.time())
+            return collection
+
+    def get_metadata(self, name, builder):
+        """获取由builder(collection)计算出的collection元数据（如输出字段列表），结果被缓存"""
+        # 先获取句柄：句柄缓存过期检查时发现collection已被替换，元数据随之失效
+        collection = self.get_collection(name)
+        if collection is None:
+            return None
+        metadata = self._metadata.get(name)
+        if metadata is not None:
+            return metadata
+        metadata = builder(collection)
+        with self._lock:
+            self._metadata[name] = metadata
+        return metadata
+
+    def invalidate(self, name=None):
+        """失效collection句柄和元数据缓存，name为None时全部失效"""
+        with self._lock:
+            if name is None:
+                self._collections.clear()
+                self._metadata.clear()
+                self._collection_ids.clear()
+            else:
+                self._collections.pop(name, None)
+                self._metadata.pop(name, None)
+                self._collection_ids.pop(name, None)
+        logger.info(f"已失效collection缓存: {name if name is not None else '全部'}")
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Milvus写后刷盘调度模块
+写入/删除后不再同步调用collection.flush()，而是登记为待刷盘，由后台线程按时间/行数策略合并刷盘，
+减少每次请求的封段耗时和小segment数量。写入后立即可检索由search/query的consistency_level保证
+"""
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('vector_db')
+
+
+class FlushScheduler:
+    """按collection合并flush：距首次写入超过interval_seconds或待刷盘行数超过max_pending_rows时刷盘
+
+    enabled为False时退化为每次写入后同步flush（原有行为），只有deferred()范围内的批量写入合并为结束时flush一次
+    """
+
+    def __init__(self, interval_seconds=5.0, max_pending_rows=10000, enabled=True):
+        self.interval_seconds = interval_seconds
+        self.max_pending_rows = max_pending_rows
+        self.enabled = enabled
+        # collection名称 -> [collection, 待刷盘行数, 首次写入时间]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._local = threading.local()
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='milvus-flush-scheduler', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def mark_dirty(self, collection, rows=0):
+        """登记collection有rows行待刷盘的写入/删除"""
+        deferred = getattr(self._local, 'deferred', None)
+        if not self.enabled and deferred is None:
+            collection.flush()
+            return
+
+        with self._lock:
+            entry = self._pending.get(collection.name)
+            if entry is None:
+                entry = self._pending[collection.name] = [collection, 0, time.time()]
+            entry[0] = collection
+            entry[1] += rows
+            over_limit = entry[1] >= self.max_pending_rows
+
+        if deferred is not None:
+            # 批量操作期间只记录，结束时统一刷盘
+            deferred.add(collection.name)
+            return
+
+        self._ensure_thread()
+        if over_limit:
+            self._wakeup.set()
+
+    @contextmanager
+    def deferred(self):
+        """批量写入期间推迟刷盘，退出时只对涉及的collection各flush一次（可嵌套，最外层退出时刷盘）"""
+        outermost = getattr(self._local, 'deferred', None) is None
+        if outermost:
+            self._local.deferred = set()
+        try:
+            yield
+        finally:
+            if outermost:
+                names = self._local.deferred
+                self._local.deferred = None
+                for name in names:
+                    self.flush(name)
+
+    def _take_due(self, force=False, name=None):
+        """取出到期（或指定）的待刷盘collection"""
+        now = time.time()
+        due = []
+        with self._lock:
+            for collection_name, (collection, rows, first_at) in list(self._pending.items()):
+                if name is not None and collection_name != name:
+                    continue
+                if force or rows >= self.max_pending_rows or now - first_at >= self.interval_seconds:
+                    due.append((collection, rows))
+                    del self._pending[collection_name]
+        return due
+
+    def _flush_entries(self, entries):
+        for collection, rows in entries:
+            start = time.time()
+            try:
+                collection.flush()
+                logger.info(f"collection[{collection.name}]刷盘完成，合并{rows}行写入，耗时{time.time() - start:.3f}s")
+            except Exception as e:
+                logger.error(f"collection[{collection.name}]刷盘失败，稍后重试: {repr(e)}")
+                with self._lock:
+                    entry = self._pending.setdefault(collection.name, [collection, 0, time.time()])
+                    entry[1] += rows
+
+    def flush(self, name=None):
+        """立即刷盘指定collection（name为None时刷盘全部）的待刷盘写入"""
+        self._flush_entries(self._take_due(force=True, name=name))
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval_seconds)
+            self._wakeup.clear()
+            self._flush_entries(self._take_due())
+
+    def close(self):
+        """停止后台线程并刷盘所有待刷盘写入（进程退出时自动调用）"""
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+向量索引方案（index profile）管理模块
+每个方案包含embedding字段的建索引参数和与之匹配的检索参数，active默认为FLAT（原有索引），为auto时按collection的实体数选择方案。
+检索参数按collection上实际存在的索引类型选取，配置切换后未重建的collection仍使用与其索引匹配的参数
+"""
+import logging
+
+logger = logging.getLogger('vector_db')
+
+# 配置中没有index_profile.profiles时使用的默认方案，max_entities为推荐使用该方案的实体数上限（None表示不限）
+DEFAULT_INDEX_PROFILES = {
+    'FLAT': {
+        'max_entities': 100000,
+        'index_params': {'metric_type': 'COSINE', 'index_type': 'FLAT', 'params': {}},
+        'search_params': {'metric_type': 'COSINE', 'params': {}}
+    },
+    'IVF_FLAT': {
+        'max_entities': 2000000,
+        'index_params': {'metric_type': 'COSINE', 'index_type': 'IVF_FLAT', 'params': {'nlist': 1024}},
+        'search_params': {'metric_type': 'COSINE', 'params': {'nprobe': 32}}
+    },
+    'IVF_SQ8': {
+        'max_entities': 5000000,
+        'index_params': {'metric_type': 'COSINE', 'index_type': 'IVF_SQ8', 'params': {'nlist': 2048}},
+        'search_params': {'metric_type': 'COSINE', 'params': {'nprobe': 32}}
+    },
+    'HNSW': {
+        'max_entities': 20000000,
+        'index_params': {'metric_type': 'COSINE', 'index_type': 'HNSW', 'params': {'M': 16, 'efConstruction': 256}},
+        'search_params': {'metric_type': 'COSINE', 'params': {'ef': 128}}
+    },
+    'DISKANN': {
+        'max_entities': None,
+        'index_params': {'metric_type': 'COSINE', 'index_type': 'DISKANN', 'params': {}},
+        'search_params': {'metric_type': 'COSINE', 'params': {'search_list': 100}}
+    }
+}
+
+DEFAULT_AUTO_ORDER = ['FLAT', 'HNSW', 'DISKANN']
+
+# 未配置index_profile.active时使用的方案，与原有配置的FLAT索引一致
+DEFAULT_ACTIVE_PROFILE = 'FLAT'
+
+# 未配置index_profile时，使用旧的index_params/search_params配置
+LEGACY_PROFILE = 'CONFIG'
+
+
+def get_index_profiles(config):
+    """返回全部索引方案{名称: 方案}，兼容只有index_params/search_params的旧配置"""
+    profile_config = config.get('index_profile')
+    if profile_config is None:
+        return {LEGACY_PROFILE: {
+            'max_entities': None,
+            'index_params': config['index_params'],
+            'search_params': config['search_params']
+        }}
+    return profile_config.get('profiles') or DEFAULT_INDEX_PROFILES
+
+
+def recommend_profile(config, num_entities):
+    """按实体数推荐索引方案：auto_order中第一个max_entities不小于num_entities的方案"""
+    profiles = get_index_profiles(config)
+    if LEGACY_PROFILE in profiles:
+        return LEGACY_PROFILE
+    auto_order = config.get('index_profile', {}).get('auto_order', DEFAULT_AUTO_ORDER)
+    candidates = [name for name in auto_order if name in profiles]
+    for name in candidates:
+        max_entities = profiles[name].get('max_entities')
+        if max_entities is None or num_entities <= max_entities:
+            return name
+    return candidates[-1]
+
+
+def resolve_profile(config, num_entities=0, profile=None):
+    """确定使用的索引方案名称：profile参数优先，其次index_profile.active，auto表示按实体数推荐"""
+    profiles = get_index_profiles(config)
+    if profile is None:
+        profile = LEGACY_PROFILE if LEGACY_PROFILE in profiles else config['index_profile'].get('active', DEFAULT_ACTIVE_PROFILE)
+    if profile == 'auto':
+        return recommend_profile(config, num_entities)
+    if profile not in profiles:
+        raise ValueError(f"索引方案[{profile}]不存在，可选: {list(profiles.keys())} 或 auto")
+    return profile
+
+
+def get_profile(config, name):
+    """按名称获取索引方案"""
+    return get_index_profiles(config)[name]
+
+
+def find_profile_for_index(config, index_params):
+    """按collection上实际的索引类型找到对应的方案名称，找不到返回None"""
+    index_type = (index_params or {}).get('index_type')
+    for name, profile in get_index_profiles(config).items():
+        if profile['index_params'].get('index_type') == index_type:
+            return name
+    return None
+
+
+def search_params_for_index(config, index_params):
+    """返回与collection上实际索引匹配的检索参数"""
+    name = find_profile_for_index(config, index_params)
+    if name is not None:
+        return get_profile(config, name)['search_params']
+    metric_type = (index_params or {}).get('metric_type', 'COSINE')
+    logger.warning(f"没有与索引{index_params}匹配的索引方案，使用默认检索参数")
+    return {'metric_type': metric_type, 'params': {}}
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+全局collection迁移工具
+对无法在线修改schema的变更（如增加BM25稀疏向量字段、改用确定性主键、以tenant_code为分区键、更换向量索引方案、更换向量存储类型），按当前配置新建collection，
+分批复制原有数据后通过重命名替换原collection，原collection保留为备份。
+迁移过程中原collection照常提供检索，但新写入的数据不会被复制，迁移期间应暂停写入。
+
+用法:
+    python -m milvus.migration sparse_bm25 --collection-type ALL
+    python -m milvus.migration hash_primary_key --collection-type ALL
+    python -m milvus.migration partition_key --collection-type ALL
+    python -m milvus.migration recommend_index --collection-type ALL
+    python -m milvus.migration index_profile --profile auto --collection-type ALL
+    python -m milvus.migration vector_dtype --dtype FLOAT16_VECTOR --collection-type ALL
+    python -m milvus.migration vector_dtype --dtype INT8_VECTOR --profile HNSW --collection-type ALL
+"""
+import argparse
+import logging
+import time
+
+from pymilvus import utility, Collection, DataType
+
+from milvus.index_profiles import resolve_profile, recommend_profile, find_profile_for_index
+from milvus.miluvs_helper import (config, get_global_collections, get_field_index_params, qa_collection_schema, doc_collection_schema,
+                                  ensure_collection_indexes, collection_create_kwargs, has_sparse_bm25,
+                                  has_hash_primary_key, has_partition_key, qa_primary_key, doc_primary_key, bm25_store, milvus_manager,
+                                  invalidate_search_results,
+                                  EMBEDDING_DTYPES, get_embedding_dtype, to_storage_vectors, from_storage_vector)
+
+logger = logging.getLogger('vector_db')
+
+
+def copy_collection_data(src, dst, batch_size=1000, transform=None):
+    """分批把src中的数据复制到dst，返回复制的行数
+
+    只复制dst需要写入的字段：自动生成的主键和Function输出字段（如BM25稀疏向量）由dst重新生成；
+    dst主键不是自动生成时使用upsert写入，重复执行不会产生重复数据；
+    src或dst的embedding字段为低精度存储时，向量按dst的存储类型转换
+    """
+    src_field_names = {f.name for f in src.schema.fields}
+    output_fields = [f.name for f in dst.schema.fields
+                     if not (f.is_primary and f.auto_id)
+                     and not getattr(f, 'is_function_output', False)
+                     and f.name in src_field_names]
+    src_dtype = get_embedding_dtype(src)
+    dst_dtype = get_embedding_dtype(dst)
+    convert_embedding = src_dtype != DataType.FLOAT_VECTOR or dst_dtype != DataType.FLOAT_VECTOR
+
+    copied = 0
+    iterator = src.query_iterator(batch_size=batch_size, expr='id >= 0', output_fields=output_fields)
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            rows = [{name: row[name] for name in output_fields} for row in batch]
+            if convert_embedding:
+                for row in rows:
+                    row['embedding'] = to_storage_vectors([from_storage_vector(row['embedding'], src_dtype)], dst_dtype)[0]
+            if transform is not None:
+                rows = [transform(row) for row in rows]
+            if dst.schema.auto_id:
+                dst.insert(data=rows)
+            else:
+                dst.upsert(data=rows)
+            copied += len(rows)
+            logger.info(f"已从[{src.name}]复制{copied}条数据到[{dst.name}]")
+    finally:
+        iterator.close()
+    dst.flush()
+    return copied
+
+
+def rebuild_collection(collection_name, schema, transform=None, batch_size=1000, index_profile=None):
+    """按schema新建collection并复制数据，完成后通过重命名替换原collection
+
+    index_profile为新collection的向量索引方案名称，默认沿用原collection的索引方案
+
+    Returns:
+        (复制行数, 备份collection名称)
+    """
+    rebuild_name = f"{collection_name}_rebuild"
+    backup_name = f"{collection_name}_bak_{time.strftime('%Y%m%d%H%M%S')}"
+    if utility.has_collection(rebuild_name):
+        raise RuntimeError(f"collection[{rebuild_name}]已存在，可能有未完成的迁移，请确认后手动删除")
+
+    src = Collection(collection_name)
+    if index_profile is None:
+        index_profile = find_profile_for_index(config, get_field_index_params(src, 'embedding'))
+    dst = Collection(rebuild_name, schema=schema, **collection_create_kwargs(schema))
+    ensure_collection_indexes(dst, index_profile=index_profile)
+    copied = copy_collection_data(src, dst, batch_size=batch_size, transform=transform)
+    dst.load()
+
+    utility.rename_collection(collection_name, backup_name)
+    utility.rename_collection(rebuild_name, collection_name)
+    # 主键可能已重新生成，进程内缓存的collection句柄、按主键缓存的BM25索引和检索结果全部失效
+    milvus_manager.invalidate(collection_name)
+    bm25_store.invalidate()
+    invalidate_search_results()
+    logger.info(f"collection[{collection_name}]迁移完成，共复制{copied}条数据，原collection已备份为[{backup_name}]")
+    schema_check_seconds = config['milvus'].get('schema_check_seconds', 10)
+    if schema_check_seconds:
+        logger.info(f"运行中的服务进程会在{schema_check_seconds}秒内检测到collection已被替换并重新加载，之后再恢复写入")
+    else:
+        logger.warning("milvus.schema_check_seconds为0，运行中的服务进程不会检测到collection已被替换，请重启服务")
+    return copied, backup_name
+
+
+def _target_collections(collection_type):
+    """返回需要迁移的(collection_type, collection名称)列表"""
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    targets = []
+    if collection_type in ('QA', 'ALL'):
+        targets.append(('QA', global_collection_qa_name))
+    if collection_type in ('DOC', 'ALL'):
+        targets.append(('DOC', global_collection_doc_name))
+    return targets
+
+
+def _schema_like(collection_type, collection, **overrides):
+    """按已有collection的特性生成新schema，overrides中的特性按指定值修改"""
+    options = {
+        'enable_sparse_bm25': has_sparse_bm25(collection),
+        'hash_primary_key': has_hash_primary_key(collection),
+        'partition_key': has_partition_key(collection),
+        'vector_dtype': get_embedding_dtype(collection),
+    }
+    options.update(overrides)
+    if collection_type == 'QA':
+        return qa_collection_schema(**options)
+    return doc_collection_schema(**options)
+
+
+def migrate_sparse_bm25(collection_type, batch_size=1000):
+    """为已有的全局collection增加Milvus BM25稀疏向量字段"""
+    for target_type, collection_name in _target_collections(collection_type):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.error(f"全局向量库[{collection_name}]不存在")
+            continue
+        if has_sparse_bm25(collection):
+            logger.info(f"collection[{collection_name}]已包含BM25稀疏向量字段，无需迁移")
+            continue
+        schema = _schema_like(target_type, collection, enable_sparse_bm25=True)
+        rebuild_collection(collection_name, schema, batch_size=batch_size)
+
+
+def migrate_hash_primary_key(collection_type, batch_size=1000):
+    """把已有全局collection的自增主键改为确定性哈希主键，重复的问答对/文档块在迁移时合并"""
+    for target_type, collection_name in _target_collections(collection_type):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.error(f"全局向量库[{collection_name}]不存在")
+            continue
+        if has_hash_primary_key(collection):
+            logger.info(f"collection[{collection_name}]已使用确定性主键，无需迁移")
+            continue
+        if target_type == 'QA':
+            def transform(row):
+                return dict(row, id=qa_primary_key(row['tenant_code'], row['org_code'], row['question']))
+        else:
+            def transform(row):
+                return dict(row, id=doc_primary_key(row['tenant_code'], row['org_code'],
+                                                    row['file_name'], row['block_id']))
+        schema = _schema_like(target_type, collection, hash_primary_key=True)
+        rebuild_collection(collection_name, schema, transform=transform, batch_size=batch_size)
+
+
+def migrate_partition_key(collection_type, batch_size=1000):
+    """把已有全局collection改为以tenant_code为分区键，数据按租户分布到各分区"""
+    for target_type, collection_name in _target_collections(collection_type):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.error(f"全局向量库[{collection_name}]不存在")
+            continue
+        if has_partition_key(collection):
+            logger.info(f"collection[{collection_name}]已以tenant_code为分区键，无需迁移")
+            continue
+        schema = _schema_like(target_type, collection, partition_key=True)
+        rebuild_collection(collection_name, schema, batch_size=batch_size)
+
+
+def recommend_index(collection_type):
+    """输出各collection的实体数、当前索引方案和按实体数推荐的索引方案"""
+    for _, collection_name in _target_collections(collection_type):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.error(f"全局向量库[{collection_name}]不存在")
+            continue
+        num_entities = collection.num_entities
+        current_profile = find_profile_for_index(config, get_field_index_params(collection, 'embedding'))
+        recommended = recommend_profile(config, num_entities)
+        print(f"{collection_name}: 实体数={num_entities}, 当前索引方案={current_profile}, 推荐索引方案={recommended}")
+
+
+def migrate_index_profile(collection_type, profile='auto', batch_size=1000):
+    """按指定索引方案（auto为按实体数推荐）离线重建collection的向量索引，重建期间原collection照常提供检索"""
+    for target_type, collection_name in _target_collections(collection_type):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.error(f"全局向量库[{collection_name}]不存在")
+            continue
+        target_profile = resolve_profile(config, collection.num_entities, profile)
+        current_index_params = get_field_index_params(collection, 'embedding')
+        if find_profile_for_index(config, current_index_params) == target_profile:
+            logger.info(f"collection[{collection_name}]已使用索引方案[{target_profile}]，无需重建")
+            continue
+        logger.info(f"collection[{collection_name}]索引由{current_index_params}重建为方案[{target_profile}]")
+        rebuild_collection(collection_name, _schema_like(target_type, collection), batch_size=batch_size,
+                           index_profile=target_profile)
+
+
+def migrate_vector_dtype(collection_type, dtype, profile=None, batch_size=1000):
+    """把已有全局collection的embedding字段改为指定存储类型（FLOAT_VECTOR/FLOAT16_VECTOR/INT8_VECTOR）
+
+    profile为新collection的索引方案，默认沿用原索引方案；INT8_VECTOR需要使用HNSW
+    """
+    vector_dtype = EMBEDDING_DTYPES[dtype]
+    for target_type, collection_name in _target_collections(collection_type):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.error(f"全局向量库[{collection_name}]不存在")
+            continue
+        if get_embedding_dtype(collection) == vector_dtype:
+            logger.info(f"collection[{collection_name}]的embedding字段已是{dtype}，无需迁移")
+            continue
+        schema = _schema_like(target_type, collection, vector_dtype=vector_dtype)
+        rebuild_collection(collection_name, schema, batch_size=batch_size, index_profile=profile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全局collection迁移工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sparse_parser = subparsers.add_parser('sparse_bm25', help='为已有collection增加Milvus BM25稀疏向量字段')
+    sparse_parser.add_argument('--collection-type', choices=['QA', 'DOC', 'ALL'], default='ALL')
+    sparse_parser.add_argument('--batch-size', type=int, default=1000)
+
+    hash_parser = subparsers.add_parser('hash_primary_key', help='把已有collection的自增主键改为确定性哈希主键')
+    hash_parser.add_argument('--collection-type', choices=['QA', 'DOC', 'ALL'], default='ALL')
+    hash_parser.add_argument('--batch-size', type=int, default=1000)
+
+    partition_parser = subparsers.add_parser('partition_key', help='把已有collection改为以tenant_code为分区键')
+    partition_parser.add_argument('--collection-type', choices=['QA', 'DOC', 'ALL'], default='ALL')
+    partition_parser.add_argument('--batch-size', type=int, default=1000)
+
+    subparsers.add_parser('recommend_index', help='按实体数推荐向量索引方案').add_argument(
+        '--collection-type', choices=['QA', 'DOC', 'ALL'], default='ALL')
+
+    index_parser = subparsers.add_parser('index_profile', help='按指定索引方案离线重建collection的向量索引')
+    index_parser.add_argument('--profile', default='auto', help='索引方案名称，auto表示按实体数推荐')
+    index_parser.add_argument('--collection-type', choices=['QA', 'DOC', 'ALL'], default='ALL')
+    index_parser.add_argument('--batch-size', type=int, default=1000)
+
+    dtype_parser = subparsers.add_parser('vector_dtype', help='更换collection的embedding字段存储类型')
+    dtype_parser.add_argument('--dtype', choices=list(EMBEDDING_DTYPES), required=True)
+    dtype_parser.add_argument('--profile', help='新collection的索引方案，默认沿用原索引方案')
+    dtype_parser.add_argument('--collection-type', choices=['QA', 'DOC', 'ALL'], default='ALL')
+    dtype_parser.add_argument('--batch-size', type=int, default=1000)
+
+    args = parser.parse_args()
+
+    milvus_manager.connect()
+
+    if args.command == 'sparse_bm25':
+        migrate_sparse_bm25(args.collection_type, batch_size=args.batch_size)
+    elif args.command == 'hash_primary_key':
+        migrate_hash_primary_key(args.collection_type, batch_size=args.batch_size)
+    elif args.command == 'partition_key':
+        migrate_partition_key(args.collection_type, batch_size=args.batch_size)
+    elif args.command == 'recommend_index':
+        recommend_index(args.collection_type)
+    elif args.command == 'index_profile':
+        migrate_index_profile(args.collection_type, profile=args.profile, batch_size=args.batch_size)
+    elif args.command == 'vector_dtype':
+        migrate_vector_dtype(args.collection_type, args.dtype, profile=args.profile, batch_size=args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,25 @@
 from pymilvus import connections, utility, FieldSchema, CollectionSchema, DataType, Collection, db,SearchResult,Hits,Hit
+from pymilvus import Function, FunctionType, AnnSearchRequest, RRFRanker
 import json
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-import torch
+import hashlib
+import math
+import threading
+import time
+import numpy as np
 from config.log_config import setup_vector_db_logging
-from rank_bm25 import BM25Okapi
-import jieba
+from milvus.bm25_store import BM25Index, BM25IndexStore
+from milvus.connection_manager import MilvusConnectionManager
+from milvus.flush_scheduler import FlushScheduler
+from milvus.result_cache import SearchResultCache
+from milvus.index_profiles import resolve_profile, recommend_profile, get_profile, find_profile_for_index, search_params_for_index
+from embedding.model_loader import LazyEmbeddingModel
+from embedding.batcher import EmbeddingBatcher
+from embedding.query_cache import QueryEmbeddingCache
+from embedding.chunk_store import ChunkEmbeddingStore
+from embedding.bucketing import embed_bucketed, iter_windows
+from embedding.worker_pool import EmbeddingWorkerPool, embed_in_worker
+from embedding.text_splitter import create_text_splitter
+from utils.single_flight import SingleFlight
 from collections import defaultdict
 
 import logging
@@ -16,52 +30,374 @@ logger = logging.getLogger('vector_db')
 with open('./config/config.json', 'r', encoding='utf-8') as f:
     config = json.load(f)
 
-# 检测CUDA是否可用
-try:
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    logger.info(f"检测到设备: {device}")
-except ImportError:
-    device = 'cpu'
-    logger.warning("未安装torch，使用CPU设备")
+# 嵌入模型后端：torch（HuggingFaceBgeEmbeddings）或onnx（ONNX Runtime，可使用int8量化模型，仅CPU）
+# 从embedding_model_path本地目录加载，导入本模块时不加载，首次计算向量或预热时才加载
+embedding_model = LazyEmbeddingModel(config)
+
+# 检索时的查询向量：并发请求的查询合并为一次批量前向计算
+embedding_batch_config = config.get('embedding_batch', {})
+# 调用时再解析embedding_model（基准测试等会替换模块中的embedding_model）
+query_embedding_batcher = EmbeddingBatcher(
+    lambda texts: embedding_model.embed_documents(texts),
+    max_batch_size=embedding_batch_config.get('max_batch_size', 32),
+    max_wait_ms=embedding_batch_config.get('max_wait_ms', 2)
+)
+
+# 查询向量缓存：key为规范化后的查询文本，可选的磁盘层供同机多个worker共享
+query_cache_config = config.get('query_embedding_cache', {})
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=query_cache_config.get('max_entries', 10000),
+    ttl_seconds=query_cache_config.get('ttl_seconds', 0),
+    disk_path=query_cache_config.get('disk_path') or None,
+    namespace=embedding_model.model_name
+) if query_cache_config.get('enabled', True) else None
+
+
+# 文档块向量持久化存储：重新上传的文档只为内容有变化的块计算向量
+# 首次使用时才创建（会创建存储目录），导入本模块不产生文件
+chunk_store_config = config.get('chunk_embedding_store', {})
+chunk_embedding_store = None
+_chunk_store_lock = threading.Lock()
+
+
+def get_chunk_embedding_store():
+    """获取文档块向量存储，未开启时返回None"""
+    global chunk_embedding_store
+    if chunk_embedding_store is None and chunk_store_config.get('enabled', False):
+        with _chunk_store_lock:
+            if chunk_embedding_store is None:
+                chunk_embedding_store = ChunkEmbeddingStore(
+                    chunk_store_config.get('path', './cache/chunk_embeddings'),
+                    dim=1024,
+                    namespace=embedding_model.model_name
+                )
+    return chunk_embedding_store
+
+
+# 入库时的向量计算：按文本长度分桶成有界批次，按窗口逐段计算并写入
+ingest_embedding_config = config.get('ingest_embedding', {})
+
+# 批量入库的嵌入计算进程池：每个工作进程加载一份模型并固定计算线程数
+embedding_pool_config = config.get('embedding_pool', {})
+embedding_worker_pool = EmbeddingWorkerPool(
+    config,
+    num_workers=embedding_pool_config.get('num_workers', 4),
+    threads_per_worker=embedding_pool_config.get('threads_per_worker', 0)
+) if embedding_pool_config.get('enabled', False) else None
+
+
+# 文档分块器，首次入库文档时创建（需要加载tokenizer），之后复用
+_text_splitter = None
+
+
+def get_text_splitter():
+    """获取按模型最大序列长度切分的文档分块器"""
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = create_text_splitter(config)
+    return _text_splitter
 
 
-embedding_model = HuggingFaceBgeEmbeddings(
-    #model_name=config['embedding_model_path'],
-    model_name="BAAI/bge-large-zh-v1.5",
-    model_kwargs = {'device': device},
-    encode_kwargs={'normalize_embeddings': True}  # set True to compute cosine similarity
+def embed_texts(text_list):
+    """按长度分桶批量计算入库文本的向量，批内文本长度相近以减少padding（中文按字数近似token数）
+
+    启用嵌入工作进程池且文本数达到min_texts时，各批次分发到工作进程并行计算
+    """
+    kwargs = dict(batch_size=ingest_embedding_config.get('batch_size', 32),
+                  max_batch_tokens=ingest_embedding_config.get('max_batch_tokens'))
+    if embedding_worker_pool is not None and len(text_list) >= embedding_pool_config.get('min_texts', 64):
+        return embed_bucketed(text_list, embed_in_worker, map_fn=embedding_worker_pool.map, **kwargs)
+    return embed_bucketed(text_list, embedding_model.embed_documents, **kwargs)
+
+
+def embed_chunks(block_list):
+    """计算入库文本（文档块/问题）的向量，已计算过的文本（按内容哈希）直接读取存储的向量
+
+    存储的全精度向量同时用于低精度向量collection检索结果的重打分
+    """
+    chunk_store = get_chunk_embedding_store()
+    if chunk_store is None:
+        return embed_texts(block_list)
+    embeddings, computed = chunk_store.embed(block_list, embed_texts)
+    logger.info(f"入库文本向量：共{len(block_list)}条，复用已存储向量{len(block_list) - computed}条，新计算{computed}条")
+    return embeddings
+
+
+def _embed_uncached_queries(query_list):
+    """计算查询向量，embedding_batch.enabled为True时与其他请求的查询合并计算"""
+    if embedding_batch_config.get('enabled', True):
+        return query_embedding_batcher.embed_documents(query_list)
+    return embedding_model.embed_documents(query_list)
+
+
+# 相同的并发请求只执行一次：检索按完整的检索参数合并，查询向量按查询文本合并
+single_flight_config = config.get('single_flight', {})
+search_single_flight = SingleFlight('search', copy_shared=True) if single_flight_config.get('search', True) else None
+embedding_single_flight = SingleFlight('embedding') if single_flight_config.get('embedding', True) else None
+
+
+def _embed_coalesced_queries(query_list):
+    """计算查询向量，其他请求正在计算的相同查询等待其结果"""
+    if embedding_single_flight is None:
+        return _embed_uncached_queries(query_list)
+    return embedding_single_flight.do_many(query_list, _embed_uncached_queries)
+
+
+def embed_queries(query_list):
+    """计算检索查询的向量，优先使用查询向量缓存"""
+    if query_embedding_cache is not None:
+        return query_embedding_cache.embed(query_list, _embed_coalesced_queries)
+    return _embed_coalesced_queries(query_list)
+
+# 进程内常驻的BM25索引，按(collection_type, tenant_code, org_code)缓存，写入/删除时增量维护
+bm25_index_config = config.get('bm25_index', {})
+bm25_store = BM25IndexStore(
+    ttl_seconds=bm25_index_config.get('ttl_seconds', 0),
+    max_indexes=bm25_index_config.get('max_indexes', 256),
+    max_rows=bm25_index_config.get('max_rows', 16384)
 )
 
+# 写入/删除后的flush由后台线程按时间/行数合并执行，mode为sync时每次写入后同步flush
+flush_config = config.get('flush', {})
+flush_scheduler = FlushScheduler(
+    interval_seconds=flush_config.get('interval_seconds', 5),
+    max_pending_rows=flush_config.get('max_pending_rows', 10000),
+    enabled=flush_config.get('mode', 'sync') == 'deferred'
+)
+
+# 检索结果缓存：key为完整的检索参数，写入/删除数据时按(collection_type, tenant_code, org_code)递增版本号使相关缓存失效
+result_cache_config = config.get('search_result_cache', {})
+search_result_cache = SearchResultCache(
+    max_entries=result_cache_config.get('max_entries', 5000),
+    ttl_seconds=result_cache_config.get('ttl_seconds', 0),
+    max_bytes=result_cache_config.get('max_bytes', 256 * 1024 * 1024)
+) if result_cache_config.get('enabled', False) else None
+
+
+def invalidate_search_results(collection_type=None, tenant_code=None, org_code=None):
+    """数据写入/删除后使相关检索范围的缓存结果失效，参数为None表示通配"""
+    if search_result_cache is not None:
+        search_result_cache.bump(collection_type, tenant_code, org_code)
+
+
+def consistency_kwargs(kind):
+    """search/query调用的一致性级别参数，kind为search或query，未配置时使用collection默认级别
+
+    flush改为异步后，写入后立即检索的可见性由一致性级别保证（Session级别可读到本进程的写入）
+    """
+    level = config.get('consistency_level', {}).get(kind)
+    return {'consistency_level': level} if level else {}
+
+
+# Milvus服务端BM25稀疏向量字段（hybrid_search.mode为milvus时使用，需要Milvus 2.5+）
+SPARSE_BM25_FIELD = 'sparse_bm25'
+# 不作为检索结果返回的向量字段类型
+VECTOR_DTYPES = (DataType.FLOAT_VECTOR, DataType.FLOAT16_VECTOR, DataType.INT8_VECTOR, DataType.SPARSE_FLOAT_VECTOR)
+# embedding字段可选的存储类型（vector_storage.dtype）：FLOAT16_VECTOR每维2字节，INT8_VECTOR每维1字节
+EMBEDDING_DTYPES = {
+    'FLOAT_VECTOR': DataType.FLOAT_VECTOR,
+    'FLOAT16_VECTOR': DataType.FLOAT16_VECTOR,
+    'INT8_VECTOR': DataType.INT8_VECTOR,
+}
+# 向量量化为INT8_VECTOR时绝对值最大的分量对应的整数值
+INT8_VECTOR_SCALE = 127
+# 只保存量化后向量的索引类型，检索结果的相似度是近似值
+QUANTIZED_INDEX_TYPES = ('IVF_SQ8', 'IVF_PQ', 'HNSW_SQ', 'HNSW_PQ', 'IVF_RABITQ')
+
+
+def use_milvus_bm25():
+    """混合检索的BM25部分是否由Milvus服务端完成"""
+    return config.get('hybrid_search', {}).get('mode', 'python') == 'milvus'
+
+
+def use_hash_primary_key():
+    """新建collection的主键是否使用业务字段的确定性哈希（primary_key.mode为hash）"""
+    return config.get('primary_key', {}).get('mode', 'auto') == 'hash'
+
+
+def use_partition_key():
+    """新建collection是否以tenant_code作为Milvus分区键（partition_key.enabled）"""
+    return bool(config.get('partition_key', {}).get('enabled', False))
+
+
+def embedding_storage_dtype():
+    """新建collection的embedding字段存储类型（vector_storage.dtype）"""
+    return EMBEDDING_DTYPES[config.get('vector_storage', {}).get('dtype', 'FLOAT_VECTOR')]
+
+
+def to_storage_vectors(vectors, dtype):
+    """把全精度向量转换为embedding字段存储类型对应的数据，写入和检索时使用
 
-def qa_collection_schema():
-    """全局QA collection的schema，包含tenant_code和org_code字段"""
+    INT8_VECTOR按每个向量各自的最大绝对值缩放到[-127, 127]，索引使用COSINE度量，缩放不影响相似度
+    """
+    if dtype == DataType.FLOAT16_VECTOR:
+        return [np.asarray(v, dtype=np.float16) for v in vectors]
+    if dtype == DataType.INT8_VECTOR:
+        int8_vectors = []
+        for v in vectors:
+            v = np.asarray(v, dtype=np.float32)
+            scale = INT8_VECTOR_SCALE / max(float(np.abs(v).max()), 1e-12)
+            int8_vectors.append(np.clip(np.rint(v * scale), -127, 127).astype(np.int8))
+        return int8_vectors
+    return vectors
+
+
+def from_storage_vector(value, dtype):
+    """把从Milvus读出的embedding字段值还原为float32向量（迁移时使用）"""
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], bytes):
+        value = value[0]
+    if dtype == DataType.FLOAT16_VECTOR:
+        vector = np.frombuffer(value, dtype=np.float16) if isinstance(value, bytes) else np.asarray(value)
+        return vector.astype(np.float32)
+    if dtype == DataType.INT8_VECTOR:
+        # 量化时丢失了缩放系数，还原后重新归一化
+        vector = (np.frombuffer(value, dtype=np.int8) if isinstance(value, bytes) else np.asarray(value)).astype(np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+    return np.asarray(value, dtype=np.float32)
+
+
+def _stable_primary_key(*parts):
+    """由业务字段计算稳定的63位正整数主键"""
+    digest = hashlib.blake2b('\x1f'.join(str(p) for p in parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & ((1 << 63) - 1)
+
+
+def qa_primary_key(tenant_code, org_code, question):
+    """问答对的确定性主键：hash(tenant_code, org_code, question)"""
+    return _stable_primary_key(tenant_code or '', org_code or '', question)
+
+
+def doc_primary_key(tenant_code, org_code, file_name, block_id):
+    """文档块的确定性主键：hash(tenant_code, org_code, file_name, block_id)"""
+    return _stable_primary_key(tenant_code or '', org_code or '', file_name, block_id)
+
+
+def _text_field_kwargs(enable_sparse_bm25):
+    """BM25输入文本字段需要开启分词器"""
+    if not enable_sparse_bm25:
+        return {}
+    analyzer_params = config.get('hybrid_search', {}).get('analyzer_params', {'type': 'chinese'})
+    return {'enable_analyzer': True, 'analyzer_params': analyzer_params}
+
+
+def _append_sparse_bm25(fields, functions, text_field):
+    """追加BM25稀疏向量字段以及由text_field生成该字段的BM25 Function"""
+    fields.append(FieldSchema(name=SPARSE_BM25_FIELD, dtype=DataType.SPARSE_FLOAT_VECTOR))
+    functions.append(Function(name=f'{text_field}_bm25', function_type=FunctionType.BM25,
+                              input_field_names=[text_field], output_field_names=[SPARSE_BM25_FIELD]))
+
+
+def qa_collection_schema(enable_sparse_bm25=None, hash_primary_key=None, partition_key=None, vector_dtype=None):
+    """全局QA collection的schema，包含tenant_code和org_code字段
+
+    enable_sparse_bm25为True时对question字段开启分词并增加BM25稀疏向量字段，默认由hybrid_search.mode决定
+    hash_primary_key为True时主键由qa_primary_key计算而不是自动生成，默认由primary_key.mode决定
+    partition_key为True时tenant_code作为分区键，按租户过滤的检索/删除只访问该租户所在分区，默认由partition_key.enabled决定
+    vector_dtype为embedding字段的存储类型（FLOAT16_VECTOR/INT8_VECTOR可减少内存占用），默认由vector_storage.dtype决定
+    """
+    if enable_sparse_bm25 is None:
+        enable_sparse_bm25 = use_milvus_bm25()
+    if hash_primary_key is None:
+        hash_primary_key = use_hash_primary_key()
+    if partition_key is None:
+        partition_key = use_partition_key()
+    if vector_dtype is None:
+        vector_dtype = embedding_storage_dtype()
     fields = [
-        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
-        FieldSchema(name='question', dtype=DataType.VARCHAR, max_length=2000),
+        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=not hash_primary_key),
+        FieldSchema(name='question', dtype=DataType.VARCHAR, max_length=2000, **_text_field_kwargs(enable_sparse_bm25)),
         FieldSchema(name='answer', dtype=DataType.VARCHAR, max_length=20000),
         FieldSchema(name='source', dtype=DataType.VARCHAR, max_length=2000),
-        FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=200),
+        FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=200, is_partition_key=partition_key),
         FieldSchema(name='org_code', dtype=DataType.VARCHAR, max_length=200),
-        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=1024),
+        FieldSchema(name='embedding', dtype=vector_dtype, dim=1024),
         FieldSchema(name='metadata', dtype=DataType.JSON, max_length=2000)
     ]
-    return CollectionSchema(fields=fields)
+    functions = []
+    if enable_sparse_bm25:
+        _append_sparse_bm25(fields, functions, 'question')
+    return CollectionSchema(fields=fields, functions=functions)
 
 
-def doc_collection_schema():
-    """全局DOC collection的schema，包含tenant_code和org_code字段"""
+def doc_collection_schema(enable_sparse_bm25=None, hash_primary_key=None, partition_key=None, vector_dtype=None):
+    """全局DOC collection的schema，包含tenant_code和org_code字段
+
+    enable_sparse_bm25为True时对content字段开启分词并增加BM25稀疏向量字段，默认由hybrid_search.mode决定
+    hash_primary_key为True时主键由doc_primary_key计算而不是自动生成，默认由primary_key.mode决定
+    partition_key为True时tenant_code作为分区键，按租户过滤的检索/删除只访问该租户所在分区，默认由partition_key.enabled决定
+    vector_dtype为embedding字段的存储类型（FLOAT16_VECTOR/INT8_VECTOR可减少内存占用），默认由vector_storage.dtype决定
+    """
+    if enable_sparse_bm25 is None:
+        enable_sparse_bm25 = use_milvus_bm25()
+    if hash_primary_key is None:
+        hash_primary_key = use_hash_primary_key()
+    if partition_key is None:
+        partition_key = use_partition_key()
+    if vector_dtype is None:
+        vector_dtype = embedding_storage_dtype()
     fields = [
-        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=not hash_primary_key),
         FieldSchema(name='file_name', dtype=DataType.VARCHAR, max_length=2000),
         FieldSchema(name='block_id', dtype=DataType.INT64, is_primary=False),
-        FieldSchema(name='content', dtype=DataType.VARCHAR, max_length=20000),
+        FieldSchema(name='content', dtype=DataType.VARCHAR, max_length=20000, **_text_field_kwargs(enable_sparse_bm25)),
         FieldSchema(name='source', dtype=DataType.VARCHAR, max_length=2000),
-        FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=200),
+        FieldSchema(name='tenant_code', dtype=DataType.VARCHAR, max_length=200, is_partition_key=partition_key),
         FieldSchema(name='org_code', dtype=DataType.VARCHAR, max_length=200),
-        FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=1024),
+        FieldSchema(name='embedding', dtype=vector_dtype, dim=1024),
         FieldSchema(name='metadata', dtype=DataType.JSON, max_length=2000)
     ]
-    return CollectionSchema(fields=fields)
+    functions = []
+    if enable_sparse_bm25:
+        _append_sparse_bm25(fields, functions, 'content')
+    return CollectionSchema(fields=fields, functions=functions)
+
+
+def has_sparse_bm25(collection):
+    """collection是否包含Milvus BM25稀疏向量字段"""
+    return any(f.name == SPARSE_BM25_FIELD for f in collection.schema.fields)
+
+
+def has_hash_primary_key(collection):
+    """collection的主键是否为确定性哈希（非auto_id）"""
+    return not collection.schema.auto_id
+
+
+def has_partition_key(collection):
+    """collection是否以tenant_code作为分区键"""
+    return any(getattr(f, 'is_partition_key', False) for f in collection.schema.fields)
+
+
+def get_embedding_dtype(collection):
+    """collection的embedding字段存储类型"""
+    return next(f.dtype for f in collection.schema.fields if f.name == 'embedding')
+
+
+def needs_rescore(collection):
+    """检索结果是否需要用全精度向量重打分：embedding字段为低精度存储或使用量化索引，且开启了vector_storage.rescore
+
+    全精度向量来自文档块向量存储，未开启存储时不重打分
+    """
+    if not config.get('vector_storage', {}).get('rescore', {}).get('enabled', True):
+        return False
+    index_params = get_field_index_params(collection, 'embedding') or {}
+    if get_embedding_dtype(collection) == DataType.FLOAT_VECTOR and index_params.get('index_type') not in QUANTIZED_INDEX_TYPES:
+        return False
+    if get_chunk_embedding_store() is None:
+        logger.warning(f"collection[{collection.name}]为低精度向量或量化索引，但未开启chunk_embedding_store，检索结果不做全精度重打分")
+        return False
+    return True
+
+
+def collection_create_kwargs(schema):
+    """新建collection时除schema外的参数：带分区键的schema需要指定分区数"""
+    if any(getattr(f, 'is_partition_key', False) for f in schema.fields):
+        return {'num_partitions': config.get('partition_key', {}).get('num_partitions', 64)}
+    return {}
+
+
+def get_output_fields(collection):
+    """检索结果返回的字段（排除向量字段）"""
+    return [f.name for f in collection.schema.fields if f.dtype not in VECTOR_DTYPES]
 
 
 def get_global_collections():
@@ -73,6 +409,43 @@ def get_global_collections():
     return global_db_name, global_collection_qa_name, global_collection_doc_name
 
 
+# 进程内共享的Milvus连接，缓存collection句柄及字段元数据
+# 缓存的collection句柄每隔schema_check_seconds检查一次collection ID，离线迁移替换collection后服务无需重启
+milvus_manager = MilvusConnectionManager(host=config['milvus']['host'], port=config['milvus']['port'],
+                                         db_name=get_global_collections()[0],
+                                         schema_check_seconds=config['milvus'].get('schema_check_seconds', 10))
+
+
+def _on_collection_replaced(collection_name):
+    """collection被其他进程替换（迁移后主键可能重新生成）：按主键缓存的BM25索引和检索结果全部失效"""
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    collection_type = {global_collection_qa_name: 'QA', global_collection_doc_name: 'DOC'}.get(collection_name)
+    bm25_store.invalidate(collection_type=collection_type)
+    invalidate_search_results(collection_type)
+
+
+milvus_manager.add_replaced_listener(_on_collection_replaced)
+
+
+def _build_collection_metadata(collection):
+    """计算检索时需要的collection元数据"""
+    return {
+        'output_fields': get_output_fields(collection),
+        'has_sparse_bm25': has_sparse_bm25(collection),
+        'hash_primary_key': has_hash_primary_key(collection),
+        'partition_key': has_partition_key(collection),
+        'embedding_dtype': get_embedding_dtype(collection),
+        'rescore': needs_rescore(collection),
+        # 与embedding字段实际索引匹配的检索参数
+        'search_params': search_params_for_index(config, get_field_index_params(collection, 'embedding'))
+    }
+
+
+def get_collection_metadata(collection_name):
+    """获取缓存的collection元数据，collection不存在时返回None"""
+    return milvus_manager.get_metadata(collection_name, _build_collection_metadata)
+
+
 def ensure_index_exists(collection, field_name, index_params):
     """确保字段索引存在，如果不存在则创建"""
     try:
@@ -93,60 +466,86 @@ def ensure_index_exists(collection, field_name, index_params):
         raise
 
 
+def get_field_index_params(collection, field_name):
+    """返回字段上已有索引的参数（index_type、metric_type、params），没有索引时返回None"""
+    for idx in collection.indexes:
+        if idx.field_name == field_name:
+            return idx.params
+    return None
+
+
+def ensure_collection_indexes(collection, index_profile=None):
+    """确保collection的embedding、tenant_code、org_code以及BM25稀疏向量字段索引都存在
+
+    embedding字段按index_profile指定的索引方案建索引，默认由index_profile.active决定（默认FLAT，auto为按实体数选择）；
+    已有索引不会被修改，与推荐方案不一致时只提示，需要通过迁移命令离线重建
+    """
+    num_entities = collection.num_entities
+    profile_name = resolve_profile(config, num_entities, index_profile)
+    varchar_index_params = config.get('varchar_index_params', {'index_type': 'INVERTED'})
+    current_index_params = get_field_index_params(collection, 'embedding')
+    if current_index_params is None:
+        logger.info(f"collection[{collection.name}]使用索引方案[{profile_name}]，实体数{num_entities}")
+    ensure_index_exists(collection, "embedding", get_profile(config, profile_name)['index_params'])
+    if current_index_params is not None and index_profile is None:
+        current_profile = find_profile_for_index(config, current_index_params)
+        recommended = recommend_profile(config, num_entities)
+        if current_profile != recommended:
+            logger.info(f"collection[{collection.name}]实体数{num_entities}，当前索引方案[{current_profile}]，"
+                        f"推荐方案[{recommended}]，可执行 python -m milvus.migration index_profile --profile auto 重建索引")
+    ensure_index_exists(collection, "tenant_code", varchar_index_params)
+    ensure_index_exists(collection, "org_code", varchar_index_params)
+    if has_sparse_bm25(collection):
+        sparse_index_params = config.get('hybrid_search', {}).get(
+            'sparse_index_params', {'index_type': 'SPARSE_INVERTED_INDEX', 'metric_type': 'BM25'})
+        ensure_index_exists(collection, SPARSE_BM25_FIELD, sparse_index_params)
+    elif use_milvus_bm25():
+        logger.warning(f"collection[{collection.name}]没有BM25稀疏向量字段，混合检索将回退到Python BM25，"
+                       f"可执行 python -m milvus.migration sparse_bm25 迁移已有数据")
+
+
 def create_collection():
     """创建全局向量库和两个全局collection（如果不存在）"""
     logger.info(f"调用方法:create_collection，创建全局向量库和collection")
 
-    config_milvus_dic = config['milvus']
-    index_params = config['index_params']
-    varchar_index_params = config.get('varchar_index_params', {'index_type': 'INVERTED'})
-    
     global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
 
-    # 连接并创建全局数据库（如果不存在）
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'])
-    if global_db_name not in db.list_database():
-        db.create_database(global_db_name)
-        logger.info(f"全局数据库[{global_db_name}]创建成功")
-    
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
+    # 创建全局数据库（如果不存在）并连接
+    milvus_manager.ensure_database()
+    milvus_manager.connect()
+    exist_collection_list = utility.list_collections(using=milvus_manager.alias)
+    # collection可能被新建或修改了索引，失效缓存的句柄和元数据
+    milvus_manager.invalidate()
+    invalidate_search_results()
     
     # 创建全局QA collection（如果不存在）
     if global_collection_qa_name not in exist_collection_list:
-        collection = Collection(global_collection_qa_name, schema=qa_collection_schema())
-        # 为embedding字段创建向量索引
-        collection.create_index(field_name="embedding", index_params=index_params)
-        # 为tenant_code和org_code字段创建VARCHAR索引
-        collection.create_index(field_name="tenant_code", index_params=varchar_index_params)
-        collection.create_index(field_name="org_code", index_params=varchar_index_params)
+        schema = qa_collection_schema()
+        collection = Collection(global_collection_qa_name, schema=schema, using=milvus_manager.alias,
+                                **collection_create_kwargs(schema))
+        # 为embedding、tenant_code、org_code（以及BM25稀疏向量）字段创建索引
+        ensure_collection_indexes(collection)
         collection.load()
         logger.info(f"全局向量库[{global_collection_qa_name}]创建成功，已为embedding、tenant_code、org_code字段创建索引")
     else:
         # collection已存在，检查并创建缺失的索引
-        collection = Collection(global_collection_qa_name)
-        ensure_index_exists(collection, "embedding", index_params)
-        ensure_index_exists(collection, "tenant_code", varchar_index_params)
-        ensure_index_exists(collection, "org_code", varchar_index_params)
+        collection = milvus_manager.get_collection(global_collection_qa_name)
+        ensure_collection_indexes(collection)
         logger.info(f"全局向量库[{global_collection_qa_name}]已存在，已确保所有索引存在")
     
     # 创建全局DOC collection（如果不存在）
     if global_collection_doc_name not in exist_collection_list:
-        collection = Collection(global_collection_doc_name, schema=doc_collection_schema())
-        # 为embedding字段创建向量索引
-        collection.create_index(field_name="embedding", index_params=index_params)
-        # 为tenant_code和org_code字段创建VARCHAR索引
-        collection.create_index(field_name="tenant_code", index_params=varchar_index_params)
-        collection.create_index(field_name="org_code", index_params=varchar_index_params)
+        schema = doc_collection_schema()
+        collection = Collection(global_collection_doc_name, schema=schema, using=milvus_manager.alias,
+                                **collection_create_kwargs(schema))
+        # 为embedding、tenant_code、org_code（以及BM25稀疏向量）字段创建索引
+        ensure_collection_indexes(collection)
         collection.load()
         logger.info(f"全局向量库[{global_collection_doc_name}]创建成功，已为embedding、tenant_code、org_code字段创建索引")
     else:
         # collection已存在，检查并创建缺失的索引
-        collection = Collection(global_collection_doc_name)
-        ensure_index_exists(collection, "embedding", index_params)
-        ensure_index_exists(collection, "tenant_code", varchar_index_params)
-        ensure_index_exists(collection, "org_code", varchar_index_params)
+        collection = milvus_manager.get_collection(global_collection_doc_name)
+        ensure_collection_indexes(collection)
         logger.info(f"全局向量库[{global_collection_doc_name}]已存在，已确保所有索引存在")
 
     logger.info(f"全局向量库和collection初始化完成")
@@ -157,42 +556,39 @@ def delete_collection(tenant_code=None, org_code=None):
     """删除全局collection中的数据（根据tenant_code和org_code过滤）"""
     logger.info(f"调用方法:delete_collection，参数为:tenant_code={tenant_code}, org_code={org_code}")
 
-    config_milvus_dic = config['milvus']
-    global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
-
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
 
-    if global_collection_qa_name not in exist_collection_list:
+    # 重新获取collection句柄，避免使用其他进程删除/重建前的缓存
+    milvus_manager.invalidate(global_collection_qa_name)
+    milvus_manager.invalidate(global_collection_doc_name)
+    qa_collection = milvus_manager.get_collection(global_collection_qa_name)
+    if qa_collection is None:
         logger.error(f"全局向量库[{global_collection_qa_name}]不存在")
         return False, f"全局向量库[{global_collection_qa_name}]不存在"
 
-    if global_collection_doc_name not in exist_collection_list:
+    doc_collection = milvus_manager.get_collection(global_collection_doc_name)
+    if doc_collection is None:
         logger.error(f"全局向量库[{global_collection_doc_name}]不存在")
         return False, f"全局向量库[{global_collection_doc_name}]不存在"
 
     # 构建过滤表达式
-    filter_expr = ""
-    if tenant_code and org_code:
-        filter_expr = f"tenant_code == '{tenant_code}' && org_code == '{org_code}'"
-    elif tenant_code:
-        filter_expr = f"tenant_code == '{tenant_code}'"
-    elif org_code:
-        filter_expr = f"org_code == '{org_code}'"
-
-    deleted_count = 0
+    filter_expr = build_scope_filter(tenant_code, org_code)
+
     if filter_expr:
+        # tenant_code为分区键时，带tenant_code条件的delete只扫描该租户所在的分区
         # 删除QA collection中的数据
-        qa_collection = Collection(global_collection_qa_name)
-        qa_collection.delete(filter_expr)
-        qa_collection.flush()
+        qa_res = qa_collection.delete(filter_expr)
+        flush_scheduler.mark_dirty(qa_collection, qa_res.delete_count)
         logger.info(f"从全局QA向量库删除数据，过滤条件: {filter_expr}")
 
         # 删除DOC collection中的数据
-        doc_collection = Collection(global_collection_doc_name)
-        doc_collection.delete(filter_expr)
-        doc_collection.flush()
+        doc_res = doc_collection.delete(filter_expr)
+        flush_scheduler.mark_dirty(doc_collection, doc_res.delete_count)
         logger.info(f"从全局DOC向量库删除数据，过滤条件: {filter_expr}")
+
+        bm25_store.invalidate(tenant_code=tenant_code, org_code=org_code)
+        for collection_type in ('QA', 'DOC'):
+            invalidate_search_results(collection_type, tenant_code or None, org_code or None)
     else:
         logger.warning("未提供tenant_code或org_code，无法删除数据")
 
@@ -200,78 +596,180 @@ def delete_collection(tenant_code=None, org_code=None):
     return True, f"从全局向量库删除数据成功"
 
 
+def escape_expr_literal(value):
+    """转义Milvus表达式中单引号字符串字面量的内容"""
+    return str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def scope_filter_parts(tenant_code, org_code, strict=False):
+    """构建tenant_code/org_code过滤条件列表
+
+    strict为False时空值不加入条件（不限制），为True时空值也按等于空字符串过滤
+    """
+    parts = []
+    if strict or tenant_code:
+        parts.append(f"tenant_code == '{escape_expr_literal(tenant_code or '')}'")
+    if strict or org_code:
+        parts.append(f"org_code == '{escape_expr_literal(org_code or '')}'")
+    return parts
+
+
+def build_scope_filter(tenant_code, org_code):
+    """构建tenant_code/org_code过滤表达式，空值不加入条件"""
+    return " && ".join(scope_filter_parts(tenant_code, org_code))
+
+
+def _batch_expr_terms(terms, separator=', '):
+    """把表达式片段按条数和拼接后的长度分批，每批同时受expr_batch.max_items和expr_batch.max_chars限制"""
+    max_items = config.get('expr_batch', {}).get('max_items', 500)
+    max_chars = config.get('expr_batch', {}).get('max_chars', 60000)
+
+    batch = []
+    batch_chars = 0
+    for term in terms:
+        if batch and (len(batch) >= max_items or batch_chars + len(term) + len(separator) > max_chars):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(term)
+        batch_chars += len(term) + len(separator)
+    if batch:
+        yield batch
+
+
+def _in_expr_batches(field_name, values, extra_parts=()):
+    """把values拆成多批field_name in [...]表达式，每批同时受元素数量和表达式长度限制"""
+    suffix = "".join(f" && {part}" for part in extra_parts)
+    literals = [f"'{escape_expr_literal(value)}'" for value in dict.fromkeys(values)]
+    for batch in _batch_expr_terms(literals):
+        yield batch, f"{field_name} in [{', '.join(batch)}]{suffix}"
+
+
+def _query_existing_values(collection, field_name, values, extra_parts=()):
+    """分批查询collection中已存在的field_name取值，每批一次query"""
+    existing = set()
+    for _, expr in _in_expr_batches(field_name, values, extra_parts):
+        res = collection.query(expr=expr, output_fields=[field_name], limit=16384, **consistency_kwargs('query'))
+        existing.update(item[field_name] for item in res)
+    return existing
+
+
+def _delete_in_batches(collection, field_name, values, extra_parts=()):
+    """分批按field_name in [...]删除，每批一次delete，返回删除的行数"""
+    deleted = 0
+    for _, expr in _in_expr_batches(field_name, values, extra_parts):
+        res = collection.delete(expr)
+        deleted += res.delete_count
+    return deleted
+
+
+def _delete_stale_blocks(collection, tenant_code, org_code, block_counts):
+    """删除文档重新分块后多出来的旧块（block_id >= 新块数），多个文档合并到一个delete表达式"""
+    scope_expr = " && ".join(scope_filter_parts(tenant_code, org_code, strict=True))
+    conditions = [f"(file_name == '{escape_expr_literal(name)}' && block_id >= {count})"
+                  for name, count in block_counts.items()]
+    deleted = 0
+    for batch in _batch_expr_terms(conditions, separator=' || '):
+        res = collection.delete(f"({' || '.join(batch)}) && {scope_expr}")
+        deleted += res.delete_count
+    return deleted
+
+
+def _rows_to_entities(rows, primary_keys):
+    """将写入的行数据和返回的主键组装成检索结果形式的实体（不含向量）"""
+    entities = []
+    for row, pk in zip(rows, primary_keys):
+        entity = {k: v for k, v in row.items() if k != 'embedding'}
+        entity['id'] = pk
+        entities.append(entity)
+    return entities
+
+
 def insert_qa_to_collection(tenant_code, org_code, question_list, answer_list, source_list, metadata_list):
     """插入QA到全局collection，org_code就是org_code"""
     logger.info(f"调用方法:insert_qa_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 问答对数量={len(question_list)}")
     
-    config_milvus_dic = config['milvus']
-    global_db_name, global_collection_qa_name, _ = get_global_collections()
+    _, global_collection_qa_name, _ = get_global_collections()
 
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_qa_name not in exist_collection_list:
+    collection = milvus_manager.get_collection(global_collection_qa_name)
+    if collection is None:
         logger.error(f"全局向量库[{global_collection_qa_name}]不存在，请先创建")
         return False, f"全局向量库[{global_collection_qa_name}]不存在，请先创建"
 
-    collection = Collection(name=global_collection_qa_name)
-
     # org_code就是org_code
     org_code = org_code
 
-    # 检查已存在的问题，如果存在则先删除
+    # 主键为确定性哈希时，已存在的问题直接由upsert覆盖，无需先查询和删除
+    collection_metadata = get_collection_metadata(global_collection_qa_name)
+    hash_primary_key = collection_metadata['hash_primary_key']
+
+    # 检查已存在的问题（按批使用in表达式查询），如果存在则先删除
     exist_quest_count = 0
     to_delete_questions = []
-    for i in range(len(question_list)):
-        q = question_list[i]
-        escaped_question = q.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"question == '{escaped_question}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        res = collection.query(expr=filter_expr)
-        if len(res) > 0:
-            exist_quest_count += 1
-            to_delete_questions.append(q)
-            logger.info(f'新增问答对：问题=[{q}] 已经存在，将先删除再插入')
+    if not hash_primary_key:
+        scope_parts = scope_filter_parts(tenant_code, org_code, strict=True)
+        existing_questions = _query_existing_values(collection, 'question', question_list, scope_parts)
+        to_delete_questions = [q for q in dict.fromkeys(question_list) if q in existing_questions]
+        exist_quest_count = len(to_delete_questions)
 
     # 如果存在相同的问题，先删除
     if len(to_delete_questions) > 0:
-        logger.info(f'检测到{len(to_delete_questions)}个已存在的问题，开始删除: {to_delete_questions}')
-        for question in to_delete_questions:
-            escaped_question = question.replace("'", "\\'")
-            filter_expr = f"question == '{escaped_question}' && tenant_code == '{tenant_code}' && org_code == '{org_code}'"
-            collection.delete(filter_expr)
-        collection.flush()
+        logger.info(f'检测到{len(to_delete_questions)}个已存在的问题，将先删除再插入: {to_delete_questions}')
+        deleted_count = _delete_in_batches(collection, 'question', to_delete_questions, scope_parts)
+        flush_scheduler.mark_dirty(collection, deleted_count)
+        deleted_questions = set(to_delete_questions)
+        bm25_store.remove_entities('QA', tenant_code, org_code,
+                                   lambda e: e.get('question') in deleted_questions
+                                   and e.get('tenant_code') == tenant_code and e.get('org_code') == org_code)
         logger.info(f'已删除{len(to_delete_questions)}个已存在的问题')
 
     if len(question_list) == 0:
         logger.info(f'新增问答对0条')
         return True, f'新增问答对0条'
 
-    question_embeddings = embedding_model.embed_documents(question_list)
+    question_embeddings = to_storage_vectors(embed_chunks(question_list), collection_metadata['embedding_dtype'])
     
-    # 准备数据：question, answer, source, tenant_code, org_code, embedding, metadata
-    tenant_code_list = [tenant_code] * len(question_list)
-    org_code_list = [org_code] * len(question_list)
-    
-    data = [question_list, answer_list, source_list, 
-            tenant_code_list, org_code_list, question_embeddings, metadata_list]
-    collection.insert(data=data)
-    collection.flush()
-    logger.info(f'插入全局向量库[{global_collection_qa_name}]成功，新增问答对{len(question_list)}条，其中{exist_quest_count}条是删除后重新插入的')
+    # 按行准备数据（BM25稀疏向量等Function输出字段由Milvus生成，不需要传入）
+    rows = [{'question': question_list[i], 'answer': answer_list[i], 'source': source_list[i],
+             'tenant_code': tenant_code, 'org_code': org_code, 'embedding': question_embeddings[i],
+             'metadata': metadata_list[i]}
+            for i in range(len(question_list))]
+    if hash_primary_key:
+        # 同一批中重复的问题只保留最后一条
+        rows = list({qa_primary_key(tenant_code, org_code, row['question']): row for row in rows}.items())
+        rows = [dict(row, id=pk) for pk, row in rows]
+        collection.upsert(data=rows)
+        primary_keys = [row['id'] for row in rows]
+    else:
+        insert_res = collection.insert(data=rows)
+        primary_keys = insert_res.primary_keys
+    flush_scheduler.mark_dirty(collection, len(rows))
+
+    # 增量更新已构建的BM25索引（相同主键的实体会被覆盖）
+    bm25_store.add_entities('QA', tenant_code, org_code, _rows_to_entities(rows, primary_keys))
+    invalidate_search_results('QA', tenant_code, org_code)
+    # 确定性主键模式下不查询已存在的问题，upsert直接覆盖，无法统计重新插入的条数
+    if hash_primary_key:
+        exist_detail = '，已存在的问题直接覆盖'
+    else:
+        exist_detail = f'，其中{exist_quest_count}条是删除后重新插入的'
+    logger.info(f'插入全局向量库[{global_collection_qa_name}]成功，新增问答对{len(question_list)}条{exist_detail}')
 
-    return True, f"插入全局向量库成功，新增问答对{len(question_list)}条，其中{exist_quest_count}条是删除后重新插入的"
+    return True, f"插入全局向量库成功，新增问答对{len(question_list)}条{exist_detail}"
 
 
 def upsert_qa_to_collection(tenant_code, org_code, question_list, answer_list, source_list, metadata_list):
-    """更新QA到全局collection（先删除后插入），org_code就是org_code"""
+    """更新QA到全局collection，org_code就是org_code
+
+    主键为确定性哈希的collection直接upsert，否则先删除后插入
+    """
     logger.info(f"调用方法:upsert_qa_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 问答对数量={len(question_list)}")
 
+    _, global_collection_qa_name, _ = get_global_collections()
+    collection_metadata = get_collection_metadata(global_collection_qa_name)
+    if collection_metadata is not None and collection_metadata['hash_primary_key']:
+        return insert_qa_to_collection(tenant_code, org_code, question_list, answer_list, source_list, metadata_list)
+
     # 先删除已存在的问答对
     is_succ, msg = delete_qa_from_collection(tenant_code, org_code, question_list)
     if not is_succ:
@@ -294,49 +792,39 @@ def insert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_
     """插入文档到全局collection，org_code就是org_code"""
     logger.info(f"调用方法:insert_docs_to_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 文档数量={len(doc_name_list)}")
     
-    config_milvus_dic = config['milvus']
-    global_db_name, _, global_collection_doc_name = get_global_collections()
+    _, _, global_collection_doc_name = get_global_collections()
 
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_doc_name not in exist_collection_list:
+    collection = milvus_manager.get_collection(global_collection_doc_name)
+    if collection is None:
         logger.error(f"全局向量库[{global_collection_doc_name}]不存在，请先创建")
         return False, f"全局向量库[{global_collection_doc_name}]不存在，请先创建"
 
-    collection = Collection(name=global_collection_doc_name)
-
     # org_code就是org_code
     org_code = org_code
 
-    # 检查已存在的文档，如果存在则先删除
+    # 主键为确定性哈希时，已存在的文档块直接由upsert覆盖，只需删除多余的旧块
+    collection_metadata = get_collection_metadata(global_collection_doc_name)
+    hash_primary_key = collection_metadata['hash_primary_key']
+
+    # 检查已存在的文档（按批使用in表达式查询，每个文档只需匹配第0块），如果存在则先删除
     exist_doc_count = 0
     to_delete_file_names = []
-    for i in range(len(doc_name_list)):
-        dname = doc_name_list[i]
-        escaped_dname = dname.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"file_name == '{escaped_dname}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        res = collection.query(expr=filter_expr)
-        if len(res) > 0:
-            exist_doc_count += 1
-            to_delete_file_names.append(dname)
-            logger.info(f'新增文档：file_name=[{dname}] 已经存在，将先删除再插入')
+    if not hash_primary_key:
+        scope_parts = scope_filter_parts(tenant_code, org_code, strict=True)
+        existing_file_names = _query_existing_values(collection, 'file_name', doc_name_list,
+                                                     scope_parts + ['block_id == 0'])
+        to_delete_file_names = [d for d in dict.fromkeys(doc_name_list) if d in existing_file_names]
+        exist_doc_count = len(to_delete_file_names)
 
     # 如果存在同名文件，先删除
     if len(to_delete_file_names) > 0:
-        logger.info(f'检测到{len(to_delete_file_names)}个已存在的文档，开始删除: {to_delete_file_names}')
-        for file_name in to_delete_file_names:
-            escaped_file_name = file_name.replace("'", "\\'")
-            filter_expr = f"file_name == '{escaped_file_name}' && tenant_code == '{tenant_code}' && org_code == '{org_code}'"
-            collection.delete(filter_expr)
-        collection.flush()
+        logger.info(f'检测到{len(to_delete_file_names)}个已存在的文档，将先删除再插入: {to_delete_file_names}')
+        deleted_count = _delete_in_batches(collection, 'file_name', to_delete_file_names, scope_parts)
+        flush_scheduler.mark_dirty(collection, deleted_count)
+        deleted_file_names = set(to_delete_file_names)
+        bm25_store.remove_entities('DOC', tenant_code, org_code,
+                                   lambda e: e.get('file_name') in deleted_file_names
+                                   and e.get('tenant_code') == tenant_code and e.get('org_code') == org_code)
         logger.info(f'已删除{len(to_delete_file_names)}个已存在的文档')
 
     if len(doc_name_list) == 0:
@@ -349,14 +837,9 @@ def insert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_
     new_doc_content_block_list = []
     new_source_list = []
     new_metadata_list = []
+    block_counts = {}
 
-    CHUNK_LEN = config['split']['chunk_size']
-    OVERLAP = config['split']['overlap']
-
-    text_spliter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_LEN, chunk_overlap=OVERLAP,
-        length_function=len, keep_separator=False
-    )
+    text_spliter = get_text_splitter()
     for i in range(len(doc_content_list)):
         cnt = doc_content_list[i]
         dname = doc_name_list[i]
@@ -364,6 +847,7 @@ def insert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_
         metadata = metadata_list[i]
 
         blocks = text_spliter.split_text(cnt)
+        block_counts[dname] = len(blocks)
         for k in range(len(blocks)):
             new_doc_name_list.append(dname)
             new_doc_block_id_list.append(k)
@@ -371,20 +855,54 @@ def insert_docs_to_collection(tenant_code, org_code, doc_name_list, doc_content_
             new_source_list.append(dsource)
             new_metadata_list.append(metadata)
 
-    block_embeddings = embedding_model.embed_documents(new_doc_content_block_list)
     logger.info(f"文档分块完成，共{len(new_doc_content_block_list)}个块，开始生成向量嵌入")
     
-    # 准备数据：file_name, block_id, content, source, tenant_code, org_code, embedding, metadata
-    tenant_code_list = [tenant_code] * len(new_doc_content_block_list)
-    org_code_list = [org_code] * len(new_doc_content_block_list)
-    
-    data = [new_doc_name_list, new_doc_block_id_list, new_doc_content_block_list, new_source_list,
-            tenant_code_list, org_code_list, block_embeddings, new_metadata_list]
-    collection.insert(data=data)
-    collection.flush()
-    logger.info(f"插入docs到全局向量库[{global_collection_doc_name}]成功,新增文档{len(doc_name_list)}条，已经存在而无需新增的文档{exist_doc_count}条，共插入{len(new_doc_content_block_list)}个文档块")
+    # 按行准备数据（BM25稀疏向量等Function输出字段由Milvus生成，不需要传入；向量按窗口计算后再填入）
+    rows = [{'file_name': new_doc_name_list[i], 'block_id': new_doc_block_id_list[i],
+             'content': new_doc_content_block_list[i], 'source': new_source_list[i],
+             'tenant_code': tenant_code, 'org_code': org_code,
+             'metadata': new_metadata_list[i]}
+            for i in range(len(new_doc_content_block_list))]
+    if hash_primary_key:
+        # 同一批中重复的文档只保留最后一份的块
+        rows = list({doc_primary_key(tenant_code, org_code, row['file_name'], row['block_id']): row
+                     for row in rows}.items())
+        rows = [dict(row, id=pk) for pk, row in rows if row['block_id'] < block_counts[row['file_name']]]
+
+    # 逐窗口计算向量并写入，内存中只保留一个窗口的向量
+    primary_keys = []
+    for window_rows in iter_windows(rows, ingest_embedding_config.get('window_size', 256)):
+        block_embeddings = to_storage_vectors(embed_chunks([row['content'] for row in window_rows]),
+                                              collection_metadata['embedding_dtype'])
+        data = [dict(row, embedding=embedding) for row, embedding in zip(window_rows, block_embeddings)]
+        if hash_primary_key:
+            collection.upsert(data=data)
+            primary_keys.extend(row['id'] for row in window_rows)
+        else:
+            insert_res = collection.insert(data=data)
+            primary_keys.extend(insert_res.primary_keys)
+        flush_scheduler.mark_dirty(collection, len(data))
+        del data, block_embeddings
+
+    if hash_primary_key:
+        stale_count = _delete_stale_blocks(collection, tenant_code, org_code, block_counts)
+        bm25_store.remove_entities('DOC', tenant_code, org_code,
+                                   lambda e: e.get('file_name') in block_counts
+                                   and e.get('block_id', 0) >= block_counts[e.get('file_name')]
+                                   and e.get('tenant_code') == tenant_code and e.get('org_code') == org_code)
+        logger.info(f"文档块按确定性主键upsert完成，删除多余的旧块{stale_count}个")
+
+    # 增量更新已构建的BM25索引（相同主键的实体会被覆盖）
+    bm25_store.add_entities('DOC', tenant_code, org_code, _rows_to_entities(rows, primary_keys))
+    invalidate_search_results('DOC', tenant_code, org_code)
+    # 确定性主键模式下不查询已存在的文档，upsert直接覆盖，无法统计已存在的文档数
+    if hash_primary_key:
+        exist_detail = '，已存在的文档直接覆盖'
+    else:
+        exist_detail = f'，已经存在而无需新增的文档{exist_doc_count}条'
+    logger.info(f"插入docs到全局向量库[{global_collection_doc_name}]成功,新增文档{len(doc_name_list)}条{exist_detail}，共插入{len(new_doc_content_block_list)}个文档块")
     
-    return True, f"插入docs到全局向量库成功,新增文档{len(doc_name_list)}条，已经存在而无需新增的文档{exist_doc_count}条"
+    return True, f"插入docs到全局向量库成功,新增文档{len(doc_name_list)}条{exist_detail}"
 
 
 def delete_qa_from_collection(tenant_code, org_code, question_list):
@@ -392,32 +910,27 @@ def delete_qa_from_collection(tenant_code, org_code, question_list):
     logger.info(f"调用方法:delete_qa_from_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 待删除问题数量={len(question_list)}")
     logger.info(f'待删除的问题列表: {question_list}')
 
-    config_milvus_dic = config['milvus']
-    global_db_name, global_collection_qa_name, _ = get_global_collections()
+    _, global_collection_qa_name, _ = get_global_collections()
 
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_qa_name not in exist_collection_list:
+    collection = milvus_manager.get_collection(global_collection_qa_name)
+    if collection is None:
         logger.error(f"全局向量库[{global_collection_qa_name}]不存在")
         return False, f"全局向量库[{global_collection_qa_name}]不存在"
-
-    collection = Collection(global_collection_qa_name)
     
     # org_code就是org_code
     org_code = org_code
 
-    for question in question_list:
-        escaped_question = question.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"question == '{escaped_question}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        collection.delete(filter_expr)
-    collection.flush()
+    # 按批使用in表达式删除，只有当tenant_code和org_code不为空时才加入条件
+    deleted_count = _delete_in_batches(collection, 'question', question_list, scope_filter_parts(tenant_code, org_code))
+    flush_scheduler.mark_dirty(collection, deleted_count)
+    logger.info(f"删除问答对实际删除{deleted_count}行")
+
+    deleted_questions = set(question_list)
+    bm25_store.remove_entities('QA', tenant_code or None, org_code or None,
+                               lambda e: e.get('question') in deleted_questions
+                               and (not tenant_code or e.get('tenant_code') == tenant_code)
+                               and (not org_code or e.get('org_code') == org_code))
+    invalidate_search_results('QA', tenant_code or None, org_code or None)
 
     logger.info(f"从全局向量库[{global_collection_qa_name}]删除问答对成功，共删除{len(question_list)}条")
     return True, f"从全局向量库删除问答对成功"
@@ -428,127 +941,234 @@ def delete_docs_from_collection(tenant_code, org_code, doc_name_list):
     logger.info(f"调用方法:delete_docs_from_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, 待删除文档数量={len(doc_name_list)}")
     logger.info(f'待删除的文档列表: {doc_name_list}')
 
-    config_milvus_dic = config['milvus']
-    global_db_name, _, global_collection_doc_name = get_global_collections()
+    _, _, global_collection_doc_name = get_global_collections()
 
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-    
-    if global_collection_doc_name not in exist_collection_list:
+    collection = milvus_manager.get_collection(global_collection_doc_name)
+    if collection is None:
         logger.error(f"全局向量库[{global_collection_doc_name}]不存在")
         return False, f"全局向量库[{global_collection_doc_name}]不存在"
-
-    collection = Collection(global_collection_doc_name)
     
     # org_code就是org_code
     org_code = org_code
 
-    for file_name in doc_name_list:
-        escaped_file_name = file_name.replace("'", "\\'")
-        # 构建过滤表达式，只有当tenant_code和org_code不为空时才加入条件
-        filter_parts = [f"file_name == '{escaped_file_name}'"]
-        if tenant_code:
-            filter_parts.append(f"tenant_code == '{tenant_code}'")
-        if org_code:
-            filter_parts.append(f"org_code == '{org_code}'")
-        filter_expr = " && ".join(filter_parts)
-        collection.delete(filter_expr)
-    collection.flush()
+    # 按批使用in表达式删除，只有当tenant_code和org_code不为空时才加入条件
+    deleted_count = _delete_in_batches(collection, 'file_name', doc_name_list, scope_filter_parts(tenant_code, org_code))
+    flush_scheduler.mark_dirty(collection, deleted_count)
+    logger.info(f"删除文档实际删除{deleted_count}个文档块")
+
+    deleted_file_names = set(doc_name_list)
+    bm25_store.remove_entities('DOC', tenant_code or None, org_code or None,
+                               lambda e: e.get('file_name') in deleted_file_names
+                               and (not tenant_code or e.get('tenant_code') == tenant_code)
+                               and (not org_code or e.get('org_code') == org_code))
+    invalidate_search_results('DOC', tenant_code or None, org_code or None)
 
     logger.info(f"从全局向量库[{global_collection_doc_name}]删除文档成功，共删除{len(doc_name_list)}个文档")
     return True, f"从全局向量库删除文档成功"
 
 
-def _tokenize_chinese(text):
-    """中文分词函数"""
-    return list(jieba.cut(text))
+def _bm25_text_field(collection_type):
+    """BM25检索使用的文本字段"""
+    return 'question' if collection_type == 'QA' else 'content'
+
+
+def _bm25_key_fields(collection_type):
+    """常驻BM25索引中保存的键字段，用于写入/删除时按条件增量删除"""
+    if collection_type == 'QA':
+        return ('question', 'tenant_code', 'org_code')
+    return ('file_name', 'block_id', 'tenant_code', 'org_code')
+
+
+def _load_bm25_entities(collection, final_filter, collection_type, limit=None, key_fields=()):
+    """从Milvus分批拉取构建BM25索引所需的实体（只取id、文本字段和key_fields），limit不为None时最多取limit个"""
+    fields = list(dict.fromkeys(['id', _bm25_text_field(collection_type)] + list(key_fields)))
+    # expr参数是必需的，如果final_filter为空，使用主键id >= 0查询所有数据
+    expr = final_filter if final_filter else 'id >= 0'
+    batch_size = bm25_index_config.get('load_batch_size', 4096)
+
+    entities = []
+    iterator = collection.query_iterator(batch_size=batch_size, expr=expr, output_fields=fields,
+                                         **consistency_kwargs('query'))
+    try:
+        while limit is None or len(entities) < limit:
+            batch = iterator.next()
+            if not batch:
+                break
+            entities.extend(batch)
+    finally:
+        iterator.close()
+    if limit is not None:
+        entities = entities[:limit]
+
+    if len(entities) == 0:
+        logger.warning(f"没有找到符合条件的文档用于构建BM25索引，collection_type={collection_type}, filter={final_filter}")
+    return entities
 
 
 def _build_bm25_index(collection, final_filter, collection_type):
-    """从Milvus collection构建BM25索引"""
+    """从Milvus collection构建一次性的BM25索引（不缓存，用于带自定义过滤条件或文档数超过bm25_index.max_rows的检索）"""
     logger.info(f"开始构建BM25索引，collection_type={collection_type}, filter={final_filter}")
-    
-    # 确定要检索的文本字段
-    if collection_type == 'QA':
-        text_field = 'question'
-    else:
-        text_field = 'content'
-    
-    # 从Milvus获取所有文档
-    fields = [f.name for f in collection.schema.fields if f.name != 'embedding']
     try:
-        # 查询所有符合条件的文档
-        # expr参数是必需的，如果final_filter为空，使用主键id >= 0查询所有数据
-        if final_filter:
-            query_params = {
-                'expr': final_filter,
-                'output_fields': fields,
-                'limit': 16384  # Milvus默认最大查询数量
-            }
-        else:
-            # 当没有过滤条件时，使用主键id >= 0来查询所有数据
-            query_params = {
-                'expr': 'id >= 0',
-                'output_fields': fields,
-                'limit': 16384  # Milvus默认最大查询数量
-            }
-        
-        query_result = collection.query(**query_params)
-        
-        if len(query_result) == 0:
-            logger.warning("没有找到符合条件的文档用于构建BM25索引")
-            return None, []
-        
-        # 提取文本和对应的实体信息
-        texts = []
-        entities = []
-        for item in query_result:
-            text = item.get(text_field, '')
-            if text:
-                texts.append(text)
-                entities.append(item)
-        
-        if len(texts) == 0:
-            logger.warning("没有找到有效的文本内容用于构建BM25索引")
-            return None, []
-        
-        # 对文本进行分词
-        tokenized_texts = [_tokenize_chinese(text) for text in texts]
-        
-        # 构建BM25索引
-        bm25 = BM25Okapi(tokenized_texts)
-        logger.info(f"BM25索引构建完成，共{len(texts)}个文档")
-        
-        return bm25, entities
+        index = BM25Index(_bm25_text_field(collection_type))
+        index.add(_load_bm25_entities(collection, final_filter, collection_type))
+        logger.info(f"BM25索引构建完成，共{len(index)}个文档")
+        return index
     except Exception as e:
         import traceback
         logger.error(f"构建BM25索引时出错: {traceback.format_exc()}")
-        return None, []
+        return None
 
 
-def _bm25_search(bm25, entities, query, limit):
-    """使用BM25进行检索"""
-    if bm25 is None or len(entities) == 0:
-        return []
-    
-    # 对查询进行分词
-    tokenized_query = _tokenize_chinese(query)
-    
-    # BM25检索
-    scores = bm25.get_scores(tokenized_query)
-    
-    # 获取top-k结果
-    top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:limit]
-    
+def _get_bm25_index(collection, collection_type, tenant_code, org_code, final_filter, cacheable):
+    """获取检索范围对应的BM25索引
+
+    过滤条件只包含tenant_code/org_code且文档数不超过bm25_index.max_rows时复用进程内常驻索引，否则按过滤条件临时构建
+    """
+    if not cacheable:
+        return _build_bm25_index(collection, final_filter, collection_type)
+
+    try:
+        index = _get_resident_bm25_index(collection, collection_type, tenant_code, org_code, final_filter)
+    except Exception as e:
+        import traceback
+        logger.error(f"构建BM25索引时出错: {traceback.format_exc()}")
+        return None
+    if index is None:
+        return _build_bm25_index(collection, final_filter, collection_type)
+    return index
+
+
+def _get_resident_bm25_index(collection, collection_type, tenant_code, org_code, final_filter):
+    """获取（必要时构建）检索范围的常驻BM25索引，文档数超过bm25_index.max_rows时返回None"""
+    key = (collection_type, tenant_code or '', org_code or '')
+    key_fields = _bm25_key_fields(collection_type)
+    return bm25_store.get_or_build(
+        key, _bm25_text_field(collection_type),
+        lambda limit: _load_bm25_entities(collection, final_filter, collection_type, limit, key_fields),
+        key_fields
+    )
+
+
+def load_global_collections():
+    """加载全局collection到内存，并缓存句柄和元数据（服务预热），返回已加载的collection名称"""
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    loaded = []
+    for collection_name in (global_collection_qa_name, global_collection_doc_name):
+        collection = milvus_manager.get_collection(collection_name)
+        if collection is None:
+            logger.warning(f"全局向量库[{collection_name}]不存在，跳过加载")
+            continue
+        collection.load()
+        get_collection_metadata(collection_name)
+        loaded.append(collection_name)
+    return loaded
+
+
+def preload_bm25_index(collection_type, tenant_code='', org_code=''):
+    """预先构建检索范围的常驻BM25索引（服务预热），返回索引中的文档数；文档数超过bm25_index.max_rows不常驻时返回None"""
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    collection = milvus_manager.get_collection(global_collection_qa_name if collection_type == 'QA' else global_collection_doc_name)
+    if collection is None:
+        return 0
+    bm25_index = _get_resident_bm25_index(collection, collection_type, tenant_code, org_code,
+                                          build_scope_filter(tenant_code, org_code))
+    if bm25_index is None:
+        logger.warning(f"检索范围的文档数超过bm25_index.max_rows，不预建常驻BM25索引: "
+                       f"collection_type={collection_type}, tenant_code={tenant_code}, org_code={org_code}")
+        return None
+    return len(bm25_index)
+
+
+def _bm25_search_batch(bm25_index, query_list, limit):
+    """批量BM25检索，返回与query_list一一对应的结果列表
+
+    各查询依次在同一份已构建的索引上打分（每个查询只读取自身词项的倒排链）
+    """
+    if bm25_index is None:
+        return [[] for _ in query_list]
+    return [bm25_index.search(query, limit) for query in query_list]
+
+
+def _search_vectors(collection, query_embeddings, **search_kwargs):
+    """多查询向量检索：按batch_search.nq_per_request把查询向量分组，每组一次collection.search，结果按查询顺序拼接"""
+    nq_per_request = config.get('batch_search', {}).get('nq_per_request', 64)
     results = []
-    for idx in top_indices:
-        result = entities[idx].copy()
-        result['bm25_score'] = scores[idx]
-        results.append(result)
-    
+    for start in range(0, len(query_embeddings), nq_per_request):
+        res = collection.search(data=query_embeddings[start:start + nq_per_request], **search_kwargs,
+                                **consistency_kwargs('search'))
+        results.extend(res)
     return results
 
 
+# Milvus单次检索topk的上限
+MAX_SEARCH_TOPK = 16384
+
+# 检索范围的行数估计，(collection名, 过滤表达式) -> (行数, 统计时间)，按candidate_limit.count_ttl_seconds过期
+_row_counts = {}
+_row_counts_lock = threading.Lock()
+
+
+def _count_rows(collection, expr):
+    """统计满足过滤条件的行数（缓存一段时间，只用于估计过滤条件的选择性）"""
+    ttl_seconds = config.get('candidate_limit', {}).get('count_ttl_seconds', 300)
+    key = (collection.name, expr or '')
+    with _row_counts_lock:
+        cached = _row_counts.get(key)
+    if cached is not None and time.time() - cached[1] <= ttl_seconds:
+        return cached[0]
+    res = collection.query(expr=expr or '', output_fields=['count(*)'], **consistency_kwargs('query'))
+    count = res[0]['count(*)'] if res else 0
+    with _row_counts_lock:
+        _row_counts[key] = (count, time.time())
+    return count
+
+
+def candidate_limit(collection, final_filter, limit, scope_rows=None):
+    """混合检索每一路的候选数，替代固定的limit*5
+
+    过滤条件越有选择性（检索范围占collection的比例越小），带过滤的ANN检索召回越不稳定，候选倍数越大：
+    倍数在min_multiplier（不过滤）和max_multiplier（范围趋近于0）之间线性变化；
+    候选数不超过检索范围的行数（scope_rows为None时用count查询统计）
+    """
+    candidate_config = config.get('candidate_limit', {})
+    min_multiplier = candidate_config.get('min_multiplier', 3)
+    max_multiplier = candidate_config.get('max_multiplier', 8)
+    if not candidate_config.get('adaptive', True):
+        return min(limit * candidate_config.get('fixed_multiplier', 5), MAX_SEARCH_TOPK)
+    if not final_filter:
+        return min(limit * min_multiplier, MAX_SEARCH_TOPK)
+
+    try:
+        if scope_rows is None:
+            scope_rows = _count_rows(collection, final_filter)
+        total_rows = _count_rows(collection, '')
+    except Exception as e:
+        logger.warning(f"统计检索范围行数失败，使用最大候选倍数: {repr(e)}")
+        return min(limit * max_multiplier, MAX_SEARCH_TOPK)
+    selectivity = min(scope_rows / total_rows, 1.0) if total_rows else 1.0
+    multiplier = min_multiplier + (max_multiplier - min_multiplier) * (1 - selectivity)
+    candidates = min(math.ceil(limit * multiplier), max(scope_rows, limit), MAX_SEARCH_TOPK)
+    logger.info(f"检索范围{scope_rows}/{total_rows}行（选择性{selectivity:.4f}），候选倍数{multiplier:.2f}，每一路候选数{candidates}")
+    return candidates
+
+
+def range_search_params(search_params, similarity_threshold, rescore=False):
+    """把相似度阈值转换为Milvus范围检索参数（radius），只返回相似度超过阈值的结果
+
+    COSINE/IP相似度越大越相似，Milvus返回 score > radius 的结果；radius比阈值略小以保持阈值本身的结果（>=），
+    需要重打分的collection在Milvus中的分数是低精度向量的近似值，按rescore_margin放宽，最终仍以全精度分数过滤
+    """
+    range_config = config.get('range_search', {})
+    if similarity_threshold is None or not range_config.get('enabled', True):
+        return search_params
+    if search_params.get('metric_type', 'COSINE') not in ('COSINE', 'IP'):
+        return search_params
+    margin = range_config.get('rescore_margin', 0.02) if rescore else 1e-6
+    params = dict(search_params)
+    params['params'] = dict(search_params.get('params') or {}, radius=similarity_threshold - margin)
+    return params
+
+
 def _reciprocal_rank_fusion(vector_results, bm25_results, k=20, bm25_weight=1.2):
     """使用RRF（Reciprocal Rank Fusion）融合向量检索和BM25检索结果
     
@@ -618,8 +1238,179 @@ def _reciprocal_rank_fusion(vector_results, bm25_results, k=20, bm25_weight=1.2)
     return fused_results
 
 
-def search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr='', limit=5, use_hybrid=False, vector_similarity_threshold=None, rrf_similarity_threshold=None):
-    """从全局collection搜索
+# snippet模式下截断的长文本字段
+SNIPPET_FIELDS = ('content', 'answer')
+
+
+def resolve_output_fields(collection_fields, output_fields):
+    """返回检索结果的字段投影（总是包含id），output_fields为空时返回全部字段；有不存在的字段时抛出ValueError"""
+    if not output_fields:
+        return list(collection_fields)
+    unknown = [f for f in output_fields if f not in collection_fields]
+    if unknown:
+        raise ValueError(f"output_fields中的字段不存在: {unknown}，可选字段: {collection_fields}")
+    return ['id'] + [f for f in dict.fromkeys(output_fields) if f != 'id']
+
+
+def _fetch_payloads(collection, ids, fields):
+    """按主键分批查询最终结果的字段，返回id -> 实体"""
+    max_items = config.get('expr_batch', {}).get('max_items', 500)
+    ids = list(dict.fromkeys(ids))
+    payloads = {}
+    for start in range(0, len(ids), max_items):
+        batch = ids[start:start + max_items]
+        res = collection.query(expr=f"id in [{', '.join(str(i) for i in batch)}]", output_fields=fields,
+                               limit=len(batch), **consistency_kwargs('query'))
+        payloads.update((item['id'], item) for item in res)
+    return payloads
+
+
+def _finalize_entities(collection, entities, fields, collection_fields, snippet_length=None):
+    """补全最终结果的字段并按投影裁剪
+
+    候选检索只返回id和分数，缺少字段的最终结果（每个查询的top-k）在这里合并为一次按主键查询补全；
+    不在投影中的字段被移除（分数、排名等非collection字段保留），snippet_length大于0时截断长文本字段
+    """
+    missing_ids = [ent['id'] for query_entities in entities for ent in query_entities
+                   if any(f not in ent for f in fields)]
+    payloads = _fetch_payloads(collection, missing_ids, fields) if missing_ids else {}
+    if missing_ids:
+        logger.info(f"按主键补全{len(set(missing_ids))}条最终结果的字段")
+    dropped_fields = set(collection_fields) - set(fields)
+    for query_entities in entities:
+        for ent in query_entities:
+            payload = payloads.get(ent['id'])
+            if payload is not None:
+                for f in fields:
+                    ent.setdefault(f, payload.get(f))
+            for f in dropped_fields:
+                ent.pop(f, None)
+            if snippet_length:
+                for f in SNIPPET_FIELDS:
+                    if isinstance(ent.get(f), str) and len(ent[f]) > snippet_length:
+                        ent[f] = ent[f][:snippet_length]
+    return entities
+
+
+def _rescore_candidates(query_embedding, candidates, text_field):
+    """用全精度向量重新计算候选结果的相似度并按新分数排序
+
+    全精度向量为文档块向量存储中按文本内容哈希保存的float32向量，存储中没有的候选保留Milvus返回的分数
+    """
+    chunk_store = get_chunk_embedding_store()
+    hashes = [chunk_store.chunk_hash(c.get(text_field) or '') for c in candidates]
+    stored = chunk_store.get_many(hashes)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    for candidate, chunk_hash in zip(candidates, hashes):
+        vector = stored.get(chunk_hash)
+        if vector is not None:
+            candidate['score'] = float(vector @ query_vector)
+    candidates.sort(key=lambda c: c['score'], reverse=True)
+    return candidates
+
+
+def _milvus_hybrid_search(collection, query_list, final_filter, fields, limit, rrf_similarity_threshold, search_params,
+                          embedding_dtype=DataType.FLOAT_VECTOR, collection_fields=None, snippet_length=None):
+    """使用Milvus原生hybrid_search完成混合检索：稠密向量 + BM25稀疏向量两路召回，服务端RRF融合
+
+    所有查询合并为一次请求，BM25打分在Milvus集群内完成；RRF只使用排名，稠密向量一路不做全精度重打分。
+    output_fields只对融合后的top-k取回，fields为投影后的字段
+    """
+    hybrid_config = config.get('hybrid_search', {})
+    rrf_k = hybrid_config.get('rrf_k', 20)
+    # 每一路获取更多结果用于融合，候选数按过滤条件的选择性调整
+    num_candidates = candidate_limit(collection, final_filter, limit)
+    expr = final_filter if final_filter else None
+
+    logger.info(f"开始生成查询向量嵌入，查询数量={len(query_list)}")
+    query_embeddings = embed_queries(query_list)
+
+    dense_request = AnnSearchRequest(data=to_storage_vectors(query_embeddings, embedding_dtype), anns_field='embedding', param=search_params,
+                                     limit=num_candidates, expr=expr)
+    sparse_request = AnnSearchRequest(data=list(query_list), anns_field=SPARSE_BM25_FIELD,
+                                      param=hybrid_config.get('sparse_search_params', {'metric_type': 'BM25'}),
+                                      limit=num_candidates, expr=expr)
+    # Milvus的RRFRanker不支持为单路设置权重，bm25_weight配置在该模式下不生效
+    res = collection.hybrid_search([dense_request, sparse_request], rerank=RRFRanker(rrf_k), limit=limit,
+                                   output_fields=fields, **consistency_kwargs('search'))
+
+    ids = []
+    distances = []
+    entities = []
+    for hits in res:
+        query_ids = []
+        query_distances = []
+        ents = []
+        for hit in hits:
+            # 根据RRF相似度阈值过滤结果（如果提供了阈值）
+            if rrf_similarity_threshold is not None and hit.score < rrf_similarity_threshold:
+                continue
+            ent = {'id': hit.id}
+            for f in fields:
+                if f != 'id':
+                    ent[f] = hit.get(f)
+            ent['rrf_score'] = hit.score
+            ents.append(ent)
+            query_ids.append(hit.id)
+            query_distances.append(hit.score)
+        logger.info(f"Milvus混合检索共{len(hits)}条结果，阈值过滤后剩余{len(ents)}条（阈值={rrf_similarity_threshold}）")
+        ids.append(query_ids)
+        distances.append(query_distances)
+        entities.append(ents)
+    _finalize_entities(collection, entities, fields, collection_fields or fields, snippet_length)
+
+    ret_dic = {
+        "ids": ids,
+        "distances": distances,
+        "entities": entities
+    }
+    total_results = sum(len(e) for e in entities)
+    logger.info(f'Milvus混合检索完成，{len(ids)}个查询，共返回{total_results}条结果')
+    return ret_dic
+
+
+def search_from_collection(tenant_code, org_code, collection_type, query_list, filter_expr='', limit=5, use_hybrid=False, vector_similarity_threshold=None, rrf_similarity_threshold=None,
+                           output_fields=None, snippet_length=None):
+    """从全局collection搜索，相同参数的检索在数据未变化时直接返回缓存结果，
+    并发的相同检索只执行一次，其余请求共享其结果
+
+    参数含义与返回值同_search_from_collection_uncached
+    """
+    # key中包含collection名称和实际使用的检索参数：切换collection或索引/检索参数后不会命中之前的结果
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    collection_name = global_collection_qa_name if collection_type == 'QA' else global_collection_doc_name
+    collection_metadata = get_collection_metadata(collection_name)
+    search_params = json.dumps(collection_metadata['search_params'], sort_keys=True) if collection_metadata else None
+    search_key = (collection_name, search_params, collection_type, tenant_code or '', org_code or '', tuple(query_list),
+                  filter_expr or '', limit, bool(use_hybrid), vector_similarity_threshold, rrf_similarity_threshold,
+                  tuple(output_fields or ()), snippet_length or 0)
+    # 版本号在检索之前获取，检索期间发生的写入会使本次结果在下次查找时失效
+    version = None
+    if search_result_cache is not None:
+        version = search_result_cache.version(collection_type, tenant_code, org_code)
+        cached = search_result_cache.get(search_key, version)
+        if cached is not None:
+            logger.info(f"检索结果缓存命中: collection_type={collection_type}, tenant_code={tenant_code}, org_code={org_code}, 查询数量={len(query_list)}")
+            return cached
+
+    def run_search():
+        result = _search_from_collection_uncached(tenant_code, org_code, collection_type, query_list, filter_expr, limit,
+                                                  use_hybrid, vector_similarity_threshold, rrf_similarity_threshold,
+                                                  output_fields, snippet_length)
+        # 只缓存成功的结果（失败时返回(False, 错误信息)）
+        if search_result_cache is not None and isinstance(result, dict):
+            search_result_cache.put(search_key, version, result)
+        return result
+
+    if search_single_flight is None:
+        return run_search()
+    # key中带上版本号：写入之后发起的检索不会共享写入之前开始的检索结果
+    return search_single_flight.do((search_key, version), run_search)
+
+
+def _search_from_collection_uncached(tenant_code, org_code, collection_type, query_list, filter_expr='', limit=5, use_hybrid=False, vector_similarity_threshold=None, rrf_similarity_threshold=None,
+                                     output_fields=None, snippet_length=None):
+    """从全局collection搜索（不使用检索结果缓存）
     
     Args:
         tenant_code: 租户代码
@@ -631,6 +1422,8 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
         use_hybrid: 是否使用混合检索（向量+BM25），默认False
         vector_similarity_threshold: 向量相似度阈值，默认从配置文件读取
         rrf_similarity_threshold: RRF相似度阈值，默认从配置文件读取
+        output_fields: 返回的字段列表（总是包含id），默认返回全部字段
+        snippet_length: 大于0时content、answer字段只返回前snippet_length个字符
     
     Returns:
         检索结果字典，包含ids、distances、entities
@@ -639,34 +1432,20 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
     logger.info(f"调用方法:search_from_collection，参数为:tenant_code={tenant_code}, org_code={org_code}, collection_type={collection_type}, 查询数量={len(query_list)}, limit={limit}, use_hybrid={use_hybrid}, vector_similarity_threshold={vector_similarity_threshold}, rrf_similarity_threshold={rrf_similarity_threshold}")
     logger.info(f"查询内容: {query_list}, 过滤条件: {filter_expr}")
     
-    config_milvus_dic = config['milvus']
-    global_db_name, global_collection_qa_name, global_collection_doc_name = get_global_collections()
+    _, global_collection_qa_name, global_collection_doc_name = get_global_collections()
 
     assert collection_type in ('QA', 'DOC'), 'collection_type必须是[QA,DOC]之一'
 
-    # 连接到全局数据库
-    connections.connect(host=config_milvus_dic['host'], port=config_milvus_dic['port'], db_name=global_db_name)
-    exist_collection_list = utility.list_collections()
-
-    if collection_type == 'QA':
-        if global_collection_qa_name not in exist_collection_list:
-            logger.error(f"全局向量库[{global_collection_qa_name}]不存在")
-            return False, f"全局向量库[{global_collection_qa_name}]不存在"
-        collection = Collection(global_collection_qa_name)
-    else:
-        if global_collection_doc_name not in exist_collection_list:
-            logger.error(f"全局向量库[{global_collection_doc_name}]不存在")
-            return False, f"全局向量库[{global_collection_doc_name}]不存在"
-        collection = Collection(global_collection_doc_name)
+    # 使用缓存的collection句柄和字段元数据，检索路径上不再有额外的Milvus调用
+    collection_name = global_collection_qa_name if collection_type == 'QA' else global_collection_doc_name
+    collection = milvus_manager.get_collection(collection_name)
+    if collection is None:
+        logger.error(f"全局向量库[{collection_name}]不存在")
+        return False, f"全局向量库[{collection_name}]不存在"
+    collection_metadata = get_collection_metadata(collection_name)
 
     # 构建过滤表达式
-    base_filter = ""
-    if tenant_code and org_code:
-        base_filter = f"tenant_code == '{tenant_code}' && org_code == '{org_code}'"
-    elif tenant_code:
-        base_filter = f"tenant_code == '{tenant_code}'"
-    elif org_code:
-        base_filter = f"org_code == '{org_code}'"
+    base_filter = build_scope_filter(tenant_code, org_code)
     
     # 合并用户提供的过滤表达式
     if filter_expr:
@@ -677,55 +1456,71 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
     else:
         final_filter = base_filter
 
-    fields = [f.name for f in collection.schema.fields if f.name != 'embedding']
+    collection_fields = collection_metadata['output_fields']
+    fields = resolve_output_fields(collection_fields, output_fields)
+    # 低精度向量/量化索引的collection多取候选结果，用全精度向量重打分后再截取
+    rescore = collection_metadata['rescore']
+    oversample = config.get('vector_storage', {}).get('rescore', {}).get('oversample', 4) if rescore else 1
     
+    # 如果使用混合检索，且collection带有BM25稀疏向量字段，则由Milvus服务端完成
+    if use_hybrid and use_milvus_bm25():
+        if collection_metadata['has_sparse_bm25']:
+            logger.info("使用Milvus原生混合检索模式（向量检索 + Milvus BM25检索）")
+            return _milvus_hybrid_search(collection, query_list, final_filter, fields, limit,
+                                         rrf_similarity_threshold, collection_metadata['search_params'],
+                                         collection_metadata['embedding_dtype'], collection_fields, snippet_length)
+        logger.warning(f"collection[{collection.name}]没有BM25稀疏向量字段，回退到Python BM25混合检索")
+
     # 如果使用混合检索
     if use_hybrid:
         logger.info("使用混合检索模式（向量检索 + BM25检索）")
         
-        # 构建BM25索引
-        bm25, bm25_entities = _build_bm25_index(collection, final_filter, collection_type)
+        # 获取BM25索引（过滤条件只有tenant_code/org_code时复用常驻索引）
+        bm25_cacheable = not filter_expr or filter_expr == base_filter
+        bm25_index = _get_bm25_index(collection, collection_type, tenant_code, org_code, final_filter, bm25_cacheable)
         
+        # 每一路获取更多结果用于融合，候选数按过滤条件的选择性调整（BM25索引的文档数即检索范围的行数）
+        num_candidates = candidate_limit(collection, final_filter, limit,
+                                         scope_rows=len(bm25_index) if bm25_index is not None else None)
+
         ids = []
         distances = []
         entities = []
         
-        # 对每个查询进行混合检索
-        for query in query_list:
-            # 向量检索
-            logger.info(f"开始向量检索，查询: {query}")
-            query_embeddings = embedding_model.embed_documents([query])
-            search_params = {
-                'data': query_embeddings,
-                'anns_field': "embedding",
-                'param': config['search_params'],
-                'limit': limit * 5,  # 获取更多结果用于融合
-                'output_fields': fields
-            }
-            if final_filter:
-                search_params['expr'] = final_filter
-            vector_res = collection.search(**search_params)
-            
+        # 向量检索：所有查询一次批量计算向量，合并为多向量检索请求
+        logger.info(f"开始向量检索，查询数量={len(query_list)}")
+        query_embeddings = embed_queries(query_list)
+        # 候选只取id和分数（重打分时还需要文本字段），融合后的top-k再按主键取回字段
+        text_field = _bm25_text_field(collection_type)
+        search_params = {
+            'anns_field': "embedding",
+            'param': collection_metadata['search_params'],
+            'limit': min(num_candidates * oversample, MAX_SEARCH_TOPK),
+            'output_fields': [text_field] if rescore else []
+        }
+        if final_filter:
+            search_params['expr'] = final_filter
+        vector_res = _search_vectors(collection, to_storage_vectors(query_embeddings, collection_metadata['embedding_dtype']),
+                                     **search_params)
+
+        # BM25检索：所有查询在同一份BM25索引上依次打分
+        logger.info(f"开始BM25检索，查询数量={len(query_list)}")
+        bm25_results_list = _bm25_search_batch(bm25_index, query_list, num_candidates)
+
+        rrf_k = config.get('hybrid_search', {}).get('rrf_k', 20)
+        bm25_weight = config.get('hybrid_search', {}).get('bm25_weight', 1.2)
+        for query_embedding, hits, bm25_results in zip(query_embeddings, vector_res, bm25_results_list):
             vector_results = []
-            for hits in vector_res:
-                for hit in hits:
-                    ent = {}
-                    # 确保包含id字段（Milvus的Hit对象有id属性）
-                    ent['id'] = hit.id
-                    for f in fields:
-                        if f != 'id':  # id已经单独处理
-                            ent[f] = hit.get(f)
-                    ent['score'] = hit.score
-                    vector_results.append(ent)
-            
-            # BM25检索
-            logger.info(f"开始BM25检索，查询: {query}")
-            bm25_results = _bm25_search(bm25, bm25_entities, query, limit * 5)
+            for hit in hits:
+                # 确保包含id字段（Milvus的Hit对象有id属性）
+                ent = {'id': hit.id, 'score': hit.score}
+                if rescore:
+                    ent[text_field] = hit.get(text_field)
+                vector_results.append(ent)
+            if rescore:
+                vector_results = _rescore_candidates(query_embedding, vector_results, text_field)[:num_candidates]
             
             # RRF融合
-            logger.info(f"开始RRF融合结果")
-            rrf_k = config.get('hybrid_search', {}).get('rrf_k', 20)
-            bm25_weight = config.get('hybrid_search', {}).get('bm25_weight', 1.2)
             fused_results = _reciprocal_rank_fusion(vector_results, bm25_results, k=rrf_k, bm25_weight=bm25_weight)
             
             # 根据RRF相似度阈值过滤结果（如果提供了阈值）
@@ -736,7 +1531,7 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
                 filtered_results = fused_results
                 logger.info(f"RRF融合后共{len(fused_results)}条结果，未应用阈值过滤")
             
-            # 取top-k结果
+            # 取top-k结果，两路候选都只有id和分数，字段在_finalize_entities中按主键统一取回
             top_results = filtered_results[:limit]
             
             # 格式化结果
@@ -748,6 +1543,7 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
             ids.append(query_ids)
             distances.append(query_distances)
             entities.append(query_entities)
+        _finalize_entities(collection, entities, fields, collection_fields, snippet_length)
         
         ret_dic = {
             "ids": ids,
@@ -763,49 +1559,61 @@ def search_from_collection(tenant_code, org_code, collection_type, query_list, f
         # 纯向量检索（原有逻辑）
         logger.info("使用纯向量检索模式")
         logger.info(f"开始生成查询向量嵌入，查询数量={len(query_list)}")
-        query_embeddings = embedding_model.embed_documents(query_list)
+        query_embeddings = embed_queries(query_list)
         logger.info(f"查询向量嵌入生成完成，开始搜索，过滤条件: {final_filter}")
 
+        # 相似度阈值由Milvus范围检索完成，不满足阈值的结果（及其content等字段）不会返回
+        # 重打分时多取的候选只取id和文本字段，重打分截取后再按主键取回字段；否则直接取回投影后的字段
+        text_field = _bm25_text_field(collection_type)
+        candidate_fields = [text_field] if rescore else fields
         search_params = {
-            'data': query_embeddings,
             'anns_field': "embedding",
-            'param': config['search_params'],
-            'limit': limit,
-            'output_fields': fields
+            'param': range_search_params(collection_metadata['search_params'], vector_similarity_threshold, rescore),
+            'limit': min(limit * oversample, MAX_SEARCH_TOPK),
+            'output_fields': candidate_fields
         }
         if final_filter:
             search_params['expr'] = final_filter
-        res = collection.search(**search_params)
+        res = _search_vectors(collection, to_storage_vectors(query_embeddings, collection_metadata['embedding_dtype']),
+                              **search_params)
 
         ids = []
         distances = []
         entities = []
 
-        for hits in res:
+        for query_embedding, hits in zip(query_embeddings, res):
             query_ids = []
             query_distances = []
             ents = []
 
-            for rank, hit in enumerate(hits, start=1):
-                # 根据向量相似度阈值过滤结果（如果提供了阈值）
-                if vector_similarity_threshold is None or hit.score >= vector_similarity_threshold:
-                    ent = {}
-                    for f in fields:
+            candidates = []
+            for hit in hits:
+                ent = {'id': hit.id}
+                for f in candidate_fields:
+                    if f != 'id':
                         ent[f] = hit.get(f)
-                    ent['score'] = hit.score  # 向量相似度分数
+                ent['score'] = hit.score  # 向量相似度分数
+                candidates.append(ent)
+            if rescore:
+                candidates = _rescore_candidates(query_embedding, candidates, text_field)[:limit]
+
+            for rank, ent in enumerate(candidates, start=1):
+                # 根据向量相似度阈值过滤结果（如果提供了阈值）
+                if vector_similarity_threshold is None or ent['score'] >= vector_similarity_threshold:
                     ent['vector_rank'] = rank  # 向量排名
                     ents.append(ent)
-                    query_ids.append(hit.id)
+                    query_ids.append(ent['id'])
                     # 对于COSINE相似度，score就是相似度值，可以直接使用
-                    query_distances.append(hit.score)
+                    query_distances.append(ent['score'])
             
             if vector_similarity_threshold is not None:
-                logger.info(f"向量检索共{len(hits)}条结果，阈值过滤后剩余{len(ents)}条（阈值={vector_similarity_threshold}）")
+                logger.info(f"向量检索共{len(candidates)}条结果，阈值过滤后剩余{len(ents)}条（阈值={vector_similarity_threshold}）")
             else:
-                logger.info(f"向量检索共{len(hits)}条结果，未应用阈值过滤")
+                logger.info(f"向量检索共{len(candidates)}条结果，未应用阈值过滤")
             ids.append(query_ids)
             distances.append(query_distances)
             entities.append(ents)
+        _finalize_entities(collection, entities, fields, collection_fields, snippet_length)
 
         ret_dic = {
             "ids": ids,
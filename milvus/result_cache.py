@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+检索结果缓存模块
+以完整的检索参数为key，在进程内LRU缓存search_from_collection的结果。
+每个(collection_type, tenant_code, org_code)检索范围有一个写入版本号，写入/删除数据时递增覆盖该数据的范围的版本号，
+缓存项记录写入时的版本号，版本号变化后即失效，不依赖TTL。
+缓存同时受条数和近似字节数（结果序列化为JSON后的长度）限制，批量检索的大结果不会使内存无限增长
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('vector_db')
+
+
+class SearchResultCache:
+    """线程安全的检索结果缓存，按检索范围的写入版本号精确失效
+
+    版本号只在进程内维护，多进程部署时其他进程的写入依赖ttl_seconds过期来感知（0表示不过期）
+    """
+
+    # 每查询多少次输出一次命中率统计
+    STATS_LOG_INTERVAL = 1000
+
+    def __init__(self, max_entries=5000, ttl_seconds=0, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # key -> (结果, 版本号, 缓存时间, 近似字节数)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # (collection_type, tenant_code, org_code) -> 版本号
+        self._versions = {}
+        # 全局代数，通配删除（无法枚举受影响范围）时递增，使全部缓存项失效
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # 单个结果超过max_bytes/8而未缓存的次数
+        self.oversized = 0
+
+    def version(self, collection_type, tenant_code, org_code):
+        """返回检索范围当前的版本号，在执行检索之前获取，与结果一起传给put"""
+        with self._lock:
+            return self._generation, self._versions.get((collection_type, tenant_code or '', org_code or ''), 0)
+
+    def bump(self, collection_type, tenant_code, org_code):
+        """(tenant_code, org_code)的数据发生写入/删除后调用，参数为None表示通配
+
+        递增覆盖该数据的全部检索范围的版本号：(tenant_code, org_code)、(tenant_code, '')、('', org_code)、('', '')
+        （检索范围中的空字符串表示不限制）；通配时无法枚举受影响的范围，递增全局代数
+        """
+        with self._lock:
+            self.invalidations += 1
+            if collection_type is None or tenant_code is None or org_code is None:
+                self._generation += 1
+                return
+            for scope in {(tenant_code, org_code), (tenant_code, ''), ('', org_code), ('', '')}:
+                scope_key = (collection_type,) + scope
+                self._versions[scope_key] = self._versions.get(scope_key, 0) + 1
+
+    def invalidate(self):
+        """丢弃全部缓存项（collection重建等操作后调用）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation += 1
+            self.invalidations += 1
+
+    def get(self, key, version):
+        """返回缓存结果的副本，未命中、版本号已变化或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, entry_version, created_at, _ = entry
+                if entry_version == version and (not self.ttl_seconds or time.time() - created_at <= self.ttl_seconds):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    result = copy.deepcopy(result)
+                else:
+                    self._pop(key)
+                    result = None
+            else:
+                result = None
+            if result is None:
+                self.misses += 1
+            lookups = self.hits + self.misses
+        if lookups % self.STATS_LOG_INTERVAL == 0:
+            logger.info(f"检索结果缓存统计: {self.stats()}")
+        return result
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[3]
+
+    @staticmethod
+    def estimate_bytes(result):
+        """结果的近似字节数（按JSON序列化后的UTF-8长度估计）"""
+        return len(json.dumps(result, ensure_ascii=False, default=str).encode('utf-8'))
+
+    def put(self, key, version, result):
+        """缓存检索结果，version为检索之前获取的版本号（检索期间有写入时该结果不会被命中）
+
+        单个结果超过max_bytes的1/8时不缓存（如多查询的批量检索结果），避免挤出大量常规结果
+        """
+        size = self.estimate_bytes(result)
+        if self.max_bytes and size > self.max_bytes // 8:
+            with self._lock:
+                self.oversized += 1
+            return
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (result, version, time.time(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                _, entry = self._entries.popitem(last=False)
+                self._bytes -= entry[3]
+                self.evictions += 1
+
+    def stats(self):
+        """命中率统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self._bytes,
+                'oversized': self.oversized,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+并发请求合并（single-flight）模块
+同一时刻key相同的多个调用只有第一个（leader）真正执行，其余调用等待leader的结果并共享，
+用于大量用户同时发起相同检索时避免重复的向量计算、Milvus检索和BM25打分
+"""
+import copy
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger('vector_db')
+
+
+class SingleFlight:
+    """按key合并进行中的调用，执行结束后即移除（不缓存结果）
+
+    leader抛出异常时，等待该key的调用收到同一个异常；
+    copy_shared为True时等待者拿到结果的深拷贝，避免调用方修改共享的结果
+    """
+
+    def __init__(self, name, copy_shared=False):
+        self.name = name
+        self.copy_shared = copy_shared
+        # key -> 进行中调用的Future
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """执行fn()，已有相同key的调用在进行中时等待其结果"""
+        return self.do_many([key], lambda keys: [fn()])[0]
+
+    def do_many(self, keys, fn):
+        """批量版本：对没有进行中调用的key执行一次fn(key列表)（返回与之一一对应的结果列表），
+        其余key等待进行中的调用，返回与keys一一对应的结果（keys中重复的key只计算一次）
+        """
+        led = []
+        futures = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._calls.get(key)
+                if future is None:
+                    future = Future()
+                    self._calls[key] = future
+                    led.append(key)
+                else:
+                    self.shared += 1
+                futures[key] = future
+            self.executed += len(led)
+        if len(led) < len(futures):
+            logger.info(f"[{self.name}]合并请求：{len(futures) - len(led)}个key等待进行中的相同请求")
+
+        if led:
+            try:
+                results = fn(led)
+                if len(results) != len(led):
+                    raise RuntimeError(f"[{self.name}]返回结果数{len(results)}与请求数{len(led)}不一致")
+                for key, result in zip(led, results):
+                    futures[key].set_result(result)
+            except BaseException as e:
+                for key in led:
+                    if not futures[key].done():
+                        futures[key].set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    for key in led:
+                        self._calls.pop(key, None)
+
+        led_keys = set(led)
+        results = []
+        for key in keys:
+            result = futures[key].result()
+            if self.copy_shared and key not in led_keys:
+                result = copy.deepcopy(result)
+            results.append(result)
+        return results
+
+    def stats(self):
+        """合并统计：executed为实际执行的key数，shared为等待共享结果的key数"""
+        with self._lock:
+            return {'in_flight': len(self._calls), 'executed': self.executed, 'shared': self.shared}
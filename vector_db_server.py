@@ -132,46 +132,48 @@ def add_multi_document():
     
     success_count = 0
     failed_count = 0
-    for idx, doc_url in enumerate(multi_doc_urls):
-        try:
-            # 验证URL格式
+    # 整批文档写入完成后再统一flush
+    with flush_scheduler.deferred():
+        for idx, doc_url in enumerate(multi_doc_urls):
             try:
-                parsed_url = urlparse(doc_url)
-                if not parsed_url.scheme or not parsed_url.netloc:
-                    logger.error(f"文档URL格式不正确: {doc_url}")
+                # 验证URL格式
+                try:
+                    parsed_url = urlparse(doc_url)
+                    if not parsed_url.scheme or not parsed_url.netloc:
+                        logger.error(f"文档URL格式不正确: {doc_url}")
+                        failed_count += 1
+                        continue
+                except Exception as e:
+                    logger.error(f"文档URL格式验证失败: {doc_url}, 错误: {repr(e)}")
                     failed_count += 1
                     continue
-            except Exception as e:
-                logger.error(f"文档URL格式验证失败: {doc_url}, 错误: {repr(e)}")
-                failed_count += 1
-                continue
             
-            is_succ, content = extract_content_from_file(doc_url, ocr_config=ocr_config)
-            if not is_succ:
-                logger.error(f"解析文档[{doc_url}]失败:{content}")
-                failed_count += 1
-                continue
+                is_succ, content = extract_content_from_file(doc_url, ocr_config=ocr_config)
+                if not is_succ:
+                    logger.error(f"解析文档[{doc_url}]失败:{content}")
+                    failed_count += 1
+                    continue
             
-            # 从请求参数中获取文档名称
-            doc_name = doc_names[idx].strip() if idx < len(doc_names) else ''
-            if not doc_name:
-                logger.error(f"文档名称为空，索引: {idx}")
-                failed_count += 1
-                continue
+                # 从请求参数中获取文档名称
+                doc_name = doc_names[idx].strip() if idx < len(doc_names) else ''
+                if not doc_name:
+                    logger.error(f"文档名称为空，索引: {idx}")
+                    failed_count += 1
+                    continue
             
-            is_succ, msg = insert_docs_to_collection(tenant_code, org_code, doc_name_list=[doc_name],
-                                                     doc_content_list=[content], source_list=[doc_url],
-                                                     metadata_list=[{}])
-            if not is_succ:
-                logger.error(f"插入文档[{doc_url}]到向量库失败:{msg}")
+                is_succ, msg = insert_docs_to_collection(tenant_code, org_code, doc_name_list=[doc_name],
+                                                         doc_content_list=[content], source_list=[doc_url],
+                                                         metadata_list=[{}])
+                if not is_succ:
+                    logger.error(f"插入文档[{doc_url}]到向量库失败:{msg}")
+                    failed_count += 1
+                    continue
+                success_count += 1
+            except Exception:
+                import traceback
+                logger.exception(f"插入文档[{doc_url}]到向量库异常: {traceback.format_exc()}")
                 failed_count += 1
                 continue
-            success_count += 1
-        except Exception:
-            import traceback
-            logger.exception(f"插入文档[{doc_url}]到向量库异常: {traceback.format_exc()}")
-            failed_count += 1
-            continue
     
     if failed_count > 0:
         return jsonify({'status': 'fail', 'code': 400,
@@ -217,10 +219,18 @@ def search_from_vector_db():
     # 向量库服务接口可以传递阈值，如果不传则使用None（不进行阈值过滤）
     vector_similarity_threshold = data.get('vector_similarity_threshold', None)
     rrf_similarity_threshold = data.get('rrf_similarity_threshold', None)
+    # 结果字段投影和长文本截断，不传则返回全部字段的完整内容
+    output_fields = data.get('output_fields', None)
+    snippet_length = data.get('snippet_length', None)
 
     if not query:
         return jsonify({'status': 'fail', 'msg': '搜索数据不能为空', 'code': 400, 'data': ''})
 
+    if output_fields is not None and (not isinstance(output_fields, list) or not all(isinstance(f, str) for f in output_fields)):
+        return jsonify({'status': 'fail', 'msg': 'output_fields必须是字段名列表', 'code': 400, 'data': ''})
+    if snippet_length is not None and (isinstance(snippet_length, bool) or not isinstance(snippet_length, int) or snippet_length < 0):
+        return jsonify({'status': 'fail', 'msg': 'snippet_length必须是非负整数', 'code': 400, 'data': ''})
+
     if not collection_type:
         return jsonify({'status': 'fail', 'msg': 'collect_type不能为空', 'code': 400, 'data': ''})
 
@@ -236,7 +246,8 @@ def search_from_vector_db():
                                      collection_type=collection_type, query_list=[query], 
                                      filter_expr=filter_expr, limit=limit, use_hybrid=use_hybrid,
                                      vector_similarity_threshold=vector_similarity_threshold,
-                                     rrf_similarity_threshold=rrf_similarity_threshold)
+                                     rrf_similarity_threshold=rrf_similarity_threshold,
+                                     output_fields=output_fields, snippet_length=snippet_length)
 
         logger.info(f"从向量库[{collection_name}]查询成功，使用混合检索: {use_hybrid}")
     except Exception:
@@ -246,6 +257,68 @@ def search_from_vector_db():
     return jsonify({'status': 'success', 'code': 200, 'msg': '从向量库查询成功', 'data': res})
 
 
+@vector_db_bp.route('/vector_db_service/batch_search', methods=['POST'])
+def batch_search():
+    """批量检索：一次请求包含多个查询（离线评测、缓存预热等），查询向量批量计算并合并为多向量检索
+
+    请求参数与search_from_vector_db相同，query替换为queries（查询文本列表）；
+    返回的ids、distances、entities与queries一一对应
+    """
+    data = request.get_json()
+    queries = data.get('queries', [])
+    # 先校验queries再记录日志（日志中需要len(queries)）
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({'status': 'fail', 'msg': 'queries必须是非空的查询文本列表', 'code': 400, 'data': ''})
+    logger.info(f'批量检索，请求参数: tenant_code={data.get("tenant_code", "")}, org_code={data.get("org_code", "")}, 查询数量={len(queries)}, collection_type={data.get("collection_type", "")}, limit={data.get("limit", 5)}, use_hybrid={data.get("use_hybrid", False)}')
+    tenant_code = data.get('tenant_code', '')
+    org_code = data.get('org_code', '')
+    collection_type = data.get('collection_type', '')
+    filter_expr = data.get('filter_expr', '')
+    limit = data.get('limit', 5)
+    use_hybrid = data.get('use_hybrid', False)
+    vector_similarity_threshold = data.get('vector_similarity_threshold', None)
+    rrf_similarity_threshold = data.get('rrf_similarity_threshold', None)
+    # 结果字段投影和长文本截断，不传则返回全部字段的完整内容
+    output_fields = data.get('output_fields', None)
+    snippet_length = data.get('snippet_length', None)
+    max_queries = config.get('batch_search', {}).get('max_queries', 500)
+
+    if len(queries) > max_queries:
+        return jsonify({'status': 'fail', 'msg': f'单次批量检索最多{max_queries}个查询', 'code': 400, 'data': ''})
+    if collection_type not in ('QA', 'DOC'):
+        return jsonify({'status': 'fail', 'msg': 'collection_type必须是[QA,DOC]之一', 'code': 400, 'data': ''})
+    if output_fields is not None and (not isinstance(output_fields, list) or not all(isinstance(f, str) for f in output_fields)):
+        return jsonify({'status': 'fail', 'msg': 'output_fields必须是字段名列表', 'code': 400, 'data': ''})
+    if snippet_length is not None and (isinstance(snippet_length, bool) or not isinstance(snippet_length, int) or snippet_length < 0):
+        return jsonify({'status': 'fail', 'msg': 'snippet_length必须是非负整数', 'code': 400, 'data': ''})
+
+    try:
+        res = search_from_collection(tenant_code=tenant_code, org_code=org_code,
+                                     collection_type=collection_type, query_list=queries,
+                                     filter_expr=filter_expr, limit=limit, use_hybrid=use_hybrid,
+                                     vector_similarity_threshold=vector_similarity_threshold,
+                                     rrf_similarity_threshold=rrf_similarity_threshold,
+                                     output_fields=output_fields, snippet_length=snippet_length)
+        logger.info(f"批量检索成功，查询数量={len(queries)}，使用混合检索: {use_hybrid}")
+    except Exception:
+        import traceback
+        logger.exception(f"批量检索异常: {traceback.format_exc()}")
+        return jsonify({'status': 'fail', 'msg': traceback.format_exc(), 'code': 400})
+    return jsonify({'status': 'success', 'code': 200, 'msg': '批量检索成功', 'data': res})
+
+
+@vector_db_bp.route('/vector_db_service/cache_stats', methods=['GET'])
+def cache_stats():
+    """检索结果缓存、查询向量缓存的命中率及并发请求合并统计（未启用的为null）"""
+    data = {
+        'search_result_cache': search_result_cache.stats() if search_result_cache is not None else None,
+        'query_embedding_cache': query_embedding_cache.stats() if query_embedding_cache is not None else None,
+        'search_single_flight': search_single_flight.stats() if search_single_flight is not None else None,
+        'embedding_single_flight': embedding_single_flight.stats() if embedding_single_flight is not None else None
+    }
+    return jsonify({'status': 'success', 'code': 200, 'msg': '获取缓存统计成功', 'data': data})
+
+
 # ==================== 问答对相关接口 ====================
 
 @vector_db_bp.route('/vector_db_service/download_qa_template', methods=['GET'])
@@ -356,10 +429,12 @@ def add_qa_from_template():
         question_list, answers_list, source_list = load_qa_template(temp_file_path)
         metadata_list = [{} for q in question_list]
         
-        # 插入到向量库
-        is_succ, msg = insert_qa_to_collection(tenant_code, org_code, question_list=question_list,
-                                               answer_list=answers_list, source_list=source_list,
-                                               metadata_list=metadata_list)
+        # 插入到向量库：问题向量按长度分桶批量计算（启用嵌入进程池且条数达到min_texts时分发到工作进程），
+        # 整个模板写入完成后再统一flush
+        with flush_scheduler.deferred():
+            is_succ, msg = insert_qa_to_collection(tenant_code, org_code, question_list=question_list,
+                                                   answer_list=answers_list, source_list=source_list,
+                                                   metadata_list=metadata_list)
         if not is_succ:
             return jsonify({'status': 'fail', 'msg': msg, 'code': 400, 'data': ''})
         